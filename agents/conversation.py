@@ -0,0 +1,149 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from agents.parcel_parser import KNOWN_CARRIERS, OPEN_STATUSES, names_parcel_ids
+from models.a2a import A2AMessage, MessagePart
+from utils.cache import build_cache
+
+# Multi-turn memory per contextId: the parcels the conversation is about, a summary of the
+# rows last reported and a bounded message history. Follow-ups such as "and the DHL one?"
+# or "any news on those?" are resolved against it locally, without an extraction call.
+
+CONTEXT_STORE_SIZE = int(os.getenv("OMI_CONTEXT_STORE_SIZE", "5000"))
+CONTEXT_TTL = float(os.getenv("OMI_CONTEXT_TTL", "3600"))
+CONTEXT_HISTORY_LENGTH = int(os.getenv("OMI_CONTEXT_HISTORY_LENGTH", "10"))
+# Agent replies are kept in the history up to this many characters
+CONTEXT_REPLY_CHARS = int(os.getenv("OMI_CONTEXT_REPLY_CHARS", "1000"))
+# Larger results (account-wide reports) are not kept for follow-ups
+CONTEXT_MAX_PARCELS = int(os.getenv("OMI_CONTEXT_MAX_PARCELS", "500"))
+
+conversation_store = build_cache("conversation", CONTEXT_STORE_SIZE, CONTEXT_TTL)
+
+STATUS_WORDS = {
+    "delivered": "delivered",
+    "in transit": "in_transit",
+    "in_transit": "in_transit",
+    "pending": "pending",
+    "cancelled": "cancelled",
+    "canceled": "cancelled",
+    "lost": "lost",
+}
+# "Is it delivered now?" asks whether the parcels have a status, so the status is not a
+# filter; "which ones are delivered?" asks for the parcels that do
+YES_NO_QUESTION = re.compile(r"^\s*(?:is|are|was|were|has|have|had|did|does|do|will|can|could)\b", re.IGNORECASE)
+# "Are any of them delayed?": keep the parcels still on their way; the report says how late they are
+DELAY_PATTERN = re.compile(r"\b(?:delayed|late|overdue|stuck|stalled)\b", re.IGNORECASE)
+ORDINALS = {"first": 0, "second": 1, "third": 2, "fourth": 3, "fifth": 4, "last": -1}
+ORDINAL_PATTERN = re.compile(r"\b(first|second|third|fourth|fifth|last)\b", re.IGNORECASE)
+# Pointing back at the previous answer as a whole
+REFERENCE_PATTERN = re.compile(
+    r"\b(?:them|those|these|it|they|again|same|others?|ones?|both|any (?:news|update)|still|now)\b",
+    re.IGNORECASE,
+)
+
+ROW_FIELDS = ("parcel_id", "carrier", "status")
+
+
+def _summary(row: Dict[str, Any]) -> Dict[str, Any]:
+    location = row.get("location") or {}
+    return {
+        **{field: row.get(field) for field in ROW_FIELDS},
+        "city": location.get("city"),
+        "country": location.get("country"),
+    }
+
+
+def load_context(context_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    return conversation_store.get(context_id) if context_id else None
+
+
+def _mentions(text: str, phrase: Optional[str]) -> bool:
+    return bool(phrase) and re.search(rf"\b{re.escape(phrase.casefold())}\b", text) is not None
+
+
+def resolve_follow_up(message: str, context: Optional[Dict[str, Any]]) -> Optional[List[Dict[str, str]]]:
+    """
+    Resolves a follow-up against the parcels of the previous turn. Carrier, status, city
+    or country mentions and ordinals ("the second one") narrow the list; a bare reference
+    ("any update on those?") returns all of it; a yes/no question about a status ("is it
+    delivered now?") is a reference, not a filter. Returns None when the message names
+    parcel IDs of its own (including digit-only tracking numbers) or does not refer back
+    at all, so it goes through normal extraction.
+    """
+    if not context or not context.get("parcels") or not message:
+        return None
+    # Covers everything parse_parcel_message accepts, which always has a keyed or known ID
+    if names_parcel_ids(message):
+        return None
+    text = message.casefold()
+    rows = context.get("rows") or []
+    picked = list(rows)
+    narrowed = False
+
+    carriers = {row["carrier"].casefold() for row in rows if row.get("carrier")} | KNOWN_CARRIERS
+    named = {carrier for carrier in carriers if _mentions(text, carrier)}
+    if named:
+        picked = [row for row in picked if (row.get("carrier") or "").casefold() in named]
+        narrowed = True
+
+    statuses = {status for word, status in STATUS_WORDS.items() if _mentions(text, word)}
+    if statuses and not YES_NO_QUESTION.match(text):
+        picked = [row for row in picked if row.get("status") in statuses]
+        narrowed = True
+    elif DELAY_PATTERN.search(text):
+        picked = [row for row in picked if row.get("status") in OPEN_STATUSES]
+        narrowed = True
+
+    places = {
+        place.casefold() for row in rows for place in (row.get("city"), row.get("country"))
+        if place and _mentions(text, place)
+    }
+    if places:
+        picked = [row for row in picked if {(row.get("city") or "").casefold(), (row.get("country") or "").casefold()} & places]
+        narrowed = True
+
+    ordinal = ORDINAL_PATTERN.search(text)
+    if ordinal:
+        position = ORDINALS[ordinal.group(1).lower()]
+        picked = [picked[position]] if -len(picked) <= position < len(picked) else []
+        narrowed = True
+
+    if narrowed:
+        return [{"parcel_id": row["parcel_id"], "carrier": row.get("carrier") or ""} for row in picked]
+    if REFERENCE_PATTERN.search(text):
+        return context["parcels"]
+    return None
+
+
+def remember_turn(
+    context_id: Optional[str],
+    client_payload: List[A2AMessage],
+    reply_text: str,
+    structured_output: List[Dict[str, str]],
+    db_result: List[Dict[str, Any]],
+    follow_up: bool = False,
+) -> List[A2AMessage]:
+    """
+    Records one exchange for the context and returns the updated history (oldest first).
+    A new inquiry replaces the parcels the conversation is about; a follow-up keeps them
+    (so "the DHL one" and then "the UPS one" both pick from the same list) and only
+    refreshes the rows it reported. Without a context_id the history is just this turn.
+    """
+    context = load_context(context_id) or {"history": []}
+    reply = reply_text if len(reply_text) <= CONTEXT_REPLY_CHARS else reply_text[:CONTEXT_REPLY_CHARS].rstrip() + " ..."
+    turn = [message.model_dump(mode="json") for message in client_payload if message.role == "user"][-1:]
+    turn.append(A2AMessage(role="agent", parts=[MessagePart(kind="text", text=reply)]).model_dump(mode="json"))
+    history = (context["history"] + turn)[-CONTEXT_HISTORY_LENGTH:]
+
+    if context_id:
+        if follow_up and context.get("rows"):
+            refreshed = {row["parcel_id"]: _summary(row) for row in db_result}
+            context = {**context, "rows": [refreshed.get(row["parcel_id"], row) for row in context["rows"]]}
+        elif structured_output and len(db_result) <= CONTEXT_MAX_PARCELS:
+            context = {
+                "parcels": [{"parcel_id": item.get("parcel_id"), "carrier": item.get("carrier") or ""} for item in structured_output],
+                "rows": [_summary(row) for row in db_result],
+            }
+        conversation_store.set(context_id, {**context, "history": history})
+    return [A2AMessage.model_validate(message) for message in history]
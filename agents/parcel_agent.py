@@ -1,23 +1,71 @@
+import asyncio
 import logging
 import json
 import os
+import re
+import time
 from dotenv import load_dotenv
 from uuid import uuid4
-from typing import List, Optional, Dict, Any
-from google import genai
-from google.genai.errors import APIError
+from typing import AsyncIterator, List, Optional, Dict, Any
 import datetime 
 
-from utils.retrieve_db import retrieve_parcel_meta_by_id
+from config.llm import GEMINI_MODEL, get_genai_client
+from config.log import setup_logging
+from agents.conversation import load_context, remember_turn, resolve_follow_up
+from agents.parcel_parser import parse_account_query, parse_parcel_message, scan_parcel_ids
+from agents.report_renderer import REPORT_MODE, iter_report_lines, render_parcel_line, render_template_report
+from utils.retrieve_db import iter_merchant_parcels, retrieve_parcel_meta_by_id
+from utils import parcel_cache, report_snapshots
+from utils.parcel_events import attach_recent_hops
+from utils.cache import build_cache, cache_key
+from utils.single_flight import build_single_flight
+from utils.llm_gateway import LLMAPIError, LLMUnavailableError, is_transient, llm_gateway
+from utils.metrics import failures, llm_call_duration, record_llm_usage, stage_duration
 from models.a2a import (
     A2AMessage, TaskResult, TaskStatus, Artifact,
-    MessagePart, MessageConfiguration
+    MessagePart, MessageConfiguration,
+    TaskStatusUpdateEvent, TaskArtifactUpdateEvent,
 )
 
 
 load_dotenv()
-# Set up basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Set up level-gated logging (LOG_LEVEL / LOG_FORMAT)
+setup_logging()
+
+# Raw message -> structured parcel list, and db_result fingerprint -> rendered report
+extraction_cache = build_cache(
+    "extraction",
+    maxsize=int(os.getenv("OMI_EXTRACTION_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("OMI_EXTRACTION_CACHE_TTL", "900")),
+)
+report_cache = build_cache(
+    "report",
+    maxsize=int(os.getenv("OMI_REPORT_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("OMI_REPORT_CACHE_TTL", "300")),
+)
+
+# Large parcel lists are reported in bounded chunks rendered concurrently
+REPORT_CHUNK_SIZE = int(os.getenv("OMI_REPORT_CHUNK_SIZE", "25"))
+REPORT_CHUNK_CONCURRENCY = int(os.getenv("OMI_REPORT_CHUNK_CONCURRENCY", "4"))
+REPORT_CHUNK_RETRIES = int(os.getenv("OMI_REPORT_CHUNK_RETRIES", "2"))
+REPORT_RETRY_BACKOFF_SECONDS = float(os.getenv("OMI_REPORT_RETRY_BACKOFF_SECONDS", "0.5"))
+
+# Last N movement events attached to each row (recent_hops) for the report; 0 turns it off
+REPORT_HOPS = int(os.getenv("OMI_REPORT_HOPS", "0"))
+
+# Upper bound on an account-wide ("all my open parcels") report
+ACCOUNT_MAX_PARCELS = int(os.getenv("OMI_ACCOUNT_MAX_PARCELS", "5000"))
+MISSING_MERCHANT_TEXT = (
+    "Error: An account-wide inquiry needs a merchant ID "
+    "(message metadata merchant_id, or 'merchant: <ID>' in the text)."
+)
+
+NO_CHANGES_TEXT = "No parcel has changed since the last update."
+
+# Identical work arriving at the same time (dashboard + Telex bot) shares one upstream call
+extraction_flight = build_single_flight("extraction")
+retrieval_flight = build_single_flight("retrieval")
+report_flight = build_single_flight("report")
 
 
 PARCEL_INPUT_SCHEMA = {
@@ -34,6 +82,19 @@ PARCEL_INPUT_SCHEMA = {
 }
 
 
+NEXT_STEP_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "parcel_id": {"type": "string"},
+            "next_step": {"type": "string", "description": "Action required / next step, maximum 7 words."}
+        },
+        "required": ["parcel_id", "next_step"],
+    }
+}
+
+
 # --- Prompt Templates ---
 
 # Prompt for JSON Conversion (Simplified, as schema enforces structure)
@@ -75,6 +136,16 @@ Where:
 Provide ONLY the header and the bulleted list. DO NOT include any explanatory text, commentary, or conversational prose.
 """
 
+# Prompt for the hybrid report mode: only the free-text next step is left to the LLM
+
+GEMINI_NEXT_STEP_PROMPT = """
+You are a logistics assistant for a dropshipper. For every parcel inside the <PARCELS> tags, write the ACTION REQUIRED/NEXT STEP as a very short (maximum 7-word) instruction, based on its status, facility and estimated arrival.
+
+<PARCELS>
+{{parcels}}
+</PARCELS>
+"""
+
 
 def json_serial(obj):
     """
@@ -88,91 +159,630 @@ def json_serial(obj):
     raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
+def _drop_nulls(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _drop_nulls(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_drop_nulls(item) for item in value]
+    return value
 
-async def process_message(client_payload: List[A2AMessage], context_id: Optional[str] = None, task_id: Optional[str] = None, config: Optional[MessageConfiguration] = None, db_session = None):
-    # API Client Initialization
-    api_key = os.getenv("GOOGLE_GEMENI_AI_KEY")
-    if not api_key:
-        logging.error("GEMINI_API_KEY is not set in environment variables.")
-        raise ValueError("API key missing.")
 
-    client = genai.Client(api_key=api_key)
+def compact_json(value: Any) -> str:
+    """Prompt payload serialization: no indentation and no null fields, to cut tokens."""
+    return json.dumps(_drop_nulls(value), separators=(",", ":"), default=json_serial)
 
-    # Extract Payload Message
-    payload_message = ""
-    for payload in client_payload:
-        for message in payload.parts:
-            if message.text:
-                payload_message = message.text
-                logging.info(f"Received payload: {payload_message}")
-                break
-        if payload_message:
-            break
 
-    if not payload_message:
-        logging.warning("No text message found in client payload.")
-        return TaskResult(id=str(uuid4()), status=TaskStatus(state="failed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text="Error: Input message was empty.")]))),
 
-    #  First Gemini Call: Data Serialization (JSON-enforced)
+def _failed_task(text: str, context_id: Optional[str] = None) -> TaskResult:
+    """Builds a failed TaskResult carrying a single agent text message."""
+    return TaskResult(
+        id=str(uuid4()),
+        contextId=context_id or str(uuid4()),
+        status=TaskStatus(state="failed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text=text)])),
+    )
+
+
+async def generate_content(stage: str, contents: str, config: Optional[Dict[str, Any]] = None):
+    """
+    One generate_content call admitted through the LLM gateway under `stage` (which is
+    also the metrics purpose). Raises LLMUnavailableError when the gateway sheds it.
+    """
+    client = get_genai_client()
+
+    async def attempt():
+        with llm_call_duration.time(purpose=stage):
+            return await client.aio.models.generate_content(model=GEMINI_MODEL, contents=contents, config=config)
+
+    response = await llm_gateway.call(stage, attempt)
+    record_llm_usage(stage, response)
+    return response
+
+
+async def extract_parcels(payload_message: str) -> List[Dict[str, str]]:
+    """
+    First Gemini call: converts the raw inquiry text into the PARCEL_INPUT_SCHEMA list.
+    Raises LLMAPIError / json.JSONDecodeError / LLMUnavailableError for the caller to handle.
+    """
     final_gemini_prompt = GEMINI_CLEANUP_PROMPT.replace(
         "{{DATA_STRING}}", payload_message
     )
-    
+    logging.debug("Calling Gemini for JSON serialization (Schema Enforced)...")
+    response = await generate_content(
+        "extraction",
+        final_gemini_prompt,
+        {
+            "response_mime_type": "application/json",
+            "response_schema": PARCEL_INPUT_SCHEMA,
+        },
+    )
+    return json.loads(response.text.strip())
+
+
+def normalize_message(payload_message: str) -> str:
+    """Collapses whitespace so trivially different copies of an inquiry share a cache entry."""
+    return re.sub(r"\s+", " ", payload_message).strip()
+
+
+def report_fingerprint(db_result: List[Dict[str, Any]], report_mode: str) -> str:
+    """A report only needs regenerating when some parcel's last_update moves."""
+    return cache_key(report_mode, [(row.get("parcel_id"), row.get("last_update")) for row in db_result])
+
+
+async def resolve_parcels(payload_message: str) -> List[Dict[str, str]]:
+    """
+    Tries the local fast-path parser first, then the extraction cache, and only
+    calls Gemini when both miss. If the LLM gateway sheds the call, the message is
+    scanned locally for ID-like tokens instead.
+    """
+    structured_output = parse_parcel_message(payload_message)
+    if structured_output is not None:
+        return structured_output
+
+    key = cache_key(normalize_message(payload_message))
+    structured_output = extraction_cache.get(key)
+    if structured_output is not None:
+        logging.debug("Extraction cache hit, skipping Gemini serialization")
+        return structured_output
+
+    async def _extract_and_cache():
+        result = await extract_parcels(payload_message)
+        extraction_cache.set(key, result)
+        return result
+
+    try:
+        return await extraction_flight.do(key, _extract_and_cache)
+    except LLMUnavailableError as e:
+        logging.warning(f"Extraction LLM unavailable ({e}), scanning the message for parcel IDs")
+        failures.inc(type="llm_degraded")
+        return scan_parcel_ids(payload_message)
+
+
+async def fetch_parcels(structured_output: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Read-through retrieval: parcels in the parcel cache never reach the database and
+    the misses are read in one lookup, coalesced across concurrent requests for the same
+    set. The shared lookup borrows pooled connections only for its queries, so followers
+    never depend on the leader's request scope. Rows come back in the order the parcels
+    were asked for.
+    """
+    parcel_ids = list(dict.fromkeys(
+        item.get("parcel_id").strip()
+        for item in structured_output
+        if item and item.get("parcel_id") and item.get("parcel_id").strip()
+    ))
+    if not parcel_ids:
+        return []
+
+    rows, misses = parcel_cache.lookup(parcel_ids)
+    if misses:
+        started_generation = parcel_cache.generation()
+        query = [{"parcel_id": parcel_id} for parcel_id in misses]
+
+        async def _retrieve():
+            fetched = await retrieve_parcel_meta_by_id(query)
+            if REPORT_HOPS:
+                fetched = await attach_recent_hops(fetched, REPORT_HOPS)
+            parcel_cache.remember(misses, fetched, started_generation)
+            return fetched
+
+        fetched = await retrieval_flight.do(cache_key(sorted(misses)), _retrieve)
+        rows.update((parcel_cache.parcel_key(row["parcel_id"]), row) for row in fetched)
+
+    ordered = []
+    for key in dict.fromkeys(parcel_cache.parcel_key(parcel_id) for parcel_id in parcel_ids):
+        if rows.get(key) is not None:
+            ordered.append(rows[key])
+    return ordered
+
+
+def _merchant_id(client_payload: List[A2AMessage]) -> Optional[str]:
+    for payload in client_payload:
+        merchant_id = (payload.metadata or {}).get("merchant_id")
+        if merchant_id:
+            return str(merchant_id)
+    return None
+
+
+def account_query_for(client_payload: List[A2AMessage], payload_message: str) -> Optional[Dict[str, Any]]:
+    """The account-wide query the inquiry asks for, or None for an explicit-ID inquiry."""
+    return parse_account_query(payload_message, _merchant_id(client_payload))
+
+
+async def fetch_account_parcels(account_query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Rows for an account-wide inquiry, read page by page from the merchant index (no
+    parcel IDs go through the LLM) and capped at ACCOUNT_MAX_PARCELS. The rows also
+    warm the parcel cache for follow-up questions about individual parcels.
+    """
+    arrival_before = datetime.datetime.utcnow() if account_query.get("overdue") else None
+    started_generation = parcel_cache.generation()
+    rows: List[Dict[str, Any]] = []
+    async for page in iter_merchant_parcels(account_query["merchant_id"], account_query["statuses"], arrival_before):
+        if REPORT_HOPS:
+            page = await attach_recent_hops(page, REPORT_HOPS)
+        rows.extend(page)
+        if len(rows) >= ACCOUNT_MAX_PARCELS:
+            logging.warning(
+                f"Account query {account_query['scope']!r} for merchant {account_query['merchant_id']} "
+                f"truncated to {ACCOUNT_MAX_PARCELS} parcels"
+            )
+            rows = rows[:ACCOUNT_MAX_PARCELS]
+            break
+    parcel_cache.remember([row["parcel_id"] for row in rows], rows, started_generation)
+    return rows
+
+
+def delta_requested(client_payload: List[A2AMessage], context_id: Optional[str]) -> bool:
+    """
+    Delta replies compare against the snapshot saved under the context's id (the one the
+    reply returns). Message metadata {"report": "delta"} or {"report": "full"} overrides
+    the OMI_DELTA_REPORTS default.
+    """
+    if not context_id:
+        return False
+    for payload in client_payload:
+        report = (payload.metadata or {}).get("report")
+        if report in ("delta", "full"):
+            return report == "delta"
+    return report_snapshots.DELTA_REPORTS
+
+
+async def phrase_next_steps(db_result: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Hybrid mode: one batched Gemini call returning {parcel_id: next_step}."""
+    parcels = [
+        {
+            "parcel_id": row.get("parcel_id"),
+            "status": row.get("status"),
+            "facility": (row.get("location") or {}).get("facility"),
+            "estimated_arrival": (row.get("movement") or {}).get("estimated_arrival"),
+        }
+        for row in db_result
+    ]
+    logging.debug("Calling Gemini for next-step phrasing...")
+    response = await generate_content(
+        "next_step",
+        GEMINI_NEXT_STEP_PROMPT.replace("{{parcels}}", compact_json(parcels)),
+        {
+            "response_mime_type": "application/json",
+            "response_schema": NEXT_STEP_SCHEMA,
+        },
+    )
+    return {
+        item["parcel_id"]: item["next_step"].strip()
+        for item in json.loads(response.text.strip())
+        if item.get("parcel_id") and item.get("next_step")
+    }
+
+
+async def generate_report(db_result: List[Dict[str, Any]], report_mode: str = REPORT_MODE) -> str:
+    """
+    Second step: turns the DB rows into the dropshipper summary report.
+    See agents/report_renderer.REPORT_MODES for the available modes.
+    """
+    if report_mode == "template" or not db_result:
+        return render_template_report(db_result)
+
+    key = report_fingerprint(db_result, report_mode)
+    cached_report = report_cache.get(key)
+    if cached_report is not None:
+        logging.debug("Report cache hit, no parcel changed since the last summary")
+        return cached_report
+
+    async def _generate_and_cache():
+        report = await _generate_llm_report(db_result, report_mode)
+        report_cache.set(key, report)
+        return report
+
     try:
-        logging.info("Calling Gemini for JSON serialization (Schema Enforced)...")
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=final_gemini_prompt,
-            config={
-                "response_mime_type": "application/json",
-                "response_schema": PARCEL_INPUT_SCHEMA,
-            }
+        return await report_flight.do(key, _generate_and_cache)
+    except LLMUnavailableError as e:
+        # Degraded answer, not cached: the next request tries the LLM again
+        logging.warning(f"Report LLM unavailable ({e}), rendering the template report")
+        failures.inc(type="llm_degraded")
+        return render_template_report(db_result)
+
+
+def _chunks(db_result: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    return [db_result[start:start + REPORT_CHUNK_SIZE] for start in range(0, len(db_result), REPORT_CHUNK_SIZE)]
+
+
+async def _with_retries(what: str, call):
+    """Retries a Gemini call on API/JSON errors with exponential backoff."""
+    for attempt in range(REPORT_CHUNK_RETRIES + 1):
+        try:
+            return await call()
+        except (LLMAPIError, json.JSONDecodeError) as e:
+            if attempt == REPORT_CHUNK_RETRIES:
+                raise
+            logging.warning(f"{what} failed (attempt {attempt + 1}), retrying: {e}")
+            await asyncio.sleep(REPORT_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+
+def _chunk_tasks(db_result: List[Dict[str, Any]], render, what: str) -> List[asyncio.Task]:
+    """
+    Starts one task per chunk, at most REPORT_CHUNK_CONCURRENCY running at a time.
+    Each task resolves to render(chunk), or None if the chunk still fails after retries
+    or the LLM gateway sheds it.
+    """
+    semaphore = asyncio.Semaphore(REPORT_CHUNK_CONCURRENCY)
+
+    async def run(rows):
+        async with semaphore:
+            try:
+                return await _with_retries(what, lambda: render(rows))
+            except (LLMAPIError, json.JSONDecodeError, LLMUnavailableError) as e:
+                logging.error(f"{what} failed for a chunk of {len(rows)} parcel(s): {e}")
+                return None
+
+    return [asyncio.ensure_future(run(rows)) for rows in _chunks(db_result)]
+
+
+async def _hybrid_next_steps(db_result: List[Dict[str, Any]]) -> Dict[str, str]:
+    # Chunks that fail keep the status-table next step for their parcels
+    next_steps: Dict[str, str] = {}
+    for part in await asyncio.gather(*_chunk_tasks(db_result, phrase_next_steps, "Next-step phrasing")):
+        next_steps.update(part or {})
+    return next_steps
+
+
+def _report_prompt(db_result: List[Dict[str, Any]]) -> str:
+    return GEMINI_PACKAGE_RESPONSE_PROMPT.replace(
+        "{{db_result}}", compact_json(db_result)
+    )
+
+
+async def _render_llm_chunk(db_result: List[Dict[str, Any]]) -> str:
+    logging.debug("Calling Gemini for final report generation (%d parcels)...", len(db_result))
+    parcel_ret_response = await generate_content("report", _report_prompt(db_result))
+    return parcel_ret_response.text.strip()
+
+
+def _report_bullets(report: Optional[str], rows: List[Dict[str, Any]]) -> List[str]:
+    """A chunk's bullet lines without its header; template lines if the chunk failed."""
+    if report is None:
+        return [render_parcel_line(row) for row in rows]
+    lines = [line.rstrip() for line in report.splitlines() if line.strip()]
+    bullets = [line for line in lines if line.lstrip().startswith(("-", "*", "•"))]
+    return bullets or lines
+
+
+async def _generate_llm_report(db_result: List[Dict[str, Any]], report_mode: str) -> str:
+    if report_mode == "hybrid":
+        return render_template_report(db_result, await _hybrid_next_steps(db_result))
+
+    if len(db_result) <= REPORT_CHUNK_SIZE:
+        return await _render_llm_chunk(db_result)
+
+    # One header, then every chunk's bullets in parcel order
+    lines = [next(iter_report_lines(db_result))]
+    chunks = _chunks(db_result)
+    reports = await asyncio.gather(*_chunk_tasks(db_result, _render_llm_chunk, "Report chunk"))
+    for rows, report in zip(chunks, reports):
+        lines.extend(_report_bullets(report, rows))
+    return "\n".join(lines)
+
+
+async def stream_report_lines(db_result: List[Dict[str, Any]], report_mode: str = REPORT_MODE) -> AsyncIterator[str]:
+    """
+    Yields the report line by line as soon as each line is ready. In llm mode the
+    Gemini streaming API is used and complete lines are forwarded as they arrive.
+    """
+    if report_mode == "template" or not db_result:
+        for line in iter_report_lines(db_result):
+            yield line
+        return
+
+    key = report_fingerprint(db_result, report_mode)
+    cached_report = report_cache.get(key)
+    if cached_report is not None:
+        for line in cached_report.splitlines():
+            if line.strip():
+                yield line
+        return
+
+    lines = []
+    if report_mode == "hybrid":
+        for line in iter_report_lines(db_result, await _hybrid_next_steps(db_result)):
+            lines.append(line)
+            yield line
+    elif len(db_result) > REPORT_CHUNK_SIZE:
+        # Chunks render concurrently; each one is forwarded as soon as it and its predecessors are done
+        lines.append(next(iter_report_lines(db_result)))
+        yield lines[0]
+        for rows, task in zip(_chunks(db_result), _chunk_tasks(db_result, _render_llm_chunk, "Report chunk")):
+            for line in _report_bullets(await task, rows):
+                lines.append(line)
+                yield line
+    else:
+        client = get_genai_client()
+        logging.debug("Streaming Gemini final report generation...")
+        buffer, last_chunk = "", None
+        try:
+            async with llm_gateway.slot("report") as deadline:
+                # Every wait on the stream is bounded by the gateway's call deadline
+                stream = await asyncio.wait_for(
+                    client.aio.models.generate_content_stream(model=GEMINI_MODEL, contents=_report_prompt(db_result)),
+                    deadline - time.monotonic(),
+                )
+                chunks = aiter(stream)
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), deadline - time.monotonic())
+                    except StopAsyncIteration:
+                        break
+                    last_chunk = chunk
+                    buffer += chunk.text or ""
+                    *complete, buffer = buffer.split("\n")
+                    for line in complete:
+                        if line.strip():
+                            lines.append(line.rstrip())
+                            yield line.rstrip()
+        except Exception as e:
+            if lines or not (isinstance(e, LLMUnavailableError) or is_transient(e)):
+                # Part of the report is already out; stream_message fails the task
+                raise
+            # Shed, timed out or dropped before the first line; answer from the template and leave the cache alone
+            logging.warning(f"Report LLM unavailable ({e!r}), streaming the template report")
+            failures.inc(type="llm_degraded")
+            for line in iter_report_lines(db_result):
+                yield line
+            return
+        if buffer.strip():
+            lines.append(buffer.rstrip())
+            yield buffer.rstrip()
+        # Usage metadata is cumulative, the final chunk carries the totals
+        record_llm_usage("report", last_chunk)
+
+    report_cache.set(key, "\n".join(lines))
+
+
+def _message_text(client_payload: List[A2AMessage]) -> str:
+    """
+    Returns the first text part of the latest user message; execute calls may carry
+    the earlier turns of the conversation in front of it.
+    """
+    user_messages = [payload for payload in client_payload if payload.role == "user"]
+    for payload in reversed(user_messages or client_payload):
+        for message in payload.parts:
+            if message.text:
+                logging.debug("Received payload: %s", message.text)
+                return message.text
+    return ""
+
+
+def _account_parcels(db_result: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """The parcel list an account-wide answer covered, for follow-up questions."""
+    return [{"parcel_id": row["parcel_id"], "carrier": row.get("carrier") or ""} for row in db_result]
+
+
+async def stream_message(client_payload: List[A2AMessage], context_id: Optional[str] = None, task_id: Optional[str] = None, config: Optional[MessageConfiguration] = None) -> AsyncIterator[TaskStatusUpdateEvent | TaskArtifactUpdateEvent]:
+    """
+    message/stream variant of process_message. Emits a working status straight away,
+    then one artifact part per report line (header first, then one per parcel) and
+    finally a completed or failed status.
+    """
+    task_ref = f"task-{uuid4()}"
+    context_id = context_id or str(uuid4())
+    artifact_id = str(uuid4())
+
+    def status_event(state: str, text: str) -> TaskStatusUpdateEvent:
+        return TaskStatusUpdateEvent(
+            taskId=task_ref,
+            contextId=context_id,
+            status=TaskStatus(state=state, message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text=text)], taskId=task_ref)),
+            final=state != "working",
         )
-        
-        structured_output: List[Dict[str, str]] = json.loads(response.text.strip())
-        logging.info(f"Structured output successfully parsed: {structured_output}")
 
-    except APIError as e:
+    def artifact_event(text: str, append: bool, last_chunk: bool) -> TaskArtifactUpdateEvent:
+        return TaskArtifactUpdateEvent(
+            taskId=task_ref,
+            contextId=context_id,
+            artifact=Artifact(artifactId=artifact_id, name="Parcel Status Summary", parts=[MessagePart(kind="text", text=text)]),
+            append=append,
+            lastChunk=last_chunk,
+        )
+
+    yield status_event("working", "Looking up your parcels...")
+
+    payload_message = _message_text(client_payload)
+    if not payload_message:
+        failures.inc(type="empty_input")
+        yield status_event("failed", "Error: Input message was empty.")
+        return
+
+    account_query = account_query_for(client_payload, payload_message)
+    if account_query is not None and not account_query["merchant_id"]:
+        failures.inc(type="missing_merchant")
+        yield status_event("failed", MISSING_MERCHANT_TEXT)
+        return
+
+    structured_output: List[Dict[str, str]] = []
+    follow_up = None
+    try:
+        if account_query is None:
+            follow_up = resolve_follow_up(payload_message, load_context(context_id))
+            structured_output = follow_up if follow_up is not None else await resolve_parcels(payload_message)
+    except LLMAPIError as e:
+        logging.error(f"Gemini API Error during JSON conversion: {e}")
+        failures.inc(type="extraction_api_error")
+        yield status_event("failed", f"API Error during data serialization: {e}")
+        return
+    except json.JSONDecodeError as e:
+        logging.error(f"JSON Decoding Error after Gemini call: {e}")
+        failures.inc(type="extraction_bad_json")
+        yield status_event("failed", "Error: Malformed JSON output from AI.")
+        return
+    except Exception as e:
+        # Transport failures after the gateway's retries; the stream still ends with a status
+        logging.error(f"Error during parcel extraction: {e!r}")
+        failures.inc(type="extraction_error")
+        yield status_event("failed", "Error: Parcel extraction failed.")
+        return
+
+    try:
+        if account_query is not None:
+            db_result = await fetch_account_parcels(account_query)
+        else:
+            db_result = await fetch_parcels(structured_output)
+    except Exception as e:
+        logging.error(f"Error during DB retrieval: {e}")
+        failures.inc(type="db_error")
+        yield status_event("failed", "Error: Database retrieval failed.")
+        return
+
+    if account_query is not None:
+        structured_output = _account_parcels(db_result)
+    all_rows, snapshot = db_result, None
+    if delta_requested(client_payload, context_id):
+        db_result, snapshot = report_snapshots.changed_rows(context_id, db_result)
+        if not db_result and snapshot:
+            report_snapshots.save_snapshot(context_id, snapshot)
+            remember_turn(context_id, client_payload, NO_CHANGES_TEXT, structured_output, all_rows, follow_up is not None)
+            yield artifact_event(NO_CHANGES_TEXT, append=False, last_chunk=True)
+            yield status_event("completed", NO_CHANGES_TEXT)
+            return
+
+    # Hold back one line so the last part can be flagged with lastChunk
+    previous, sent, report_lines = None, 0, []
+    try:
+        async for line in stream_report_lines(db_result):
+            if previous is not None:
+                yield artifact_event(previous, append=sent > 0, last_chunk=False)
+                sent += 1
+            previous = line
+            report_lines.append(line)
+    except Exception as e:
+        # API error, deadline or dropped connection mid-stream: close the artifact and fail the task
+        if isinstance(e, LLMAPIError):
+            logging.error(f"Gemini API Error during report generation: {e}")
+            failures.inc(type="report_api_error")
+            text = f"An API error occurred during report generation: {e}"
+        else:
+            logging.error(f"Report stream failed: {e!r}")
+            failures.inc(type="report_stream_error")
+            text = "Error: Report generation was interrupted."
+        if previous is not None:
+            yield artifact_event(previous, append=sent > 0, last_chunk=True)
+        yield status_event("failed", text)
+        return
+    if previous is not None:
+        yield artifact_event(previous, append=sent > 0, last_chunk=True)
+    if snapshot is not None:
+        report_snapshots.save_snapshot(context_id, snapshot)
+    remember_turn(context_id, client_payload, "\n".join(report_lines), structured_output, all_rows, follow_up is not None)
+
+    yield status_event("completed", "Periodic parcel status update completed and summarized.")
+
+
+async def process_message(client_payload: List[A2AMessage], context_id: Optional[str] = None, task_id: Optional[str] = None, config: Optional[MessageConfiguration] = None, follow_up: Optional[List[Dict[str, str]]] = None):
+    # State is kept under the id the reply returns, generated here when the client sent none.
+    # follow_up: the parcels a caller already resolved this message to against the context
+    context_id = context_id or str(uuid4())
+    # Extract Payload Message
+    with stage_duration.time(stage="payload_extraction"):
+        payload_message = _message_text(client_payload)
+
+    if not payload_message:
+        logging.warning("No text message found in client payload.")
+        failures.inc(type="empty_input")
+        return _failed_task("Error: Input message was empty.", context_id)
+
+    # "All my open parcels" style inquiries are answered from the merchant index, without extraction
+    account_query = account_query_for(client_payload, payload_message)
+    if account_query is not None and not account_query["merchant_id"]:
+        failures.inc(type="missing_merchant")
+        return _failed_task(MISSING_MERCHANT_TEXT, context_id)
+
+    #  First Gemini Call: Data Serialization (JSON-enforced), skipped for well-formed input
+    #  and for follow-ups that refer back to the parcels of this context's previous turn
+    structured_output: List[Dict[str, str]] = []
+    try:
+        if account_query is None:
+            with stage_duration.time(stage="gemini_extraction"):
+                if follow_up is None:
+                    follow_up = resolve_follow_up(payload_message, load_context(context_id))
+                structured_output = follow_up if follow_up is not None else await resolve_parcels(payload_message)
+            logging.debug("Structured output successfully parsed: %s", structured_output)
+
+    except LLMAPIError as e:
         logging.error(f"Gemini API Error during JSON conversion: {e}")
-        return TaskResult(id=str(uuid4()), status=TaskStatus(state="failed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text=f"API Error during data serialization: {e}")]))),
+        failures.inc(type="extraction_api_error")
+        return _failed_task(f"API Error during data serialization: {e}", context_id)
     except json.JSONDecodeError as e:
         logging.error(f"JSON Decoding Error after Gemini call: {e}")
-        return TaskResult(id=str(uuid4()), status=TaskStatus(state="failed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text="Error: Malformed JSON output from AI.")]))),
+        failures.inc(type="extraction_bad_json")
+        return _failed_task("Error: Malformed JSON output from AI.", context_id)
 
 
     # Database Retrieval
     try:
         # The structured_output now contains data ready for database query.
-        db_result = await retrieve_parcel_meta_by_id(structured_output, db_session)
-        logging.info("Database retrieval complete.")
+        with stage_duration.time(stage="db_retrieval"):
+            if account_query is not None:
+                db_result = await fetch_account_parcels(account_query)
+            else:
+                db_result = await fetch_parcels(structured_output)
+        logging.debug("Database retrieval complete.")
     except (TimeoutError) as e:
         logging.error(f"Database Error: {e}")
-        return TaskResult(id=str(uuid4()), status=TaskStatus(state="failed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text="Error: Database retrieval failed.")]))),
+        failures.inc(type="db_timeout")
+        return _failed_task("Error: Database retrieval failed.", context_id)
     except Exception as e:
         logging.error(f"Unexpected error during DB retrieval: {e}")
-        return TaskResult(id=str(uuid4()), status=TaskStatus(state="failed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text="Error: Unexpected error during DB retrieval.")]))),
+        failures.inc(type="db_error")
+        return _failed_task("Error: Unexpected error during DB retrieval.", context_id)
+
+    if account_query is not None:
+        structured_output = _account_parcels(db_result)
 
+    # Delta mode: report only what changed since this context's last reply, and skip the LLM if nothing did
+    all_rows, snapshot = db_result, None
+    if delta_requested(client_payload, context_id):
+        db_result, snapshot = report_snapshots.changed_rows(context_id, db_result)
+        if not db_result and snapshot:
+            report_snapshots.save_snapshot(context_id, snapshot)
+            history = remember_turn(context_id, client_payload, NO_CHANGES_TEXT, structured_output, all_rows, follow_up is not None)
+            return _completed_task(NO_CHANGES_TEXT, context_id, history)
 
     # Second Gemini Call: Report Generation
-    
-    final_parcel_prompt = GEMINI_PACKAGE_RESPONSE_PROMPT.replace(
-        "{{db_result}}", json.dumps(db_result, indent=2, default=json_serial)
-    )
     try:
-        logging.info("Calling Gemini for final report generation...")
-        parcel_ret_response = client.models.generate_content(
-            model="gemini-2.5-flash", 
-            contents=final_parcel_prompt
-        )
-        final_summary_text = parcel_ret_response.text.strip()
-        logging.info("Report generation complete.")
+        with stage_duration.time(stage="gemini_report"):
+            final_summary_text = await generate_report(db_result)
+        logging.debug("Report generation complete.")
+        if snapshot is not None:
+            report_snapshots.save_snapshot(context_id, snapshot)
         
-    except APIError as e:
+    except LLMAPIError as e:
         logging.error(f"Gemini API Error during report generation: {e}")
+        failures.inc(type="report_api_error")
         final_summary_text = f"An API error occurred during report generation: {e}"
 
+    history = remember_turn(context_id, client_payload, final_summary_text, structured_output, all_rows, follow_up is not None)
+    return _completed_task(final_summary_text, context_id, history)
 
 
+def _completed_task(final_summary_text: str, context_id: Optional[str] = None, history: Optional[List[A2AMessage]] = None) -> TaskResult:
+    """Wraps the report text into the completed TaskResult returned to the agent platform."""
     # Task Result Construction
     task_id_new = str(uuid4())
     
@@ -185,7 +795,7 @@ async def process_message(client_payload: List[A2AMessage], context_id: Optional
         role="agent",
         parts=[MessagePart(kind="text", text="Periodic parcel status update completed and summarized.")],
         taskId=f"task-{task_id_new}",
-        contextId=f"ctx-{context_id}" if context_id is not None else str(uuid4()),
+        contextId=context_id or str(uuid4()),
     )
 
     # Defines the Build artifacts (the structured final output)
@@ -197,12 +807,13 @@ async def process_message(client_payload: List[A2AMessage], context_id: Optional
     # A return of the constructed result, back to the agent.
     return TaskResult(
         id=f"task-{task_id_new}",
-        contextId=f"ctx-{context_id}" if context_id is not None else str(uuid4()),
+        contextId=context_id or str(uuid4()),
         status=TaskStatus(
             state="completed",
             timestamp=datetime.datetime.utcnow().isoformat(), 
             message=response_message
         ),
         artifacts=[artifacts],
+        history=history or [],
         kind="task"
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,367 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from agents.parcel_agent import (
+    GEMINI_PACKAGE_RESPONSE_PROMPT, REPORT_CHUNK_CONCURRENCY, REPORT_CHUNK_SIZE, _completed_task, _failed_task,
+    _message_text, NO_CHANGES_TEXT, _hybrid_next_steps, _render_llm_chunk, _with_retries, account_query_for,
+    cache_key, compact_json, delta_requested, extraction_cache, extract_parcels, fetch_parcels, generate_content,
+    generate_report, normalize_message, process_message, report_cache, report_fingerprint,
+)
+from agents.conversation import load_context, remember_turn, resolve_follow_up
+from agents.parcel_parser import parse_parcel_message, scan_parcel_ids
+from agents.report_renderer import REPORT_MODE, render_template_report
+from models.a2a import A2AMessage, MessageConfiguration, TaskResult
+from utils import report_snapshots
+from utils.llm_gateway import LLMAPIError, LLMUnavailableError
+from utils.metrics import failures
+
+# JSON-RPC batch support: every inquiry in a batch shares one DB query, and the LLM work
+# that is left after the fast path and the caches is packed into one call per stage (report
+# prompts are packed up to OMI_REPORT_CHUNK_SIZE parcels each).
+
+BatchCall = Tuple[List[A2AMessage], Optional[str], Optional[str], Optional[MessageConfiguration]]
+
+
+BATCH_PARCEL_INPUT_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "inquiry_index": {"type": "integer", "description": "The index attribute of the <INQUIRY> the record came from."},
+            "parcel_id": {"type": "string", "description": "The unique identifier for the parcel, derived from 'Parcel Id'."},
+            "carrier": {"type": "string", "description": "The logistics carrier name, derived from 'carrier'."}
+        },
+        "required": ["inquiry_index", "parcel_id", "carrier"],
+    }
+}
+
+BATCH_REPORT_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "report_index": {"type": "integer", "description": "The index attribute of the <DB_RESULTS> block."},
+            "report": {"type": "string", "description": "The header and bulleted list for that block."}
+        },
+        "required": ["report_index", "report"],
+    }
+}
+
+GEMINI_BATCH_CLEANUP_PROMPT = """
+You are an expert data serialization specialist. Your sole task is to extract the logistics data provided below and convert it precisely into the mandated JSON structure.
+
+Several independent inquiries are provided, each inside its own <INQUIRY index="N"> tag. Each inquiry consists of semicolon-separated records. Extract the 'Parcel Id' and 'carrier' for each record and tag it with the index of the inquiry it came from.
+
+{{INQUIRIES}}
+"""
+
+GEMINI_BATCH_REPORT_PROMPT = """
+Several independent report requests are provided below, each inside its own <DB_RESULTS index="N"> tag. Produce one report per block, following exactly the instructions that come after them, and return it together with the block's index.
+
+{{BLOCKS}}
+
+{{INSTRUCTIONS}}
+"""
+
+
+async def extract_parcels_batch(payload_messages: List[str]) -> List[List[Dict[str, str]]]:
+    """Extracts several inquiries with a single Gemini call; results are in input order."""
+    if len(payload_messages) == 1:
+        return [await extract_parcels(payload_messages[0])]
+
+    inquiries = "\n".join(
+        f'<INQUIRY index="{index}">\n{message}\n</INQUIRY>'
+        for index, message in enumerate(payload_messages)
+    )
+    logging.debug("Calling Gemini for batched JSON serialization of %d inquiries...", len(payload_messages))
+    response = await generate_content(
+        "extraction_batch",
+        GEMINI_BATCH_CLEANUP_PROMPT.replace("{{INQUIRIES}}", inquiries),
+        {
+            "response_mime_type": "application/json",
+            "response_schema": BATCH_PARCEL_INPUT_SCHEMA,
+        },
+    )
+    grouped: List[List[Dict[str, str]]] = [[] for _ in payload_messages]
+    for item in json.loads(response.text.strip()):
+        index = item.get("inquiry_index")
+        if isinstance(index, int) and 0 <= index < len(grouped):
+            grouped[index].append({"parcel_id": item["parcel_id"], "carrier": item.get("carrier", "")})
+    return grouped
+
+
+async def resolve_parcels_batch(payload_messages: List[str]) -> List[Any]:
+    """
+    Batch counterpart of resolve_parcels. Each entry is the parcel list for that
+    message, or the exception that prevented its extraction.
+    """
+    resolved: List[Any] = [None] * len(payload_messages)
+    misses: Dict[str, List[int]] = {}
+    for index, message in enumerate(payload_messages):
+        structured_output = parse_parcel_message(message)
+        if structured_output is None:
+            key = cache_key(normalize_message(message))
+            structured_output = extraction_cache.get(key)
+            if structured_output is None:
+                misses.setdefault(key, []).append(index)
+                continue
+        resolved[index] = structured_output
+
+    if misses:
+        keys = list(misses)
+        try:
+            extracted = await extract_parcels_batch([payload_messages[misses[key][0]] for key in keys])
+        except (LLMAPIError, json.JSONDecodeError) as e:
+            extracted = [e] * len(keys)
+        except LLMUnavailableError as e:
+            logging.warning(f"Batched extraction LLM unavailable ({e}), scanning the messages for parcel IDs")
+            failures.inc(type="llm_degraded")
+            for key in keys:
+                for index in misses[key]:
+                    resolved[index] = scan_parcel_ids(payload_messages[index])
+            return resolved
+        for key, result in zip(keys, extracted):
+            if not isinstance(result, Exception):
+                extraction_cache.set(key, result)
+            for index in misses[key]:
+                resolved[index] = result
+    return resolved
+
+
+async def _generate_llm_reports_batch(db_results: List[List[Dict[str, Any]]]) -> List[str]:
+    """One Gemini call producing a report per block; blocks it skips are generated on their own."""
+    instructions = GEMINI_PACKAGE_RESPONSE_PROMPT.replace("{{db_result}}", "(the rows of the block being reported on)")
+    blocks = "\n".join(
+        f'<DB_RESULTS index="{index}">\n{compact_json(rows)}\n</DB_RESULTS>'
+        for index, rows in enumerate(db_results)
+    )
+    logging.debug("Calling Gemini for %d batched reports...", len(db_results))
+    response = await generate_content(
+        "report_batch",
+        GEMINI_BATCH_REPORT_PROMPT.replace("{{BLOCKS}}", blocks).replace("{{INSTRUCTIONS}}", instructions),
+        {
+            "response_mime_type": "application/json",
+            "response_schema": BATCH_REPORT_SCHEMA,
+        },
+    )
+    reports: List[Optional[str]] = [None] * len(db_results)
+    for item in json.loads(response.text.strip()):
+        index = item.get("report_index")
+        if isinstance(index, int) and 0 <= index < len(reports) and item.get("report"):
+            reports[index] = item["report"].strip()
+
+    missing = [index for index, report in enumerate(reports) if report is None]
+    if missing:
+        logging.warning(f"Batched report skipped {len(missing)} block(s), generating them individually")
+        for index, report in zip(missing, await asyncio.gather(*(generate_report(db_results[i], "llm") for i in missing))):
+            reports[index] = report
+    return reports
+
+
+def _pack_blocks(db_results: List[List[Dict[str, Any]]]) -> List[List[int]]:
+    """Groups block indexes, in order, so no packed prompt carries more than REPORT_CHUNK_SIZE rows."""
+    groups: List[List[int]] = []
+    rows = 0
+    for index, block in enumerate(db_results):
+        if not groups or rows + len(block) > REPORT_CHUNK_SIZE:
+            groups.append([])
+            rows = 0
+        groups[-1].append(index)
+        rows += len(block)
+    return groups
+
+
+async def _generate_llm_reports(db_results: List[List[Dict[str, Any]]]) -> List[Optional[str]]:
+    """
+    Blocks larger than REPORT_CHUNK_SIZE go through generate_report's chunked path; the rest
+    are packed into prompts of at most REPORT_CHUNK_SIZE rows, each retried like a report
+    chunk. Blocks whose packed call still fails, or is shed by the gateway, come back None.
+    """
+    reports: List[Optional[str]] = [None] * len(db_results)
+    small = [index for index, rows in enumerate(db_results) if len(rows) <= REPORT_CHUNK_SIZE]
+    large = [index for index, rows in enumerate(db_results) if len(rows) > REPORT_CHUNK_SIZE]
+    semaphore = asyncio.Semaphore(REPORT_CHUNK_CONCURRENCY)
+
+    async def run(indexes: List[int]) -> None:
+        blocks = [db_results[index] for index in indexes]
+        async with semaphore:
+            try:
+                if len(blocks) == 1:
+                    generated = [await _with_retries("Report chunk", lambda: _render_llm_chunk(blocks[0]))]
+                else:
+                    generated = await _with_retries("Batched report", lambda: _generate_llm_reports_batch(blocks))
+            except LLMUnavailableError as e:
+                logging.warning(f"Batched report LLM unavailable ({e}), rendering {len(blocks)} template report(s)")
+                failures.inc(type="llm_degraded")
+                return
+            except (LLMAPIError, json.JSONDecodeError) as e:
+                logging.error(f"Batched report failed for {len(blocks)} block(s), rendering template reports: {e}")
+                return
+        for index, report in zip(indexes, generated):
+            reports[index] = report
+
+    async def run_large(index: int) -> None:
+        reports[index] = await generate_report(db_results[index], "llm")
+
+    await asyncio.gather(
+        *(run([small[position] for position in group]) for group in _pack_blocks([db_results[index] for index in small])),
+        *(run_large(index) for index in large),
+    )
+    return reports
+
+
+async def generate_reports_batch(db_results: List[List[Dict[str, Any]]], report_mode: str = REPORT_MODE) -> List[str]:
+    """Batch counterpart of generate_report; cache hits and empty results never reach the LLM."""
+    reports: List[Optional[str]] = [None] * len(db_results)
+    misses: Dict[str, List[int]] = {}
+    for index, rows in enumerate(db_results):
+        if report_mode == "template" or not rows:
+            reports[index] = render_template_report(rows)
+            continue
+        key = report_fingerprint(rows, report_mode)
+        reports[index] = report_cache.get(key)
+        if reports[index] is None:
+            misses.setdefault(key, []).append(index)
+
+    if not misses:
+        return reports
+
+    keys = list(misses)
+    pending = [db_results[misses[key][0]] for key in keys]
+    if report_mode == "hybrid":
+        # One phrasing call covering every parcel across the batch
+        union = list({row["parcel_id"]: row for rows in pending for row in rows}.values())
+        next_steps = await _hybrid_next_steps(union)
+        generated = [render_template_report(rows, next_steps) for rows in pending]
+    elif len(pending) == 1:
+        generated = [await generate_report(pending[0], report_mode)]
+    else:
+        generated = await _generate_llm_reports(pending)
+
+    for key, report, rows in zip(keys, generated, pending):
+        if report is None:
+            # Degraded answers are not cached, so the next batch tries the LLM again
+            report = render_template_report(rows)
+        else:
+            report_cache.set(key, report)
+        for index in misses[key]:
+            reports[index] = report
+    return reports
+
+
+def _split_rows(rows_by_id: Dict[str, Dict[str, Any]], structured_output: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Picks one request's rows out of the merged result, in the order it asked for them."""
+    picked, seen = [], set()
+    for item in structured_output:
+        parcel_id = (item.get("parcel_id") or "").strip().casefold()
+        row = rows_by_id.get(parcel_id)
+        if row is not None and parcel_id not in seen:
+            seen.add(parcel_id)
+            picked.append(row)
+    return picked
+
+
+async def process_batch(calls: List[BatchCall]) -> List[TaskResult]:
+    """
+    Runs several blocking inquiries together: one extraction call for whatever the
+    fast path and cache cannot resolve, one DB query for the union of parcel IDs and
+    one report call. Results come back in input order with per-item failures.
+    """
+    # Every item gets the contextId its reply will carry before any state is read or stored
+    calls = [(messages, context_id or str(uuid4()), task_id, config) for messages, context_id, task_id, config in calls]
+    results: List[Optional[TaskResult]] = [None] * len(calls)
+    payload_messages = [_message_text(messages) for messages, _, _, _ in calls]
+
+    active, individual, follow_ups = [], [], {}
+    for index, message in enumerate(payload_messages):
+        messages, context_id = calls[index][0], calls[index][1]
+        if not message:
+            failures.inc(type="empty_input")
+            results[index] = _failed_task("Error: Input message was empty.", context_id)
+            continue
+        if account_query_for(messages, message) is None:
+            follow_up = resolve_follow_up(message, load_context(context_id))
+            if follow_up is None:
+                active.append(index)
+                continue
+            follow_ups[index] = follow_up
+        individual.append(index)
+
+    async def run_individual(index: int) -> None:
+        results[index] = await process_message(*calls[index], follow_up=follow_ups.get(index))
+
+    # Account-wide inquiries (merchant index) and follow-ups (conversation context) run on
+    # their own, alongside the batched path for everything else
+    await asyncio.gather(
+        *(run_individual(index) for index in individual),
+        _process_batched(calls, payload_messages, active, results),
+    )
+    return results
+
+
+async def _process_batched(
+    calls: List[BatchCall], payload_messages: List[str], active: List[int], results: List[Optional[TaskResult]]
+) -> None:
+    """The shared extraction, DB and report path for the active items; fills in their results."""
+    if not active:
+        return
+    resolved = await resolve_parcels_batch([payload_messages[index] for index in active])
+    extracted = {}
+    for index, structured_output in zip(active, resolved):
+        if isinstance(structured_output, LLMAPIError):
+            failures.inc(type="extraction_api_error")
+            results[index] = _failed_task(f"API Error during data serialization: {structured_output}", calls[index][1])
+        elif isinstance(structured_output, Exception):
+            failures.inc(type="extraction_bad_json")
+            results[index] = _failed_task("Error: Malformed JSON output from AI.", calls[index][1])
+        else:
+            extracted[index] = structured_output
+    if not extracted:
+        return
+
+    merged = [item for structured_output in extracted.values() for item in structured_output]
+    try:
+        rows = await fetch_parcels(merged)
+    except Exception as e:
+        logging.error(f"Error during batched DB retrieval: {e}")
+        failures.inc(type="db_error")
+        for index in extracted:
+            results[index] = _failed_task("Error: Database retrieval failed.", calls[index][1])
+        return
+
+    rows_by_id = {row["parcel_id"].casefold(): row for row in rows}
+    db_results = {index: _split_rows(rows_by_id, structured_output) for index, structured_output in extracted.items()}
+
+    # Delta mode per item; items with nothing new are answered without a report
+    all_rows = dict(db_results)
+    snapshots = {}
+    for index in list(db_results):
+        messages, context_id = calls[index][0], calls[index][1]
+        if not delta_requested(messages, context_id):
+            continue
+        db_results[index], snapshots[index] = report_snapshots.changed_rows(context_id, db_results[index])
+        if not db_results[index] and snapshots[index]:
+            report_snapshots.save_snapshot(context_id, snapshots.pop(index))
+            history = remember_turn(context_id, messages, NO_CHANGES_TEXT, extracted[index], all_rows[index])
+            results[index] = _completed_task(NO_CHANGES_TEXT, context_id, history)
+            del db_results[index]
+    if not db_results:
+        return
+
+    try:
+        reports = await generate_reports_batch(list(db_results.values()))
+    except (LLMAPIError, json.JSONDecodeError) as e:
+        logging.error(f"Gemini API Error during batched report generation: {e}")
+        failures.inc(type="report_api_error")
+        reports = [f"An API error occurred during report generation: {e}"] * len(db_results)
+        snapshots = {}
+    for index, snapshot in snapshots.items():
+        report_snapshots.save_snapshot(calls[index][1], snapshot)
+
+    for index, report in zip(db_results, reports):
+        messages, context_id = calls[index][0], calls[index][1]
+        history = remember_turn(context_id, messages, report, extracted[index], all_rows[index])
+        results[index] = _completed_task(report, context_id, history)
@@ -0,0 +1,241 @@
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from utils.metrics import register_collector
+
+# Deterministic fast path for the GEMINI_CLEANUP_PROMPT step. Well-formed inquiries such as
+# "Parcel Id: PKG002NG; carrier: DHL" are parsed locally into the PARCEL_INPUT_SCHEMA shape;
+# anything the grammar does not fully account for returns None and goes to Gemini instead.
+
+FAST_PARSE_ENABLED = os.getenv("OMI_FAST_PARSE", "true").lower() not in ("0", "false", "no")
+
+# IDs we recognise even without a "Parcel Id:" key in front of them
+KNOWN_ID_PATTERNS = [
+    re.compile(r"^PKG\d{3,}[A-Z]{2}$"),
+]
+
+# A value given explicitly under a parcel-id key only has to look like an identifier
+KEYED_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9\-_]{2,63}$")
+
+PARCEL_ID_KEYS = {
+    "parcelid", "parcel", "parcelno", "parcelnumber",
+    "packageid", "package", "pkgid", "pkg",
+    "trackingid", "trackingnumber", "trackingno", "tracking",
+    "shipmentid", "id",
+}
+CARRIER_KEYS = {"carrier", "carriername", "courier", "shipper", "logistics", "provider"}
+
+KNOWN_CARRIERS = {
+    "dhl", "fedex", "ups", "usps", "dpd", "gls", "tnt", "aramex", "hermes", "evri",
+    "royal mail", "japan post", "canada post", "la poste", "australia post", "gig logistics",
+}
+
+FIELD_SEPARATORS = re.compile(r"[;\n\r|,]+")
+KEY_VALUE = re.compile(r"^([A-Za-z][A-Za-z _\-\.#]*?)\s*[:=]\s*(.+)$")
+LIST_MARKER = re.compile(r"^(?:[-*•]|\d+[.)])\s*")
+
+fast_path_stats = {"hits": 0, "misses": 0}
+
+register_collector(
+    "omi_fast_path_total",
+    "Messages seen by the fast-path parser, by result (hit skips the extraction LLM call).",
+    "counter",
+    lambda: [("", {"result": "hit"}, fast_path_stats["hits"]), ("", {"result": "miss"}, fast_path_stats["misses"])],
+)
+
+
+def _normalize_key(key: str) -> str:
+    return re.sub(r"[^a-z]", "", key.lower())
+
+
+def _clean(value: str) -> str:
+    return value.strip().strip("\"'`").strip()
+
+
+def _is_known_id(token: str) -> bool:
+    return any(pattern.match(token) for pattern in KNOWN_ID_PATTERNS)
+
+
+def _tokenize(message: str) -> Optional[List[tuple]]:
+    """
+    Splits the message into ("id", value) / ("carrier", value) tokens.
+    Returns None as soon as a field does not fit the grammar.
+    """
+    tokens = []
+    for raw_field in FIELD_SEPARATORS.split(message):
+        field = LIST_MARKER.sub("", raw_field.strip())
+        if not field:
+            continue
+
+        match = KEY_VALUE.match(field)
+        if match:
+            key, value = _normalize_key(match.group(1)), _clean(match.group(2))
+            if key in PARCEL_ID_KEYS and KEYED_ID_PATTERN.match(value):
+                tokens.append(("id", value))
+            elif key in CARRIER_KEYS and value:
+                tokens.append(("carrier", value))
+            else:
+                return None
+            continue
+
+        # Bare fields: "PKG002NG", "DHL" or "PKG002NG DHL"
+        head, _, tail = _clean(field).partition(" ")
+        if _is_known_id(head):
+            tokens.append(("id", head))
+            tail = _clean(tail.strip("()[] "))
+            if tail:
+                if tail.lower() not in KNOWN_CARRIERS:
+                    return None
+                tokens.append(("carrier", tail))
+        elif _clean(field).lower() in KNOWN_CARRIERS:
+            tokens.append(("carrier", _clean(field)))
+        else:
+            return None
+    return tokens
+
+
+def _assemble(tokens: List[tuple]) -> Optional[List[Dict[str, str]]]:
+    """Groups tokens into records; a carrier attaches to the parcel it follows (or precedes)."""
+    records: List[Dict[str, str]] = []
+    pending_carrier = None
+    for kind, value in tokens:
+        if kind == "id":
+            records.append({"parcel_id": value, "carrier": pending_carrier or ""})
+            pending_carrier = None
+        elif records and not records[-1]["carrier"]:
+            records[-1]["carrier"] = value
+        elif pending_carrier is None:
+            pending_carrier = value
+        else:
+            return None
+    if pending_carrier is not None or not records:
+        return None
+    return records
+
+
+def parse_parcel_message(message: str) -> Optional[List[Dict[str, str]]]:
+    """
+    Parses a parcel inquiry without calling Gemini.
+    Returns the same List[Dict] structure as the extraction call, or None when the
+    input cannot be handled confidently and should fall back to the LLM.
+    """
+    if not FAST_PARSE_ENABLED or not message or not message.strip():
+        return None
+
+    tokens = _tokenize(message)
+    records = _assemble(tokens) if tokens else None
+    if records is None:
+        fast_path_stats["misses"] += 1
+        return None
+
+    fast_path_stats["hits"] += 1
+    logging.debug("Fast-path parser resolved %d parcel(s) without Gemini", len(records))
+    return records
+
+
+# --- Account-wide inquiries ("all my open parcels", "everything delayed") ---
+
+# scope -> statuses; "delayed" additionally requires an estimated_arrival in the past
+OPEN_STATUSES = ["pending", "in_transit"]
+ACCOUNT_SCOPES = {
+    "delayed": OPEN_STATUSES,
+    "in_transit": ["in_transit"],
+    "pending": ["pending"],
+    "lost": ["lost"],
+    "open": OPEN_STATUSES,
+}
+
+# "Is my package with DHL delayed?" is about one parcel; only phrases that cover the whole
+# account ("all my", "every", "how many") make an account query
+ACCOUNT_QUANTIFIER = re.compile(
+    r"\b(?:all (?:of )?(?:my|our|the)|all (?:\w+ )?(?:parcels|packages|shipments|orders)"
+    r"|every\w*|how many|(?:any|which) of (?:my|our))\b",
+    re.IGNORECASE,
+)
+# "are any of them delayed?" is about the parcels already under discussion, not the account
+ACCOUNT_ANAPHORA = re.compile(r"\b(?:them|those|these|they)\b", re.IGNORECASE)
+# Checked in order, so "all delayed parcels in transit" is a delayed query
+ACCOUNT_SCOPE_PATTERNS = [
+    ("delayed", re.compile(r"\b(?:delayed|late|overdue|stuck|stalled)\b", re.IGNORECASE)),
+    ("lost", re.compile(r"\blost\b", re.IGNORECASE)),
+    ("in_transit", re.compile(r"\bin[ _-]?transit\b", re.IGNORECASE)),
+    ("pending", re.compile(r"\b(?:pending|awaiting pickup|not (?:yet )?shipped)\b", re.IGNORECASE)),
+    ("open", re.compile(
+        r"\b(?:open|active|in flight|undelivered|outstanding|on the way|parcels|packages|shipments|orders)\b"
+        r"|\beverything\b",
+        re.IGNORECASE,
+    )),
+]
+MERCHANT_IN_TEXT = re.compile(r"\b(?:merchant|account|store|shop)(?:[ _-]?id)?\s*[:=#]\s*([A-Za-z0-9][A-Za-z0-9\-_]{1,63})", re.IGNORECASE)
+# Letters and digits mixed, e.g. an unrecognised tracking number: not an account query
+ID_LIKE_TOKEN = re.compile(r"\b(?=[A-Za-z\-_]*\d)(?=[\d\-_]*[A-Za-z])[A-Za-z0-9\-_]{5,64}\b")
+# Digit-only tracking numbers (USPS, UPS Mail Innovations, many national posts)
+DIGIT_ID_TOKEN = re.compile(r"\b\d{8,}\b")
+
+
+def names_parcel_ids(message: str) -> bool:
+    """
+    True when the message carries parcel IDs of its own: a parcel-id key ("Parcel Id: ..."),
+    an ID-looking token or a long digit run. Does not count towards the fast-path stats.
+    """
+    if not message:
+        return False
+    if ID_LIKE_TOKEN.search(message) or DIGIT_ID_TOKEN.search(message):
+        return True
+    for field in FIELD_SEPARATORS.split(message):
+        match = KEY_VALUE.match(LIST_MARKER.sub("", field.strip()))
+        if match and _normalize_key(match.group(1)) in PARCEL_ID_KEYS:
+            return True
+    return False
+
+
+def parse_account_query(message: str, merchant_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Recognises an inquiry about a whole account rather than explicit parcel IDs.
+    Returns {"scope", "statuses", "overdue", "merchant_id"} or None. The merchant comes
+    from the message metadata or a "merchant: ID" field in the text (None when neither
+    is given; the caller asks for it). Messages that name parcel IDs (digit-only ones
+    included) or carry a parcel-id key are left to the ID path, and messages pointing
+    back at earlier parcels ("any of them") to the conversation context.
+    """
+    if not message or not message.strip():
+        return None
+    text_merchant = MERCHANT_IN_TEXT.search(message)
+    text = MERCHANT_IN_TEXT.sub(" ", message)
+    if not ACCOUNT_QUANTIFIER.search(text):
+        return None
+    if ACCOUNT_ANAPHORA.search(text):
+        return None
+    if names_parcel_ids(text):
+        return None
+
+    for scope, pattern in ACCOUNT_SCOPE_PATTERNS:
+        if pattern.search(text):
+            return {
+                "scope": scope,
+                "statuses": ACCOUNT_SCOPES[scope],
+                "overdue": scope == "delayed",
+                "merchant_id": merchant_id or (text_merchant.group(1) if text_merchant else None),
+            }
+    return None
+
+
+def scan_parcel_ids(message: str) -> List[Dict[str, str]]:
+    """
+    Degraded extraction for when the LLM is unavailable: every identifier-looking token
+    (letters and digits mixed) is taken as a parcel ID. Unknown tokens simply find no
+    row, so over-matching costs a lookup, not a wrong answer. Not cached, so the next
+    inquiry goes back to Gemini once it recovers.
+    """
+    return [
+        {"parcel_id": parcel_id, "carrier": ""}
+        for parcel_id in dict.fromkeys(match.group(0) for match in ID_LIKE_TOKEN.finditer(message or ""))
+    ]
+
+
+def fast_path_hit_rate() -> float:
+    """Share of parsed messages that skipped the extraction LLM call."""
+    total = fast_path_stats["hits"] + fast_path_stats["misses"]
+    return fast_path_stats["hits"] / total if total else 0.0
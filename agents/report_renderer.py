@@ -0,0 +1,121 @@
+import datetime
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+# Local replacement for the GEMINI_PACKAGE_RESPONSE_PROMPT step.
+#   template - render everything locally from the db_result rows
+#   llm      - the original Gemini-written report
+#   hybrid   - local rendering, Gemini only phrases the next-step column (one batched call)
+REPORT_MODES = ("template", "llm", "hybrid")
+REPORT_MODE = os.getenv("OMI_REPORT_MODE", "llm").lower()
+if REPORT_MODE not in REPORT_MODES:
+    raise ValueError(f"OMI_REPORT_MODE must be one of {REPORT_MODES}, got {REPORT_MODE!r}")
+
+MAP_URL_TEMPLATE = "https://maps.google.com/maps?q={latitude},{longitude}"
+REPORT_HEADER = "Parcel Status Report"
+
+# Next step per status, kept within the 7-word limit of the LLM prompt
+NEXT_STEP_BY_STATUS = {
+    "pending": "Awaiting carrier pickup",
+    "in_transit": "Monitor; arriving by {eta}",
+    "delivered": "None; parcel delivered",
+    "cancelled": "Confirm cancellation and refund buyer",
+    "lost": "File a lost-parcel claim with carrier",
+}
+NEXT_STEP_OVERDUE = "Overdue; contact carrier for update"
+NEXT_STEP_NO_ETA = "Monitor for next carrier scan"
+NEXT_STEP_UNKNOWN = "Contact carrier for status"
+
+
+def _as_datetime(value: Any) -> Optional[datetime.datetime]:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+
+def default_next_step(row: Dict[str, Any]) -> str:
+    """Looks up the next-step text for a parcel row from NEXT_STEP_BY_STATUS."""
+    status = (row.get("status") or "").lower()
+    template = NEXT_STEP_BY_STATUS.get(status)
+    if template is None:
+        return NEXT_STEP_UNKNOWN
+    if "{eta}" not in template:
+        return template
+
+    eta = _as_datetime((row.get("movement") or {}).get("estimated_arrival"))
+    if eta is None:
+        return NEXT_STEP_NO_ETA
+    if eta.replace(tzinfo=None) < datetime.datetime.utcnow():
+        return NEXT_STEP_OVERDUE
+    return template.format(eta=eta.date().isoformat())
+
+
+def map_link(location: Optional[Dict[str, Any]]) -> str:
+    location = location or {}
+    latitude, longitude = location.get("latitude"), location.get("longitude")
+    if latitude is None or longitude is None:
+        return "N/A"
+    return MAP_URL_TEMPLATE.format(latitude=latitude, longitude=longitude)
+
+
+def describe_location(location: Optional[Dict[str, Any]]) -> str:
+    location = location or {}
+    parts = [location.get(key) for key in ("facility", "city", "country")]
+    return ", ".join(part for part in parts if part) or "Unknown"
+
+
+def describe_route(hops: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    """'Route: A (Oct 12) -> B (Oct 14)' from the recent_hops attached to a row, if any."""
+    stops = []
+    for hop in hops or []:
+        place = hop.get("facility") or hop.get("city")
+        if not place or (stops and stops[-1][0] == place):
+            continue
+        timestamp = _as_datetime(hop.get("timestamp"))
+        stops.append((place, timestamp.strftime("%b %d") if timestamp else None))
+    if len(stops) < 2:
+        return None
+    return "Route: " + " -> ".join(f"{place} ({day})" if day else place for place, day in stops)
+
+
+def render_parcel_line(row: Dict[str, Any], next_step: Optional[str] = None) -> str:
+    """One bullet in the extended format used by the LLM prompt, plus the route when known."""
+    status = (row.get("status") or "unknown").replace("_", " ").upper()
+    columns = [
+        f"- [{row.get('parcel_id')}]",
+        status,
+        describe_location(row.get("location")),
+        next_step or default_next_step(row),
+        map_link(row.get("location")),
+        row.get("tracking_url") or "N/A",
+    ]
+    route = describe_route(row.get("recent_hops"))
+    if route:
+        columns.append(route)
+    return " | ".join(columns)
+
+
+def iter_report_lines(db_result: List[Dict[str, Any]], next_steps: Optional[Dict[str, str]] = None) -> Iterator[str]:
+    """Yields the header and then one bullet per parcel, in db_result order."""
+    if not db_result:
+        yield REPORT_HEADER
+        yield "No matching parcels were found."
+        return
+
+    next_steps = next_steps or {}
+    yield f"{REPORT_HEADER} ({len(db_result)} parcel{'s' if len(db_result) != 1 else ''})"
+    for row in db_result:
+        yield render_parcel_line(row, next_steps.get(row.get("parcel_id")))
+
+
+def render_template_report(db_result: List[Dict[str, Any]], next_steps: Optional[Dict[str, str]] = None) -> str:
+    """
+    Builds the header and bullet list locally from the db_result rows.
+    next_steps optionally overrides the next-step text per parcel_id (hybrid mode).
+    """
+    return "\n".join(iter_report_lines(db_result, next_steps))
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+import httpx
+
+from models.a2a import (
+    A2AMessage, JSONRPCResponse, MessagePart, PushNotificationConfig,
+    TaskResult, TaskStatus,
+)
+from utils.llm_gateway import BACKGROUND, llm_priority
+from utils.metrics import register_collector
+
+# Background execution for MessageConfiguration(blocking=False): the request returns a
+# "working" task at once, a bounded worker pool runs the pipeline and the final result is
+# POSTed to pushNotificationConfig.url. tasks/get reads the same store.
+
+TASK_WORKERS = int(os.getenv("OMI_TASK_WORKERS", "8"))
+TASK_QUEUE_SIZE = int(os.getenv("OMI_TASK_QUEUE_SIZE", "1000"))
+TASK_STORE_SIZE = int(os.getenv("OMI_TASK_STORE_SIZE", "10000"))
+PUSH_MAX_ATTEMPTS = int(os.getenv("OMI_PUSH_MAX_ATTEMPTS", "4"))
+PUSH_BACKOFF_SECONDS = float(os.getenv("OMI_PUSH_BACKOFF_SECONDS", "0.5"))
+PUSH_TIMEOUT_SECONDS = float(os.getenv("OMI_PUSH_TIMEOUT_SECONDS", "10"))
+
+Job = Callable[[], Awaitable[TaskResult]]
+
+
+class QueueFullError(Exception):
+    """Raised when a non-blocking task cannot be accepted."""
+
+
+class _QueuedTask:
+    __slots__ = ("task_id", "context_id", "request_id", "job", "push_config")
+
+    def __init__(self, task_id: str, context_id: str, request_id: str, job: Job, push_config: Optional[PushNotificationConfig]):
+        self.task_id = task_id
+        self.context_id = context_id
+        self.request_id = request_id
+        self.job = job
+        self.push_config = push_config
+
+
+class TaskQueue:
+    def __init__(self, workers: int = TASK_WORKERS, queue_size: int = TASK_QUEUE_SIZE, store_size: int = TASK_STORE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.store_size = store_size
+        self._tasks: "OrderedDict[str, TaskResult]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self.stats: Dict[str, int] = {"submitted": 0, "completed": 0, "failed": 0, "pushed": 0, "push_failed": 0}
+
+    def start(self) -> None:
+        """Starts the worker pool on the running loop (idempotent)."""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.workers * 2, max_keepalive_connections=self.workers),
+            timeout=httpx.Timeout(PUSH_TIMEOUT_SECONDS),
+        )
+        self._workers = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        logging.info(f"Task queue started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    def submit(self, job: Job, request_id: str, context_id: Optional[str] = None, push_config: Optional[PushNotificationConfig] = None) -> TaskResult:
+        """Queues job and returns the "working" TaskResult the caller should answer with."""
+        self.start()
+        task_id = f"task-{uuid4()}"
+        context_ref = context_id or str(uuid4())
+        try:
+            self._queue.put_nowait(_QueuedTask(task_id, context_ref, request_id, job, push_config))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Task queue is full ({self.queue_size} pending)")
+
+        working = TaskResult(
+            id=task_id,
+            contextId=context_ref,
+            status=TaskStatus(
+                state="working",
+                message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text="Parcel inquiry accepted and queued.")], taskId=task_id),
+            ),
+        )
+        self._remember(working)
+        self.stats["submitted"] += 1
+        return working
+
+    def get(self, task_id: str) -> Optional[TaskResult]:
+        return self._tasks.get(task_id)
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _remember(self, task: TaskResult) -> None:
+        self._tasks[task.id] = task
+        self._tasks.move_to_end(task.id)
+        while len(self._tasks) > self.store_size:
+            self._tasks.popitem(last=False)
+
+    async def _worker(self, index: int) -> None:
+        # Queued tasks yield LLM slots to interactive requests (the worker task owns this context)
+        llm_priority.set(BACKGROUND)
+        while True:
+            queued = await self._queue.get()
+            try:
+                await self._run(queued)
+            except Exception as e:
+                logging.error(f"Task worker {index} failed on {queued.task_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, queued: _QueuedTask) -> None:
+        try:
+            result = await queued.job()
+        except Exception as e:
+            logging.error(f"Background task {queued.task_id} raised: {e}")
+            result = TaskResult(
+                id=queued.task_id,
+                contextId=queued.context_id,
+                status=TaskStatus(state="failed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text=f"Error: {e}")])),
+            )
+        # Keep the id/context the client was given when the task was accepted
+        result = result.model_copy(update={"id": queued.task_id, "contextId": queued.context_id})
+        self._remember(result)
+        self.stats["failed" if result.status.state == "failed" else "completed"] += 1
+
+        if queued.push_config is not None:
+            await self._push(queued, result)
+
+    async def _push(self, queued: _QueuedTask, result: TaskResult) -> None:
+        """POSTs the final JSON-RPC response to the push URL, retrying transient failures."""
+        config = queued.push_config
+        headers = {"Content-Type": "application/json"}
+        if config.token:
+            headers["Authorization"] = f"Bearer {config.token}"
+        body = JSONRPCResponse(id=queued.request_id, result=result).model_dump_json()
+
+        for attempt in range(1, PUSH_MAX_ATTEMPTS + 1):
+            try:
+                response = await self._http_client.post(config.url, content=body, headers=headers)
+                if response.status_code < 500 and response.status_code != 429:
+                    if response.is_success:
+                        self.stats["pushed"] += 1
+                    else:
+                        # 4xx other than 429 will not improve on retry
+                        self.stats["push_failed"] += 1
+                        logging.error(f"Push for {queued.task_id} rejected with HTTP {response.status_code}")
+                    return
+                logging.warning(f"Push for {queued.task_id} got HTTP {response.status_code} (attempt {attempt})")
+            except httpx.TransportError as e:
+                logging.warning(f"Push for {queued.task_id} failed: {e} (attempt {attempt})")
+            if attempt < PUSH_MAX_ATTEMPTS:
+                await asyncio.sleep(PUSH_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+        self.stats["push_failed"] += 1
+        logging.error(f"Giving up pushing {queued.task_id} to {config.url}")
+
+
+task_queue = TaskQueue()
+
+register_collector(
+    "omi_task_queue_events_total", "Background task queue events by kind.", "counter",
+    lambda: [("", {"event": event}, count) for event, count in task_queue.stats.items()],
+)
+register_collector(
+    "omi_task_queue_pending", "Background tasks waiting for a worker.", "gauge",
+    lambda: [("", {}, task_queue.pending())],
+)
@@ -0,0 +1,98 @@
+"""
+Shows that the DB pool no longer caps how many inquiries can wait on Gemini at once.
+
+Serves the app with a deliberately tiny pool (--pool-size, no overflow) and a slow fake
+model, replays many concurrent inquiries and samples the pool while they run. If a
+connection were held for the whole request, throughput could not exceed
+pool capacity / model latency; since connections are only checked out for the
+retrieval queries, throughput scales with concurrency while at most pool-size
+connections are ever in use.
+
+    python -m bench.db_pool --pool-size 2 --concurrency 64 --latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/omi-pool-bench.db")
+os.environ.setdefault("GOOGLE_GEMENI_AI_KEY", "bench-key")
+
+import httpx
+
+from bench.e2e import percentile, run_level, seed_database, synthetic_workload
+
+
+async def main(args) -> bool:
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{args.gemini_port}"
+    os.environ["OMI_DB_POOL_SIZE"] = str(args.pool_size)
+    os.environ["OMI_DB_MAX_OVERFLOW"] = "0"
+    # Admission control would otherwise be the limit being measured
+    os.environ["OMI_LLM_MAX_CONCURRENCY"] = str(args.concurrency * 2)
+    os.environ["OMI_LLM_STAGE_LIMITS"] = json.dumps({"extraction": args.concurrency, "report": args.concurrency})
+
+    import uvicorn
+    from bench.fake_gemini import start_fake_gemini
+    from config.db import dispose_async_engine, get_async_engine
+    from utils.cache import caches
+
+    gemini = await start_fake_gemini(args.gemini_port, args.latency_ms)
+    parcels = await seed_database(args.parcels, args.seed)
+
+    from main import app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    peak = 0
+    sampling = True
+
+    async def sample_pool():
+        nonlocal peak
+        while sampling:
+            peak = max(peak, get_async_engine().pool.checkedout())
+            await asyncio.sleep(0.002)
+
+    url = f"http://127.0.0.1:{args.port}/a2a/parcel"
+    bodies = synthetic_workload(parcels, args.requests, 3, args.free_text_share, args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+            await client.post(url, json=bodies[0])
+            for cache in caches.values():
+                cache.clear()
+            sampler = asyncio.create_task(sample_pool())
+            result = await run_level(client, url, bodies, args.concurrency)
+            sampling = False
+            await sampler
+    finally:
+        for server_ref, task in ((server, server_task), gemini):
+            server_ref.should_exit = True
+            await task
+        await dispose_async_engine()
+
+    rps = len(result["latencies"]) / result["elapsed"]
+    ceiling = args.pool_size / (args.latency_ms / 1000)
+    print(f"pool_size={args.pool_size} concurrency={args.concurrency} model latency={args.latency_ms:.0f}ms")
+    print(f"{len(result['latencies'])} requests, {result['errors']} errors, {rps:.1f} req/s, "
+          f"p50={percentile(result['latencies'], 0.5) * 1000:.0f}ms p99={percentile(result['latencies'], 0.99) * 1000:.0f}ms")
+    print(f"peak connections checked out: {peak}; ceiling if held across the LLM call: {ceiling:.1f} req/s")
+    ok = result["errors"] == 0 and peak <= args.pool_size and rps > ceiling * 3
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=640)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake Gemini latency per call")
+    parser.add_argument("--free-text-share", type=float, default=0.3, help="share of inquiries needing Gemini extraction")
+    parser.add_argument("--parcels", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--gemini-port", type=int, default=8089)
+    raise SystemExit(0 if asyncio.run(main(parser.parse_args())) else 1)
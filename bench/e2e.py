@@ -0,0 +1,234 @@
+"""
+Offline end-to-end benchmark for /a2a/parcel.
+
+Seeds a local SQLite database (sqlite+aiosqlite) with a synthetic parcel population,
+serves the app and the fake Gemini server in-process, replays a JSON-RPC workload at
+each concurrency level and prints p50/p95/p99 latency, requests/s and a per-stage
+breakdown read from /metrics.
+
+    python -m bench.e2e --parcels 10000 --requests 200 --concurrency 1,8,32 --latency-ms 300
+    python -m bench.e2e --workload captures.jsonl --concurrency 16
+
+A workload file holds one JSON object per line: either a full JSON-RPC request, or a
+requests.jsonl-style capture whose "body" (or "text") is sent as a message/send inquiry.
+Use --target to benchmark an already running deployment instead (no seeding, no fake model).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/omi-bench.db")
+os.environ.setdefault("GOOGLE_GEMENI_AI_KEY", "bench-key")
+
+import httpx
+
+STAGES = ("payload_extraction", "gemini_extraction", "db_retrieval", "gemini_report", "serialization")
+
+
+async def seed_database(count: int, seed: int) -> List[Tuple[str, str]]:
+    """Recreates the benchmark tables and bulk-loads `count` synthetic parcels; returns (parcel_id, carrier) pairs."""
+    from config.db import IS_SQLITE
+    from utils.ingest_db import ingest_parcels
+    from utils.parcel_generator import generate_parcels
+    from utils.schema import create_schema
+
+    if not IS_SQLITE:
+        raise SystemExit("Refusing to seed a non-SQLite DATABASE_URL; pass --no-seed to reuse existing data")
+
+    records = list(generate_parcels(count, seed))
+    await create_schema(drop=True)
+    await ingest_parcels(records)
+    return [(record["parcel_id"], record["carrier"]) for record in records]
+
+
+def message_send(text: str, request_id: str) -> Dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "message/send",
+        "params": {"message": {"kind": "message", "role": "user", "parts": [{"kind": "text", "text": text}]}},
+    }
+
+
+def synthetic_workload(parcels: List[Tuple[str, str]], requests: int, per_request: int,
+                       free_text_share: float, seed: int) -> List[Dict]:
+    """Well-formed inquiries hit the fast-path parser; free-text ones go through Gemini extraction."""
+    rng = random.Random(seed + 1)
+    bodies = []
+    for index in range(requests):
+        picked = rng.sample(parcels, min(per_request, len(parcels)))
+        if rng.random() < free_text_share:
+            listed = ", ".join(f"{pid} (sent with {carrier})" for pid, carrier in picked)
+            text = f"hi, can you tell me where these are: {listed}? thanks"
+        else:
+            text = "; ".join(f"Parcel Id: {pid}; carrier: {carrier}" for pid, carrier in picked)
+        bodies.append(message_send(text, f"bench-{index}"))
+    return bodies
+
+
+def load_workload(path: str) -> List[Dict]:
+    bodies = []
+    with open(path, encoding="utf-8") as handle:
+        for index, line in enumerate(handle):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, list) or "jsonrpc" in record:
+                bodies.append(record)
+            else:
+                text = record.get("body") or record.get("text") or ""
+                bodies.append(message_send(text, str(record.get("request_id", f"replay-{index}"))))
+    return bodies
+
+
+def _failed(response: httpx.Response) -> bool:
+    if response.status_code != 200:
+        return True
+    payload = response.json()
+    items = payload if isinstance(payload, list) else [payload]
+    return any(
+        item.get("error") or ((item.get("result") or {}).get("status") or {}).get("state") == "failed"
+        for item in items
+    )
+
+
+async def run_level(client: httpx.AsyncClient, url: str, bodies: List[Dict], concurrency: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    queue = iter(bodies)
+
+    async def worker():
+        nonlocal errors
+        for body in queue:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=body)
+                failed = _failed(response)
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"elapsed": time.perf_counter() - started, "latencies": latencies, "errors": errors}
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(share * len(ordered))) - 1))]
+
+
+async def stage_totals(client: httpx.AsyncClient, base_url: str) -> Dict[str, Tuple[float, float]]:
+    """Reads omi_stage_duration_seconds_{sum,count} per stage from the Prometheus endpoint."""
+    totals: Dict[str, List[float]] = {}
+    response = await client.get(f"{base_url}/metrics")
+    for line in response.text.splitlines():
+        for field, position in (("_sum", 0), ("_count", 1)):
+            prefix = f"omi_stage_duration_seconds{field}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split("\"} ")
+                totals.setdefault(stage, [0.0, 0.0])[position] = float(value)
+    return {stage: (total[0], total[1]) for stage, total in totals.items()}
+
+
+def print_level(concurrency: int, result: Dict, before: Dict, after: Dict) -> None:
+    latencies = result["latencies"]
+    print(
+        f"c={concurrency:<4} n={len(latencies):<6} errors={result['errors']:<4} "
+        f"rps={len(latencies) / result['elapsed']:8.1f}  "
+        f"p50={percentile(latencies, 0.50) * 1000:8.1f}ms  "
+        f"p95={percentile(latencies, 0.95) * 1000:8.1f}ms  "
+        f"p99={percentile(latencies, 0.99) * 1000:8.1f}ms"
+    )
+    for stage in STAGES:
+        seconds = after.get(stage, (0.0, 0.0))[0] - before.get(stage, (0.0, 0.0))[0]
+        calls = after.get(stage, (0.0, 0.0))[1] - before.get(stage, (0.0, 0.0))[1]
+        if calls:
+            print(f"    {stage:<20} mean={seconds / calls * 1000:8.2f}ms  runs/request={calls / max(len(latencies), 1):.2f}")
+
+
+async def main(args) -> bool:
+    servers = []
+    base_url = args.target
+    if base_url is None:
+        os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{args.gemini_port}"
+        import uvicorn
+        from bench.fake_gemini import start_fake_gemini
+
+        servers.append(await start_fake_gemini(args.gemini_port, args.latency_ms, args.error_rate, args.report_line_chars))
+        parcels = await seed_database(args.parcels, args.seed) if not args.no_seed else []
+
+        from main import app
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+        task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        servers.append((server, task))
+        base_url = f"http://127.0.0.1:{args.port}"
+    else:
+        parcels = []
+
+    if args.workload:
+        bodies = load_workload(args.workload)
+    elif parcels:
+        bodies = synthetic_workload(parcels, args.requests, args.parcels_per_request, args.free_text_share, args.seed)
+    else:
+        raise SystemExit("Nothing to replay: pass --workload, or let the bench seed its own parcels")
+
+    url = f"{base_url}/a2a/parcel"
+    levels = [int(level) for level in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    total_errors = 0
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            await client.post(url, json=bodies[0])  # warm-up
+            print(f"{len(bodies)} requests per level against {url}")
+            for concurrency in levels:
+                if servers and not args.warm_caches:
+                    # Every level replays the same bodies; start each one from cold result caches
+                    from utils.cache import caches
+                    for cache in caches.values():
+                        cache.clear()
+                before = await stage_totals(client, base_url)
+                result = await run_level(client, url, bodies, concurrency)
+                after = await stage_totals(client, base_url)
+                print_level(concurrency, result, before, after)
+                total_errors += result["errors"]
+    finally:
+        for server, task in reversed(servers):
+            server.should_exit = True
+            await task
+        if servers:
+            from config.db import dispose_async_engine
+            # aiosqlite connections run on non-daemon threads; close them so the process can exit
+            await dispose_async_engine()
+    return total_errors == 0 or args.error_rate > 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="base URL of a running deployment (skips seeding and the fake model)")
+    parser.add_argument("--workload", help="JSONL file of JSON-RPC requests or text captures to replay")
+    parser.add_argument("--parcels", type=int, default=10_000, help="synthetic parcels to seed")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the parcels already in DATABASE_URL")
+    parser.add_argument("--requests", type=int, default=200, help="synthetic requests per concurrency level")
+    parser.add_argument("--parcels-per-request", type=int, default=3)
+    parser.add_argument("--free-text-share", type=float, default=0.3, help="share of inquiries needing Gemini extraction")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake Gemini latency per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake Gemini calls answered with HTTP 503")
+    parser.add_argument("--report-line-chars", type=int, default=0, help="minimum length of each fake report line")
+    parser.add_argument("--warm-caches", action="store_true", help="keep result caches between concurrency levels")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--gemini-port", type=int, default=8089)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    raise SystemExit(0 if asyncio.run(main(parser.parse_args())) else 1)
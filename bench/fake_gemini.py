@@ -0,0 +1,139 @@
+"""
+Local stand-in for the Gemini REST API, used by the bench scripts.
+
+Run it on its own with:
+    python -m bench.fake_gemini --port 8089 --latency-ms 500 --report-line-chars 200
+and point the agent at it with GEMINI_BASE_URL=http://127.0.0.1:8089
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+PARCEL_ID_PATTERN = re.compile(r"\bPKG[0-9A-Z]+\b")
+INDEXED_BLOCK_PATTERN = re.compile(r'<(INQUIRY|DB_RESULTS) index="(\d+)">(.*?)</\1>', re.S)
+SLOW_FACTOR = 10
+
+app = FastAPI(title="Fake Gemini")
+app.state.latency_ms = 0.0
+app.state.error_rate = 0.0
+# Share of calls that take SLOW_FACTOR times the normal latency (a slow tail)
+app.state.slow_rate = 0.0
+app.state.report_line_chars = 0
+app.state.calls = 0
+
+
+def _prompt_text(body: dict) -> str:
+    return "\n".join(
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def _fake_report(parcel_ids: list) -> str:
+    lines = ["Parcel status report:"]
+    for pid in parcel_ids:
+        line = f"- {pid} | in_transit | Unknown | Await next scan | https://maps.google.com/maps?q=0,0 | n/a"
+        # Pad the next-step column to mimic wordier model output
+        padding = app.state.report_line_chars - len(line)
+        lines.append(line + (" (" + "x" * (padding - 3) + ")" if padding > 3 else ""))
+    return "\n".join(lines)
+
+
+def _fake_answer(prompt: str, wants_json: bool, schema_fields: set) -> str:
+    parcel_ids = list(dict.fromkeys(PARCEL_ID_PATTERN.findall(prompt)))
+    blocks = [(int(index), PARCEL_ID_PATTERN.findall(block)) for _, index, block in INDEXED_BLOCK_PATTERN.findall(prompt)]
+    if wants_json and "inquiry_index" in schema_fields:
+        return json.dumps([
+            {"inquiry_index": index, "parcel_id": pid, "carrier": "DHL"}
+            for index, ids in blocks for pid in dict.fromkeys(ids)
+        ])
+    if wants_json and "report_index" in schema_fields:
+        return json.dumps([{"report_index": index, "report": _fake_report(list(dict.fromkeys(ids)))} for index, ids in blocks])
+    if wants_json and "next_step" in schema_fields:
+        return json.dumps([{"parcel_id": pid, "next_step": "Await next carrier scan"} for pid in parcel_ids])
+    if wants_json:
+        return json.dumps([{"parcel_id": pid, "carrier": "DHL"} for pid in parcel_ids])
+    return _fake_report(parcel_ids)
+
+
+@app.post("/{api_version}/models/{model_action}")
+async def generate_content(api_version: str, model_action: str, request: Request):
+    body = await request.json()
+    app.state.calls += 1
+    if app.state.latency_ms:
+        slow = app.state.slow_rate and random.random() < app.state.slow_rate
+        await asyncio.sleep(app.state.latency_ms * (SLOW_FACTOR if slow else 1) / 1000)
+    if app.state.error_rate and random.random() < app.state.error_rate:
+        return JSONResponse(
+            status_code=503,
+            content={"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}},
+        )
+
+    prompt = _prompt_text(body)
+    generation_config = body.get("generationConfig") or {}
+    wants_json = generation_config.get("responseMimeType") == "application/json"
+    schema = generation_config.get("responseSchema") or {}
+    schema_fields = {key.lower() for key in (schema.get("items") or {}).get("properties", {})}
+    text = _fake_answer(prompt, wants_json, schema_fields)
+    if model_action.endswith(":streamGenerateContent"):
+        return StreamingResponse(_stream_chunks(prompt, text), media_type="text/event-stream")
+    return _response_body(prompt, text)
+
+
+def _response_body(prompt: str, text: str, finished: bool = True) -> dict:
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return {
+        "candidates": [candidate],
+        "usageMetadata": {
+            "promptTokenCount": len(prompt) // 4,
+            "candidatesTokenCount": len(text) // 4,
+            "totalTokenCount": (len(prompt) + len(text)) // 4,
+        },
+    }
+
+
+async def _stream_chunks(prompt: str, text: str):
+    """Streams the answer one line per SSE event, like the real streaming endpoint."""
+    lines = text.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        body = _response_body(prompt, line, finished=index == len(lines) - 1)
+        yield f"data: {json.dumps(body)}\r\n\r\n"
+        await asyncio.sleep(0.01)
+
+
+async def start_fake_gemini(port: int, latency_ms: float = 0.0, error_rate: float = 0.0, report_line_chars: int = 0, slow_rate: float = 0.0):
+    """Starts the fake server on 127.0.0.1:<port> in the running loop; returns (server, task)."""
+    app.state.latency_ms = latency_ms
+    app.state.error_rate = error_rate
+    app.state.slow_rate = slow_rate
+    app.state.report_line_chars = report_line_chars
+    app.state.calls = 0
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Gemini model server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with HTTP 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help=f"share of calls {SLOW_FACTOR}x slower than --latency-ms")
+    parser.add_argument("--report-line-chars", type=int, default=0, help="minimum length of each report line")
+    args = parser.parse_args()
+    app.state.latency_ms = args.latency_ms
+    app.state.error_rate = args.error_rate
+    app.state.slow_rate = args.slow_rate
+    app.state.report_line_chars = args.report_line_chars
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
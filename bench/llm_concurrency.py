@@ -0,0 +1,62 @@
+"""
+Checks that concurrent Gemini calls overlap instead of queueing on the event loop.
+
+Starts the fake model server with a fixed latency, fires N extraction calls at once
+through the shared async client and compares wall time against a single call.
+
+    python -m bench.llm_concurrency --requests 20 --latency-ms 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+# The agent module imports the DB config; this check never connects to it
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/omi-bench.db")
+os.environ.setdefault("GOOGLE_GEMENI_AI_KEY", "bench-key")
+
+
+async def main(requests: int, latency_ms: float, port: int) -> bool:
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{port}"
+    # Let the LLM gateway admit the whole burst; this measures the client, not admission control
+    os.environ["OMI_LLM_MAX_CONCURRENCY"] = str(max(requests, 32))
+    os.environ["OMI_LLM_STAGE_LIMITS"] = json.dumps({"extraction": requests})
+
+    from bench.fake_gemini import start_fake_gemini
+    from config.llm import init_genai_client, close_genai_client
+    from agents.parcel_agent import extract_parcels
+
+    server, server_task = await start_fake_gemini(port, latency_ms)
+    init_genai_client()
+    try:
+        # Warm up the connection pool so the timing below is pure model latency
+        await extract_parcels("Parcel Id: PKG000XX; carrier: DHL")
+
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(extract_parcels(f"Parcel Id: PKG{i:03d}NG; carrier: DHL") for i in range(requests))
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        await close_genai_client()
+        server.should_exit = True
+        await server_task
+
+    single = latency_ms / 1000
+    print(f"{requests} concurrent calls in {elapsed:.3f}s (one call ~ {single:.3f}s)")
+    assert all(len(r) == 1 for r in results), "unexpected extraction output"
+    # Serialised calls would take requests * latency; allow generous overhead for one round-trip
+    ok = elapsed < single * 2
+    print("PASS" if ok else "FAIL: calls did not overlap")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    raise SystemExit(0 if asyncio.run(main(args.requests, args.latency_ms, args.port)) else 1)
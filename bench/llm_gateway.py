@@ -0,0 +1,139 @@
+"""
+Exercises the LLM gateway (utils/llm_gateway.py) against the fake Gemini server.
+
+Four checks, each with its own small gateway so the limits are easy to saturate:
+  priority  - background calls queued first still yield their slots to interactive ones
+  breaker   - with every call failing, the breaker opens and further calls are shed in
+              microseconds instead of each waiting on the model
+  recovery  - a cancelled probe does not wedge the breaker half-open; once the model is
+              healthy again the next probe closes it
+  hedging   - with a slow tail (--slow-rate calls take 10x), hedged requests cut p99
+
+    python -m bench.llm_gateway --latency-ms 50 --slow-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+# The agent modules import the DB config; this check never connects to it
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/omi-bench.db")
+os.environ.setdefault("GOOGLE_GEMENI_AI_KEY", "bench-key")
+
+
+def _percentile(values, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def main(args) -> bool:
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+
+    from bench.fake_gemini import app, start_fake_gemini
+    from config.llm import GEMINI_MODEL, close_genai_client, init_genai_client
+    from utils.llm_gateway import BACKGROUND, INTERACTIVE, CircuitBreaker, LLMGateway, LLMUnavailableError, llm_priority
+
+    server, server_task = await start_fake_gemini(args.port, args.latency_ms)
+    client = init_genai_client()
+
+    def call():
+        return client.aio.models.generate_content(model=GEMINI_MODEL, contents="Parcel Id: PKG001NG")
+
+    def breaker(cooldown: float = 30.0) -> CircuitBreaker:
+        return CircuitBreaker(window=20, min_calls=10, failure_rate=0.5, cooldown=cooldown)
+
+    ok = True
+    try:
+        await call()
+
+        # --- priority: 2 slots, background work queued before the interactive burst ---
+        gateway = LLMGateway(max_concurrency=2, stage_limits={}, hedge_after=0, retries=0, breaker=breaker())
+        finished = []
+
+        async def tagged(priority: int, index: int):
+            llm_priority.set(priority)
+            await gateway.call("report", call)
+            finished.append(priority)
+
+        background = [asyncio.create_task(tagged(BACKGROUND, i)) for i in range(args.calls // 2)]
+        await asyncio.sleep(0)
+        interactive = [asyncio.create_task(tagged(INTERACTIVE, i)) for i in range(args.calls // 2)]
+        await asyncio.gather(*background, *interactive)
+        # Only the background calls that grabbed the free slots first may finish ahead of interactive ones
+        first_half = finished[:len(interactive)]
+        early_background = first_half.count(BACKGROUND)
+        print(f"priority: {early_background} background call(s) finished among the first {len(first_half)}")
+        ok = ok and early_background <= 2
+
+        # --- breaker: every call fails ---
+        app.state.error_rate = 1.0
+        gateway = LLMGateway(max_concurrency=8, stage_limits={}, hedge_after=0, retries=0, breaker=breaker(cooldown=1.0))
+        calls_before = app.state.calls
+        shed_latency, errors = [], 0
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            try:
+                await gateway.call("report", call)
+            except LLMUnavailableError:
+                shed_latency.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+        reached = app.state.calls - calls_before
+        # The call that trips the breaker already reports LLMUnavailableError
+        print(f"breaker: {reached} call(s) reached the model, {len(shed_latency)} reported unavailable "
+              f"(median {statistics.median(shed_latency) * 1e6:.0f}us), state={gateway.breaker.state}")
+        ok = ok and reached == 10 and errors == 9 and gateway.breaker.state == "open"
+
+        # --- recovery: wait out the cooldown, cancel the first probe, then a healthy one ---
+        app.state.error_rate = 0.0
+        await asyncio.sleep(1.1)
+        probe = asyncio.create_task(gateway.call("report", call))
+        await asyncio.sleep(0)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        print(f"recovery: probe cancelled, state={gateway.breaker.state} probing={gateway.breaker.probing}")
+        ok = ok and not gateway.breaker.probing
+        await gateway.call("report", call)
+        print(f"recovery: probe succeeded, state={gateway.breaker.state}")
+        ok = ok and gateway.breaker.state == "closed"
+
+        # --- hedging: same workload with and without hedged requests ---
+        app.state.slow_rate = args.slow_rate
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def timed(gateway: LLMGateway):
+            async with semaphore:
+                started = time.perf_counter()
+                await gateway.call("report", call)
+                return time.perf_counter() - started
+
+        hedge_after = args.latency_ms * 3 / 1000
+        results = {}
+        for label, hedge in (("no hedging", 0), (f"hedge after {hedge_after * 1000:.0f}ms", hedge_after)):
+            gateway = LLMGateway(max_concurrency=args.concurrency * 2, stage_limits={}, hedge_after=hedge, retries=0, breaker=breaker())
+            latencies = await asyncio.gather(*(timed(gateway) for _ in range(args.calls * 5)))
+            results[label] = _percentile(latencies, 0.99)
+            print(f"hedging: {label:<20} p50={_percentile(latencies, 0.5) * 1000:6.1f}ms "
+                  f"p99={results[label] * 1000:6.1f}ms hedged={gateway.stats['hedged']}")
+        plain, hedged = results.values()
+        ok = ok and hedged < plain
+    finally:
+        app.state.error_rate = app.state.slow_rate = 0.0
+        await close_genai_client()
+        server.should_exit = True
+        await server_task
+
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent calls in the hedging check")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="share of calls 10x slower in the hedging check")
+    parser.add_argument("--port", type=int, default=8089)
+    raise SystemExit(0 if asyncio.run(main(parser.parse_args())) else 1)
@@ -0,0 +1,94 @@
+"""
+Exercises the non-blocking task queue against a local webhook receiver.
+
+Submits N background jobs to a small worker pool and checks that submission returns
+at once, at most --workers jobs run concurrently, every result is pushed (the receiver
+answers the first delivery with HTTP 503 to force a retry) and tasks/get-style lookups
+see the completed tasks.
+
+    python -m bench.push_notifications --tasks 20 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+os.environ.setdefault("OMI_PUSH_BACKOFF_SECONDS", "0.05")
+
+receiver = FastAPI(title="Webhook receiver")
+receiver.state.deliveries = []
+receiver.state.attempts = 0
+
+
+@receiver.post("/webhook")
+async def webhook(request: Request):
+    receiver.state.attempts += 1
+    if receiver.state.attempts == 1:
+        return JSONResponse(status_code=503, content={"error": "warming up"})
+    receiver.state.deliveries.append((request.headers.get("authorization"), await request.json()))
+    return {"ok": True}
+
+
+async def main(tasks: int, workers: int, job_ms: float, port: int) -> bool:
+    from agents.task_queue import TaskQueue
+    from models.a2a import A2AMessage, MessagePart, PushNotificationConfig, TaskResult, TaskStatus
+
+    server = uvicorn.Server(uvicorn.Config(receiver, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    queue = TaskQueue(workers=workers, queue_size=tasks, store_size=tasks)
+    running = peak = 0
+
+    async def job() -> TaskResult:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(job_ms / 1000)
+        running -= 1
+        return TaskResult(
+            id="ignored", contextId="ignored",
+            status=TaskStatus(state="completed", message=A2AMessage(role="agent", parts=[MessagePart(kind="text", text="done")])),
+        )
+
+    push = PushNotificationConfig(url=f"http://127.0.0.1:{port}/webhook", token="bench-token")
+    started = time.perf_counter()
+    accepted = [queue.submit(job, request_id=str(i), push_config=push) for i in range(tasks)]
+    submit_elapsed = time.perf_counter() - started
+
+    deadline = time.monotonic() + 30
+    while len(receiver.state.deliveries) < tasks and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    elapsed = time.perf_counter() - started
+
+    await queue.stop()
+    server.should_exit = True
+    await server_task
+
+    states = {queue.get(task.id).status.state for task in accepted}
+    print(f"submitted {tasks} tasks in {submit_elapsed * 1000:.1f}ms, all pushed after {elapsed:.2f}s")
+    print(f"peak concurrency {peak} (limit {workers}), deliveries {len(receiver.state.deliveries)}, stats {queue.stats}")
+    ok = (
+        all(task.status.state == "working" for task in accepted)
+        and peak <= workers
+        and len(receiver.state.deliveries) == tasks
+        and all(auth == "Bearer bench-token" for auth, _ in receiver.state.deliveries)
+        and states == {"completed"}
+    )
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--job-ms", type=float, default=100.0)
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    raise SystemExit(0 if asyncio.run(main(args.tasks, args.workers, args.job_ms, args.port)) else 1)
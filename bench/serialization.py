@@ -0,0 +1,99 @@
+"""
+Micro-benchmark for the /a2a/parcel request decoding and response encoding path.
+
+Compares, per request, the previous path (json.loads, JSONRPCRequest(**body),
+response.model_dump() re-encoded by FastAPI's jsonable_encoder + JSONResponse) with the
+current one (TypeAdapter.validate_json on the body bytes, dump_json straight to bytes,
+pre-encoded connection-check reply). Reports CPU microseconds per request; no server,
+database or model is involved.
+
+    python -m bench.serialization --parcels 25 --iterations 2000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/omi-bench.db")
+os.environ.setdefault("GOOGLE_GEMENI_AI_KEY", "bench-key")
+
+
+def cpu_us(fn, iterations: int) -> float:
+    fn()
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main(args) -> bool:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from agents.parcel_agent import _completed_task
+    from agents.report_renderer import render_template_report
+    from main import rpc_request_adapter, rpc_response_adapter, verified_response
+    from models.a2a import A2AMessage, JSONRPCRequest, JSONRPCResponse, MessagePart
+    from utils.parcel_generator import generate_parcels
+
+    rows = list(generate_parcels(args.parcels, args.seed))
+    text = "; ".join(f"Parcel Id: {row['parcel_id']}; carrier: {row['carrier']}" for row in rows)
+    raw_request = json.dumps({
+        "jsonrpc": "2.0",
+        "id": "bench-1",
+        "method": "message/send",
+        "params": {"message": {"kind": "message", "role": "user", "parts": [{"kind": "text", "text": text}]}},
+    }).encode()
+    raw_verify = json.dumps({"jsonrpc": "2.0", "id": "bench-2", "method": "message/send", "params": {}}).encode()
+    history = [A2AMessage(role=role, parts=[MessagePart(kind="text", text=text)]) for role in ("user", "agent")]
+    response = JSONRPCResponse(id="bench-1", result=_completed_task(render_template_report(rows), "bench", history))
+
+    def old_decode():
+        return JSONRPCRequest(**json.loads(raw_request.decode("utf-8")))
+
+    def new_decode():
+        return rpc_request_adapter.validate_json(raw_request)
+
+    def old_encode():
+        return JSONResponse(jsonable_encoder(response.model_dump())).body
+
+    def new_encode():
+        return rpc_response_adapter.dump_json(response)
+
+    def old_verify():
+        body = json.loads(raw_verify.decode("utf-8"))
+        try:
+            JSONRPCRequest(**body)
+        except Exception:
+            JSONResponse(jsonable_encoder({"jsonrpc": "2.0", "id": body.get("id"), "result": {"kind": "task"}})).body
+
+    def new_verify():
+        try:
+            rpc_request_adapter.validate_json(raw_verify)
+        except Exception:
+            verified_response(json.loads(raw_verify).get("id")).body
+
+    # messageId is generated when missing, so it differs between any two decodes
+    generated = {"params": {"message": {"messageId"}}}
+    assert new_decode().model_dump(exclude=generated) == old_decode().model_dump(exclude=generated), "decoders disagree"
+    assert json.loads(new_encode()) == json.loads(old_encode()), "encoders disagree"
+
+    ok = True
+    print(f"{args.parcels} parcels per response ({len(new_encode())} bytes), {args.iterations} iterations")
+    for label, old, new in (("decode request", old_decode, new_decode),
+                            ("encode response", old_encode, new_encode),
+                            ("connection check", old_verify, new_verify)):
+        before, after = cpu_us(old, args.iterations), cpu_us(new, args.iterations)
+        print(f"{label:<18} before={before:8.1f}us  after={after:8.1f}us  {before / after:5.1f}x")
+        ok = ok and after < before
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--parcels", type=int, default=25)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    raise SystemExit(0 if main(parser.parse_args()) else 1)
@@ -0,0 +1,124 @@
+"""
+Measures worker startup: time to import main and time until the lifespan is ready to
+serve, each in a fresh interpreter so import caches do not carry over.
+
+  eager    - what startup used to do: google.genai imported with the agents, create_all on
+             every boot and the Gemini client built before serving
+  lazy     - the current default: one schema_version query; engine, TLS context and
+             Gemini client are built on first use
+  prewarm  - lazy, plus OMI_PREWARM_DB_CONNECTIONS / OMI_PREWARM_LLM in the background
+
+Also counts the SQL statements each startup sends (every one is a round trip to a remote
+database) and checks that the pre-warm actually finished after startup.
+
+    python -m bench.startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ("eager", "lazy", "prewarm")
+
+
+def child(mode: str) -> None:
+    started = time.perf_counter()
+    if mode == "eager":
+        import google.genai  # noqa: F401  (imported by the agents before the client was lazy)
+    import main
+    imported = time.perf_counter()
+
+    from sqlalchemy import event
+    import config.db as db
+    import config.llm as llm
+
+    statements = 0
+
+    def count(*_):
+        nonlocal statements
+        statements += 1
+
+    async def boot():
+        event.listen(db.get_async_engine().sync_engine, "before_cursor_execute", count)
+        async with main.lifespan(main.app):
+            if mode == "eager":
+                llm.init_genai_client()
+            ready = time.perf_counter()
+            warmed = None
+            if mode == "prewarm":
+                for _ in range(500):
+                    if db.get_async_engine().pool.checkedin() >= db.DB_PREWARM_CONNECTIONS and llm._genai_client is not None:
+                        warmed = time.perf_counter()
+                        break
+                    await asyncio.sleep(0.01)
+            result = {
+                "import_ms": (imported - started) * 1000,
+                "ready_ms": (ready - started) * 1000,
+                "warm_ms": (warmed - started) * 1000 if warmed else None,
+                "statements": statements,
+                "genai_loaded": "google.genai" in sys.modules,
+            }
+        print(json.dumps(result))
+
+    asyncio.run(boot())
+
+
+def run(mode: str, database_url: str) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        GOOGLE_GEMENI_AI_KEY="bench-key",
+        OMI_SCHEMA_MODE="create" if mode == "eager" else "check",
+        OMI_PREWARM_DB_CONNECTIONS="4" if mode == "prewarm" else "0",
+        OMI_PREWARM_LLM="true" if mode == "prewarm" else "false",
+        LOG_LEVEL="WARNING",
+    )
+    output = subprocess.run(
+        [sys.executable, "-m", "bench.startup", "--child", mode],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args) -> bool:
+    database_url = f"sqlite+aiosqlite:///{tempfile.gettempdir()}/omi-startup-bench.db"
+    # The create run stamps the schema the check runs expect
+    run("eager", database_url)
+
+    results = {}
+    for mode in MODES:
+        samples = [run(mode, database_url) for _ in range(args.runs)]
+        results[mode] = samples
+        median = lambda key: statistics.median(sample[key] for sample in samples)
+        warm = [sample["warm_ms"] for sample in samples if sample["warm_ms"] is not None]
+        print(f"{mode:<8} import={median('import_ms'):7.0f}ms  ready={median('ready_ms'):7.0f}ms  "
+              f"statements={samples[0]['statements']:3d}  google.genai loaded={samples[0]['genai_loaded']}"
+              + (f"  warm after {statistics.median(warm):.0f}ms" if warm else ""))
+
+    eager_ready = statistics.median(sample["ready_ms"] for sample in results["eager"])
+    lazy_ready = statistics.median(sample["ready_ms"] for sample in results["lazy"])
+    ok = (
+        lazy_ready < eager_ready
+        and all(sample["statements"] <= 1 for sample in results["lazy"])
+        and not any(sample["genai_loaded"] for sample in results["lazy"])
+        and all(sample["warm_ms"] is not None for sample in results["prewarm"])
+    )
+    print(f"ready {eager_ready / lazy_ready:.1f}x sooner")
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+    else:
+        raise SystemExit(0 if main(args) else 1)
@@ -0,0 +1,81 @@
+import os
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from google import genai
+
+load_dotenv()
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Optional override, e.g. a local fake model server used by the bench scripts
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "100"))
+GEMINI_MAX_KEEPALIVE = int(os.getenv("GEMINI_MAX_KEEPALIVE", "20"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+# Build the client in the background right after startup rather than on the first inquiry
+GEMINI_PREWARM = os.getenv("OMI_PREWARM_LLM", "false").lower() in ("1", "true", "yes")
+
+_http_client: Optional[httpx.AsyncClient] = None
+_genai_client: Optional["genai.Client"] = None
+# The client may be built from a warm-up thread while the first request asks for it
+_client_lock = threading.Lock()
+
+
+def init_genai_client() -> "genai.Client":
+    """
+    Builds the process-wide Gemini client backed by a pooled httpx.AsyncClient.
+    Safe to call more than once; the existing client is returned. google.genai is
+    imported here rather than at module load, since it dominates import time.
+    """
+    global _genai_client
+    with _client_lock:
+        if _genai_client is None:
+            _genai_client = _build_genai_client()
+        return _genai_client
+
+
+def _build_genai_client() -> "genai.Client":
+    global _http_client
+    from google import genai
+    from google.genai import types
+
+    api_key = os.getenv("GOOGLE_GEMENI_AI_KEY")
+    if not api_key:
+        logging.error("GEMINI_API_KEY is not set in environment variables.")
+        raise ValueError("API key missing.")
+
+    _http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=GEMINI_MAX_CONNECTIONS,
+            max_keepalive_connections=GEMINI_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(GEMINI_TIMEOUT_SECONDS),
+    )
+    http_options = types.HttpOptions(
+        base_url=GEMINI_BASE_URL,
+        httpx_async_client=_http_client,
+    )
+    client = genai.Client(api_key=api_key, http_options=http_options)
+    logging.info(f"Gemini client ready (model={GEMINI_MODEL}, max_connections={GEMINI_MAX_CONNECTIONS})")
+    return client
+
+
+def get_genai_client() -> "genai.Client":
+    """Returns the shared Gemini client, building it on first use."""
+    if _genai_client is None:
+        return init_genai_client()
+    return _genai_client
+
+
+async def close_genai_client() -> None:
+    """Releases the pooled connections held by the shared client."""
+    global _http_client, _genai_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _genai_client = None
@@ -0,0 +1,39 @@
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" emits one JSON object per line for log shippers; "text" is the human-readable format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def setup_logging() -> None:
+    """Configures the root logger once; per-request detail is only emitted at DEBUG."""
+    root = logging.getLogger()
+    if getattr(root, "_omi_configured", False):
+        return
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    root._omi_configured = True
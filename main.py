@@ -1,10 +1,14 @@
-from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
 import json
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Union
 from uuid import uuid4
+from pydantic import TypeAdapter, ValidationError
 from models.a2a import (
     JSONRPCRequest,
     JSONRPCResponse,
@@ -14,20 +18,58 @@ from models.a2a import (
     MessagePart,
     A2AMessage,
 )
-from agents.parcel_agent import process_message
-from config.db import Base, async_engine, get_async_db
-from sqlalchemy.ext.asyncio import AsyncSession
+from agents.parcel_agent import process_message, stream_message
+from agents.parcel_batch import process_batch
+from agents.task_queue import task_queue, QueueFullError
+from config.db import DB_PREWARM_CONNECTIONS, dispose_async_engine, prewarm_pool
+from config.llm import GEMINI_PREWARM, init_genai_client, close_genai_client
 from contextlib import asynccontextmanager
+from utils import analytics
 from utils.flood_db import populate_db
+from utils.ingest_db import IngestError, ingest_stream
+from utils.parcel_events import EVENT_RETENTION_DAYS, run_event_maintenance
+from utils.carrier_polling import CARRIER_POLLING, carrier_poller
+from utils.metrics import failures, render_metrics, stage_duration
+from utils.schema import ensure_schema
 from datetime import datetime
 
 
+async def prewarm() -> None:
+    """Opens pooled DB connections and builds the Gemini client off the request path."""
+    steps = []
+    if DB_PREWARM_CONNECTIONS > 0:
+        steps.append(prewarm_pool(DB_PREWARM_CONNECTIONS))
+    if GEMINI_PREWARM:
+        # google.genai takes about a second to import; keep it off the event loop
+        steps.append(asyncio.to_thread(init_genai_client))
+    for result in await asyncio.gather(*steps, return_exceptions=True):
+        if isinstance(result, Exception):
+            logging.warning(f"Warm-up failed, connecting on first use instead: {result}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Attempting a db table creation")
-    async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # A single schema_version query (OMI_SCHEMA_MODE); the engine and the shared Gemini
+    # client are built on first use, or in the background when pre-warming is enabled
+    await ensure_schema()
+    warm_up = asyncio.create_task(prewarm()) if DB_PREWARM_CONNECTIONS > 0 or GEMINI_PREWARM else None
+    task_queue.start()
+    # parcel_events retention and compaction (OMI_EVENT_RETENTION_DAYS=0 turns it off)
+    maintenance = asyncio.create_task(run_event_maintenance()) if EVENT_RETENTION_DAYS > 0 else None
+    # Refreshes non-terminal parcels from the carriers (OMI_CARRIER_POLLING=true)
+    if CARRIER_POLLING:
+        carrier_poller.start()
+    try:
         yield
+    finally:
+        if maintenance is not None:
+            maintenance.cancel()
+        if warm_up is not None:
+            warm_up.cancel()
+        await carrier_poller.stop()
+        await task_queue.stop()
+        await close_genai_client()
+        await dispose_async_engine()
 
 
 app = FastAPI(
@@ -38,95 +80,284 @@ app = FastAPI(
 )
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/flood")
-async def flood_table(db_session: AsyncSession = Depends(get_async_db)):
-    await populate_db(db_session)
+async def flood_table():
+    return await populate_db()
+
+
+@app.post("/parcels/bulk")
+async def bulk_ingest(request: Request):
+    """
+    Streams carrier status updates into the parcels table. The body is NDJSON (one
+    models.parcel.Parcel object per line) or, with Content-Type text/csv, CSV with a
+    header row. Returns inserted/updated/stale/rejected counts. When a batch cannot be
+    written, earlier batches stay committed and the 500 response carries their counts.
+    """
+    try:
+        return await ingest_stream(request.stream(), request.headers.get("content-type", ""))
+    except IngestError as e:
+        failures.inc(type="ingest_error")
+        return JSONResponse(status_code=500, content={
+            "error": str(e),
+            "failed_at_line": e.line,
+            "committed": e.result["inserted"] + e.result["updated"],
+            **e.result,
+        })
+
+
+def _csv(value: Optional[str]) -> List[str]:
+    """Comma-separated query values ("DHL,UPS") as a list."""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+@app.get("/analytics/counts")
+async def analytics_counts(group_by: str = "carrier,status", carrier: Optional[str] = None, status: Optional[str] = None,
+                           country: Optional[str] = None, city: Optional[str] = None):
+    """Parcel counts grouped by any of carrier, status, country, city, from the parcel_stats aggregate."""
+    dimensions = _csv(group_by)
+    unknown = [dimension for dimension in dimensions if dimension not in analytics.STAT_DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot group by {', '.join(unknown)}; use {', '.join(analytics.STAT_DIMENSIONS)}")
+    filters = {"carrier": _csv(carrier), "status": _csv(status), "country": _csv(country), "city": _csv(city)}
+    return await analytics.count_parcels(dimensions, filters)
+
+
+@app.get("/analytics/bbox")
+async def analytics_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                         status: Optional[str] = None, limit: int = 100):
+    """Parcels inside a bounding box; min_lng > max_lng means the box crosses the antimeridian."""
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+    return await analytics.parcels_in_box(min_lat, min_lng, max_lat, max_lng, _csv(status), limit)
+
+
+@app.get("/analytics/radius")
+async def analytics_radius(lat: float, lng: float, km: float, status: Optional[str] = None, limit: int = 100):
+    """Parcels within `km` kilometres of (lat, lng), nearest first."""
+    if km <= 0:
+        raise HTTPException(status_code=400, detail="km must be positive")
+    return await analytics.parcels_near(lat, lng, km, _csv(status), limit)
+
+
+@app.get("/analytics/overdue")
+async def analytics_overdue(carrier: Optional[str] = None, country: Optional[str] = None, limit: int = 100):
+    """Open parcels past their estimated arrival, most overdue first."""
+    return await analytics.overdue_parcels(carriers=_csv(carrier), countries=_csv(country), limit=limit)
+
+
+async def sse_events(request_id: str, events):
+    """Wraps each streamed task event in a JSON-RPC response and frames it as SSE."""
+    async for event in events:
+        response = JSONRPCResponse(jsonrpc="2.0", id=request_id, result=event)
+        yield f"data: {response.model_dump_json()}\n\n"
+
+
+# Built once: requests are validated straight from the body bytes and responses are
+# serialized straight to bytes, skipping json.loads and FastAPI's jsonable_encoder
+rpc_request_adapter = TypeAdapter(JSONRPCRequest)
+rpc_response_adapter = TypeAdapter(JSONRPCResponse)
+batch_response_adapter = TypeAdapter(List[Union[JSONRPCResponse, Dict[str, Any]]])
+
+
+def json_bytes(content: bytes, status_code: int = 200) -> Response:
+    return Response(content=content, status_code=status_code, media_type="application/json")
+
+
+def _verified_parts():
+    """
+    The reply to a connection check (a JSON-RPC envelope without valid params), encoded
+    once around the request id. Its task is not a real one, so the ids and timestamp
+    are fixed for the life of the process.
+    """
+    result = {
+        "id": str(uuid4()),
+        "contextId": str(uuid4()),
+        "status": {
+            "state": "completed",
+            "timestamp": datetime.utcnow().isoformat(),
+            "message": {
+                "kind": "message",
+                "role": "agent",
+                "parts": [
+                    {
+                        "kind": "text",
+                        "text": "A2A connection verified successfully.",
+                    }
+                ],
+                "messageId": f"msg-{str(uuid4())}",
+                "taskId": f"task-{str(uuid4())}",
+                "metadata": None,
+            },
+        },
+        "artifacts": [],
+        "history": [],
+        "kind": "task",
+    }
+    return b'{"jsonrpc":"2.0","id":', b',"result":' + json.dumps(result, separators=(",", ":")).encode() + b',"error":null}'
+
+
+VERIFIED_HEAD, VERIFIED_TAIL = _verified_parts()
+
+
+def verified_response(request_id) -> Response:
+    return json_bytes(VERIFIED_HEAD + json.dumps(request_id).encode() + VERIFIED_TAIL)
+
+
+def rpc_error(request_id, code: int, message: str) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+def call_args(rpc_request: JSONRPCRequest):
+    """Maps a message/send, message/stream or execute request onto process_message arguments."""
+    messages = []
+    context_id = None
+    task_id = None
+    config = None
+
+    if rpc_request.method in ("message/send", "message/stream"):
+        messages = [rpc_request.params.message]
+        config = rpc_request.params.configuration
+        context_id = rpc_request.params.message.contextId
+    elif rpc_request.method == "execute":
+        messages = rpc_request.params.messages
+        context_id = rpc_request.params.contextId
+        task_id = rpc_request.params.taskId
+    # Conversation and delta state is stored under the contextId the reply carries, so a
+    # client that echoes it back continues the same context
+    return messages, context_id or str(uuid4()), task_id, config
+
+
+def submit_background(rpc_request: JSONRPCRequest, messages, context_id, task_id, config):
+    """Queues a non-blocking inquiry; returns (http_status, JSON-RPC body)."""
+    try:
+        result = task_queue.submit(
+            lambda: process_message(messages, context_id, task_id, config),
+            request_id=rpc_request.id,
+            context_id=context_id,
+            push_config=config.pushNotificationConfig,
+        )
+    except QueueFullError as e:
+        return 503, rpc_error(rpc_request.id, -32000, str(e))
+    return 200, JSONRPCResponse(jsonrpc="2.0", id=rpc_request.id, result=result).model_dump()
+
+
+def get_task(rpc_request: JSONRPCRequest):
+    """tasks/get; returns (http_status, JSON-RPC body)."""
+    task = task_queue.get(rpc_request.params.id)
+    if task is None:
+        return 404, rpc_error(rpc_request.id, -32001, f"Task not found: {rpc_request.params.id}")
+    return 200, JSONRPCResponse(jsonrpc="2.0", id=rpc_request.id, result=task).model_dump()
+
+
+async def parcel_batch(items: list):
+    """
+    JSON-RPC 2.0 batch: blocking inquiries are processed together (one DB query, packed
+    LLM calls); every item gets its own response or error, in request order.
+    """
+    if not items:
+        return JSONResponse(status_code=400, content=rpc_error(None, -32600, "Invalid Request: empty batch"))
+
+    responses = [None] * len(items)
+    blocking = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or item.get("jsonrpc") != "2.0" or "id" not in item:
+            item_id = item.get("id") if isinstance(item, dict) else None
+            responses[index] = rpc_error(item_id, -32600, "Invalid JSON-RPC request, jsonrpc must be '2.0' and id is required")
+            continue
+        try:
+            rpc_request = JSONRPCRequest(**item)
+        except Exception as e:
+            responses[index] = rpc_error(item.get("id"), -32602, f"Invalid params: {e}")
+            continue
+
+        if rpc_request.method == "tasks/get":
+            _, responses[index] = get_task(rpc_request)
+        elif rpc_request.method == "message/stream":
+            responses[index] = rpc_error(rpc_request.id, -32600, "message/stream cannot be used inside a batch")
+        else:
+            messages, context_id, task_id, config = call_args(rpc_request)
+            if config is not None and not config.blocking:
+                _, responses[index] = submit_background(rpc_request, messages, context_id, task_id, config)
+            else:
+                blocking.append((index, rpc_request.id, (messages, context_id, task_id, config)))
+
+    if blocking:
+        results = await process_batch([call for _, _, call in blocking])
+        for (index, request_id, _), result in zip(blocking, results):
+            responses[index] = JSONRPCResponse(jsonrpc="2.0", id=request_id, result=result)
+    return json_bytes(batch_response_adapter.dump_json(responses))
 
 
 @app.post("/a2a/parcel")
-async def parcel_entry(
-    request: Request, db_session: AsyncSession = Depends(get_async_db)
-):
+async def parcel_entry(request: Request):
     """Main A2A endpoint for parcel agent"""
     try:
-        body = await request.body()
-        body = json.loads(body.decode("utf-8"))
-
-        # Validate minimal JSON-RPC envelope
-        if body.get("jsonrpc") != "2.0" or "id" not in body:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "jsonrpc": "2.0",
-                    "id": body.get("id"),
-                    "error": {
-                        "code": -32600,
-                        "message": "Invalid JSON-RPC request, jsonrpc must be '2.0' and id is required",
-                    },
-                },
-            )
-
+        raw_body = await request.body()
         try:
-            rpc_request = JSONRPCRequest(**body)
-        except Exception:
-            return {
-                "jsonrpc": "2.0",
-                "id": body.get("id"),
-                "result": {
-                    "id": str(uuid4()),
-                    "contextId": f"ctx-{str(uuid4())}",
-                    "status": {
-                        "state": "completed",
-                        "timestamp": datetime.utcnow().isoformat(),
-                        "message": {
-                            "kind": "message",
-                            "role": "agent",
-                            "parts": [
-                                {
-                                    "kind": "text",
-                                    "text": "A2A connection verified successfully.",
-                                }
-                            ],
-                            "messageId": f"msg-{str(uuid4())}",
-                            "taskId": f"task-{str(uuid4())}",
-                            "metadata": None,
+            # Well-formed single requests are decoded and validated in one pass
+            rpc_request = rpc_request_adapter.validate_json(raw_body)
+        except ValidationError:
+            body = json.loads(raw_body)
+
+            if isinstance(body, list):
+                return await parcel_batch(body)
+
+            # Validate minimal JSON-RPC envelope
+            if not isinstance(body, dict) or body.get("jsonrpc") != "2.0" or "id" not in body:
+                return JSONResponse(
+                    status_code=400,
+                    content={
+                        "jsonrpc": "2.0",
+                        "id": body.get("id") if isinstance(body, dict) else None,
+                        "error": {
+                            "code": -32600,
+                            "message": "Invalid JSON-RPC request, jsonrpc must be '2.0' and id is required",
                         },
                     },
-                    "artifacts": [],
-                    "history": [],
-                    "kind": "task",
-                },
-                "error": None,
-            }
-
-        # Extract messages
-        messages = []
-        context_id = None
-        task_id = None
-        config = None
-
-        if rpc_request.method == "message/send":
-            messages = [rpc_request.params.message]
-            config = rpc_request.params.configuration
-        elif rpc_request.method == "execute":
-            messages = rpc_request.params.messages
-            context_id = rpc_request.params.context_id
-            task_id = rpc_request.params.task_id
-
-        # Process and return the result
-        result = await process_message(
-            messages, context_id, task_id, config, db_session
-        )
+                )
 
-        response = JSONRPCResponse(
-            jsonrpc="2.0",
-            id=rpc_request.id,
-            result=result,
-        )
-        return response.model_dump()
+            # A valid envelope whose params do not parse is a connection check
+            return verified_response(body.get("id"))
+
+        if rpc_request.method == "tasks/get":
+            status_code, content = get_task(rpc_request)
+            return JSONResponse(status_code=status_code, content=content)
+
+        messages, context_id, task_id, config = call_args(rpc_request)
+
+        if rpc_request.method == "message/stream":
+            return StreamingResponse(
+                sse_events(rpc_request.id, stream_message(messages, context_id, task_id, config)),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        if config is not None and not config.blocking:
+            # Answer with a "working" task now; the result goes to the push URL / tasks/get
+            status_code, content = submit_background(rpc_request, messages, context_id, task_id, config)
+            return JSONResponse(status_code=status_code, content=content)
+
+        # Process and return the result. The agent opens its own short-lived DB session
+        # so identical concurrent inquiries can share a single retrieval.
+        result = await process_message(messages, context_id, task_id, config)
+
+        with stage_duration.time(stage="serialization"):
+            response = JSONRPCResponse(
+                jsonrpc="2.0",
+                id=rpc_request.id,
+                result=result,
+            )
+            return json_bytes(rpc_response_adapter.dump_json(response))
 
     except Exception as e:
-        print("Error:", e)
+        logging.exception(f"Error handling A2A request: {e}")
+        failures.inc(type="internal_error")
         return JSONResponse(
             status_code=500,
             content={
@@ -18,6 +18,7 @@ class A2AMessage(BaseModel):
     parts: List[MessagePart]
     messageId: str = Field(default_factory=lambda: str(uuid4()))
     taskId: Optional[str] = None
+    contextId: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
 
 
@@ -44,11 +45,16 @@ class ExecuteParams(BaseModel):
     messages: List[A2AMessage]
 
 
+class TaskQueryParams(BaseModel):
+    id: str
+    historyLength: Optional[int] = None
+
+
 class JSONRPCRequest(BaseModel):
     jsonrpc: Literal["2.0"]
     id: str
-    method: Literal["message/send", "execute"]
-    params: MessageParams | ExecuteParams
+    method: Literal["message/send", "message/stream", "execute", "tasks/get"]
+    params: MessageParams | ExecuteParams | TaskQueryParams
 
 
 class TaskStatus(BaseModel):
@@ -72,8 +78,25 @@ class TaskResult(BaseModel):
     kind: Literal["task"] = "task"
 
 
+class TaskStatusUpdateEvent(BaseModel):
+    kind: Literal["status-update"] = "status-update"
+    taskId: str
+    contextId: str
+    status: TaskStatus
+    final: bool = False
+
+
+class TaskArtifactUpdateEvent(BaseModel):
+    kind: Literal["artifact-update"] = "artifact-update"
+    taskId: str
+    contextId: str
+    artifact: Artifact
+    append: bool = False
+    lastChunk: bool = False
+
+
 class JSONRPCResponse(BaseModel):
     jsonrpc: Literal["2.0"] = "2.0"
     id: str
-    result: Optional[TaskResult] = None
+    result: Optional[TaskResult | TaskStatusUpdateEvent | TaskArtifactUpdateEvent] = None
     error: Optional[Dict[str, Any]] = None
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Float, String, DateTime, JSON
+from sqlalchemy import BigInteger, Column, Float, Index, Integer, String, DateTime, JSON
 from config.db import Base
 
 
@@ -12,4 +12,67 @@ class Parcel(Base):
     movement = Column(JSON)
     carrier = Column(String(length=255))
     tracking_url = Column(String(length=255))
+    # Owning merchant/dropshipper account, for account-wide inquiries
+    merchant_id = Column(String(length=255))
+    # When the carrier poller should refresh the parcel; NULL once it stops moving
+    next_poll_at = Column(DateTime)
+    # Copied out of location / movement on every write so analytics can filter on indexes
+    latitude = Column(Float)
+    longitude = Column(Float)
+    city = Column(String(length=255))
+    country = Column(String(length=255))
+    estimated_arrival = Column(DateTime)
 
+    __table_args__ = (
+        # "Open" / "delayed" parcels of one merchant, paged on (last_update, parcel_id)
+        Index("ix_parcels_merchant_status_update", "merchant_id", "status", "last_update"),
+        Index("ix_parcels_next_poll_at", "next_poll_at"),
+        # Bounding-box and radius queries (latitude range, longitude filtered in the index)
+        Index("ix_parcels_lat_lng", "latitude", "longitude"),
+        Index("ix_parcels_country_city_status", "country", "city", "status"),
+        # Open parcels past their estimated arrival, most overdue first
+        Index("ix_parcels_status_eta", "status", "estimated_arrival"),
+    )
+
+
+class ParcelStat(Base):
+    """
+    Parcel counts per (carrier, status, country, city), kept in step with the parcels
+    table by the ingest path. Unknown values are stored as "" so they can be part of
+    the key.
+    """
+    __tablename__ = "parcel_stats"
+    carrier = Column(String(length=255), primary_key=True)
+    status = Column(String(length=255), primary_key=True)
+    country = Column(String(length=255), primary_key=True)
+    city = Column(String(length=255), primary_key=True)
+    parcel_count = Column(Integer, nullable=False, default=0)
+
+
+class ParcelEvent(Base):
+    """Append-only status history; one row per (parcel_id, timestamp) update."""
+    __tablename__ = "parcel_events"
+    # SQLite only autoincrements INTEGER PRIMARY KEY
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    parcel_id = Column(String(length=255), nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    status = Column(String(length=255), nullable=False)
+    carrier = Column(String(length=255))
+    facility = Column(String(length=255))
+    city = Column(String(length=255))
+    country = Column(String(length=255))
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    __table_args__ = (
+        # Re-ingesting the same update must not duplicate history
+        Index("ux_parcel_events_parcel_time", "parcel_id", "timestamp", unique=True),
+        Index("ix_parcel_events_carrier_status_time", "carrier", "status", "timestamp"),
+    )
+
+
+class SchemaVersion(Base):
+    """One row per schema revision applied; startup only compares the highest against SCHEMA_VERSION."""
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    applied_at = Column(DateTime, nullable=False)
@@ -26,4 +26,5 @@ class Parcel(BaseModel):
     movement: Movement
     carrier: Optional[str] = None
     tracking_url: Optional[HttpUrl] = None
+    merchant_id: Optional[str] = None
 
@@ -0,0 +1,49 @@
+import os
+import socket
+import tempfile
+from contextlib import asynccontextmanager
+
+import pytest
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Read at import time by config.db / config.llm: a throwaway SQLite database and the
+# fake model server from bench/, never the deployment's DATABASE_URL or Gemini
+FAKE_GEMINI_PORT = _free_port()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/omi-test.db"
+os.environ["GOOGLE_GEMENI_AI_KEY"] = "test-key"
+os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{FAKE_GEMINI_PORT}"
+os.environ["OMI_CACHE_BACKEND"] = "memory"
+
+
+@pytest.fixture
+def fake_gemini():
+    """
+    Returns an async context manager that serves bench.fake_gemini in the test's event
+    loop (yielding its app.state, whose `calls` counts model requests) and afterwards
+    closes the Gemini client and the DB engine, both bound to that loop.
+    """
+    @asynccontextmanager
+    async def serve(latency_ms: float = 0.0):
+        from bench.fake_gemini import app, start_fake_gemini
+        from config.db import dispose_async_engine
+        from config.llm import close_genai_client
+        from utils.cache import caches
+
+        for cache in caches.values():
+            cache.clear()
+        server, task = await start_fake_gemini(FAKE_GEMINI_PORT, latency_ms)
+        try:
+            yield app.state
+        finally:
+            await close_genai_client()
+            await dispose_async_engine()
+            server.should_exit = True
+            await task
+
+    return serve
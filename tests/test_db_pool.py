@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import config.db as db
+
+POOL_SIZE = 2
+REQUESTS = 24
+LATENCY_MS = 200
+
+
+def test_pool_connections_are_not_held_across_llm_calls(fake_gemini, monkeypatch):
+    monkeypatch.setattr(db, "DB_POOL_SIZE", POOL_SIZE)
+    monkeypatch.setattr(db, "DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(db, "DB_POOL_TIMEOUT", 5.0)
+
+    async def scenario():
+        from agents.parcel_agent import process_message
+        from models.a2a import A2AMessage, MessagePart
+        from utils.ingest_db import ingest_parcels
+        from utils.parcel_generator import generate_parcels
+        from utils.schema import create_schema
+
+        async with fake_gemini(latency_ms=LATENCY_MS):
+            await create_schema(drop=True)
+            records = list(generate_parcels(REQUESTS + 1, seed=7))
+            await ingest_parcels(records)
+
+            peak = 0
+            sampling = True
+
+            async def sample_pool():
+                nonlocal peak
+                while sampling:
+                    peak = max(peak, db.get_async_engine().pool.checkedout())
+                    await asyncio.sleep(0.002)
+
+            # Free text, so every inquiry makes an extraction and a report call
+            messages = [
+                [A2AMessage(role="user", parts=[MessagePart(
+                    kind="text", text=f"hi, where is {record['parcel_id']} (sent with {record['carrier']})? thanks",
+                )])]
+                for record in records
+            ]
+            # Warm-up: the Gemini client, its connection and the first DB connections
+            await process_message(messages.pop())
+            sampler = asyncio.create_task(sample_pool())
+            started = time.perf_counter()
+            results = await asyncio.gather(*(process_message(message) for message in messages))
+            elapsed = time.perf_counter() - started
+            sampling = False
+            await sampler
+        return results, peak, elapsed
+
+    results, peak, elapsed = asyncio.run(scenario())
+    assert all(result.status.state == "completed" for result in results)
+    assert peak <= POOL_SIZE
+    # Holding a connection across both model calls would serialize the requests
+    # POOL_SIZE at a time; released connections let them all overlap
+    held_across_llm = REQUESTS / POOL_SIZE * 2 * LATENCY_MS / 1000
+    assert elapsed < held_across_llm / 3
@@ -0,0 +1,62 @@
+from agents.conversation import resolve_follow_up
+from agents.parcel_parser import parse_account_query
+
+CONTEXT = {
+    "parcels": [
+        {"parcel_id": "PKG001NG", "carrier": "DHL"},
+        {"parcel_id": "PKG002NG", "carrier": "UPS"},
+        {"parcel_id": "PKG003NG", "carrier": "FedEx"},
+    ],
+    "rows": [
+        {"parcel_id": "PKG001NG", "carrier": "DHL", "status": "in_transit", "city": "Lagos", "country": "Nigeria"},
+        {"parcel_id": "PKG002NG", "carrier": "UPS", "status": "delivered", "city": "Abuja", "country": "Nigeria"},
+        {"parcel_id": "PKG003NG", "carrier": "FedEx", "status": "pending", "city": "Kano", "country": "Nigeria"},
+    ],
+}
+
+
+def test_anaphoric_delay_question_is_not_an_account_query():
+    assert parse_account_query("are any of them delayed?") is None
+    assert parse_account_query("Are those still in transit?") is None
+
+
+def test_account_delay_question_still_parses():
+    query = parse_account_query("are any of my parcels delayed? merchant: M1")
+    assert query["scope"] == "delayed"
+    assert query["overdue"]
+    assert query["merchant_id"] == "M1"
+
+
+def test_digit_only_ids_are_not_account_queries():
+    assert parse_account_query("Status of my packages 9400111899223197428490 and 9400111899223197428491") is None
+    assert parse_account_query("Can you check all orders: 123456789, 987654321") is None
+
+
+def test_single_parcel_question_is_not_an_account_query():
+    assert parse_account_query("Is my package with DHL delayed?") is None
+    assert parse_account_query("how many of my parcels are in transit?")["scope"] == "in_transit"
+
+
+def test_delay_follow_up_keeps_open_parcels_of_the_context():
+    resolved = resolve_follow_up("are any of them delayed?", CONTEXT)
+    assert [item["parcel_id"] for item in resolved] == ["PKG001NG", "PKG003NG"]
+
+
+def test_delay_question_without_context_is_not_a_follow_up():
+    assert resolve_follow_up("are any of them delayed?", None) is None
+
+
+def test_new_inquiry_with_digit_only_id_is_not_a_follow_up():
+    assert resolve_follow_up("Parcel Id: 1234567890; carrier: DHL", CONTEXT) is None
+    assert resolve_follow_up("Parcel Id: 9400111899223197428490; carrier: USPS", CONTEXT) is None
+    assert resolve_follow_up("where is 9400111899223197428490 now?", CONTEXT) is None
+
+
+def test_yes_no_status_question_does_not_filter_by_status():
+    context = {"parcels": CONTEXT["parcels"][:1], "rows": CONTEXT["rows"][:1]}
+    assert resolve_follow_up("Is it delivered now?", context) == [{"parcel_id": "PKG001NG", "carrier": "DHL"}]
+
+
+def test_status_question_filters_by_status():
+    resolved = resolve_follow_up("which ones are delivered?", CONTEXT)
+    assert resolved == [{"parcel_id": "PKG002NG", "carrier": "UPS"}]
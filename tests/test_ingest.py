@@ -0,0 +1,38 @@
+import asyncio
+
+from sqlalchemy.exc import OperationalError
+
+from utils.ingest_db import _is_lock_conflict, iter_csv
+
+
+async def _chunks(data: bytes, size: int = 7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _parse(data: bytes):
+    async def collect():
+        return [record async for record in iter_csv(_chunks(data))]
+    return asyncio.run(collect())
+
+
+def test_csv_quoted_fields_may_span_lines():
+    records = _parse(
+        b'parcel_id,status,carrier,city\n'
+        b'P1,in_transit,DHL,"Lagos\nIsland"\n'
+        b'P2,pending,"UPS ""Express""",Kano\n'
+    )
+    assert [line for line, _ in records] == [2, 4]
+    assert records[0][1]["location"]["city"] == "Lagos\nIsland"
+    assert records[1][1]["carrier"] == 'UPS "Express"'
+
+
+def test_csv_unterminated_quote_is_rejected():
+    (line, error), = _parse(b'parcel_id,status\n"P1,pending\n')
+    assert line == 2 and isinstance(error, ValueError)
+
+
+def test_lock_conflicts_are_recognised():
+    assert _is_lock_conflict(OperationalError("stmt", {}, Exception(1213, "Deadlock found")))
+    assert _is_lock_conflict(OperationalError("stmt", {}, Exception("database is locked")))
+    assert not _is_lock_conflict(OperationalError("stmt", {}, Exception(1406, "Data too long")))
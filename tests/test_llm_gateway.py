@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from utils.llm_gateway import CircuitBreaker, LLMGateway
+
+
+def _gateway(**kwargs) -> LLMGateway:
+    return LLMGateway(
+        max_concurrency=kwargs.pop("max_concurrency", 32),
+        hedge_after=0,
+        retries=0,
+        breaker=CircuitBreaker(window=50, min_calls=10, failure_rate=0.5, cooldown=30),
+        **kwargs,
+    )
+
+
+def test_stage_limit_waiters_do_not_block_other_stages():
+    async def scenario():
+        gateway = _gateway(stage_limits={"extraction": 2}, queue_timeout=1)
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "extracted"
+
+        extractions = [asyncio.ensure_future(gateway.call("extraction", slow)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert gateway.in_flight == 2 and gateway.queued() == 1
+
+        async def fast():
+            return "report"
+
+        assert await gateway.call("report", fast) == "report"
+        release.set()
+        assert await asyncio.gather(*extractions) == ["extracted"] * 3
+        assert gateway.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_released_slot_goes_to_the_queued_call_that_can_run():
+    async def scenario():
+        gateway = _gateway(max_concurrency=2, stage_limits={"extraction": 1}, queue_timeout=1)
+        gates = {"extraction": asyncio.Event(), "report": asyncio.Event()}
+
+        def waiting_on(stage):
+            async def fn():
+                await gates[stage].wait()
+                return stage
+            return fn
+
+        running = [
+            asyncio.ensure_future(gateway.call("extraction", waiting_on("extraction"))),
+            asyncio.ensure_future(gateway.call("report", waiting_on("report"))),
+        ]
+        await asyncio.sleep(0)
+        # Queued behind the global limit: an extraction (its stage is full) and then a report
+        queued = [
+            asyncio.ensure_future(gateway.call("extraction", waiting_on("extraction"))),
+            asyncio.ensure_future(gateway.call("report", waiting_on("report"))),
+        ]
+        await asyncio.sleep(0)
+        gates["report"].set()
+        # The freed report slot goes to the queued report, not the extraction still over its limit
+        assert await asyncio.wait_for(asyncio.gather(running[1], queued[1]), 1) == ["report", "report"]
+        gates["extraction"].set()
+        assert await asyncio.wait_for(asyncio.gather(running[0], queued[0]), 1) == ["extraction", "extraction"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    async def scenario():
+        gateway = _gateway(queue_timeout=1)
+        gateway.breaker.opened_at = 0.0
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        probe = asyncio.ensure_future(gateway.call("report", hang))
+        await asyncio.sleep(0)
+        assert gateway.breaker.probing
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert not gateway.breaker.probing
+
+    asyncio.run(scenario())
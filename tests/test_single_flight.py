@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+SAMPLE_ROWS = [
+    {"parcel_id": "PKG002NG", "status": "in_transit", "last_update": "2025-11-01T10:00:00",
+     "location": {"latitude": 6.5244, "longitude": 3.3792, "city": "Lagos"}, "movement": {},
+     "carrier": "DHL", "tracking_url": None},
+]
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test")
+        started = 0
+
+        async def work():
+            nonlocal started
+            started += 1
+            await asyncio.sleep(0.01)
+            return object()
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(10)))
+        assert started == 1
+        assert all(result is results[0] for result in results)
+        assert flight.stats() == {"executions": 1, "shared": 9, "in_flight": 0}
+
+    asyncio.run(scenario())
+
+
+def test_leader_error_reaches_every_waiter():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        results = await asyncio.gather(*(flight.do("key", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_last_waiter_cancelling_stops_the_shared_call():
+    async def scenario():
+        flight = SingleFlight("test")
+        cancelled = asyncio.Event()
+
+        async def hang():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.ensure_future(flight.do("key", hang))
+        second = asyncio.ensure_future(flight.do("key", hang))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert not cancelled.is_set()
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_identical_inquiries_reach_the_model_once(fake_gemini):
+    async def scenario():
+        from agents.parcel_agent import generate_report, resolve_parcels
+
+        # Free text, so the fast-path parser declines it and extraction needs the model
+        inquiry = "hey, could you check where my parcel PKG002NG is? it ships with DHL"
+        async with fake_gemini(latency_ms=100) as model:
+            extracted = await asyncio.gather(*(resolve_parcels(inquiry) for _ in range(20)))
+            extraction_calls = model.calls
+            reports = await asyncio.gather(*(generate_report(SAMPLE_ROWS, "llm") for _ in range(20)))
+            report_calls = model.calls - extraction_calls
+
+        assert extraction_calls == 1 and report_calls == 1
+        assert all(result == extracted[0] for result in extracted)
+        assert all(report == reports[0] for report in reports)
+
+    asyncio.run(scenario())
@@ -0,0 +1,294 @@
+"""
+Operational analytics over the parcels table: counts per carrier/status/region from the
+parcel_stats aggregate, bounding-box and radius lookups on the latitude/longitude index,
+and open parcels past their estimated arrival. Nothing here reads the JSON columns.
+
+Existing databases can fill the denormalized columns and the aggregate once with:
+
+    python -m utils.analytics --backfill
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, delete, func, insert, literal, or_, select, update
+
+from config.db import dispose_async_engine, get_async_engine
+from models.db_model import Parcel, ParcelStat
+from utils.retrieve_db import pooled_connection
+
+# Upper bound on the parcel lists returned by bbox, radius and overdue queries
+ANALYTICS_MAX_ROWS = int(os.getenv("OMI_ANALYTICS_MAX_ROWS", "1000"))
+# Radius queries check at most this many candidates from the surrounding box
+ANALYTICS_MAX_SCAN = int(os.getenv("OMI_ANALYTICS_MAX_SCAN", "50000"))
+BACKFILL_BATCH_SIZE = 1000
+
+STAT_DIMENSIONS = ("carrier", "status", "country", "city")
+OPEN_STATUSES = ("pending", "in_transit")
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+ROW_COLUMNS = (
+    Parcel.parcel_id,
+    Parcel.carrier,
+    Parcel.status,
+    Parcel.city,
+    Parcel.country,
+    Parcel.latitude,
+    Parcel.longitude,
+    Parcel.estimated_arrival,
+    Parcel.last_update,
+)
+
+StatKey = Tuple[str, str, str, str]
+
+
+def stat_key(row: Dict[str, Any]) -> StatKey:
+    return tuple((row.get(dimension) or "") for dimension in STAT_DIMENSIONS)
+
+
+def _stat_upsert(dialect: str):
+    """Adds parcel_count to an existing aggregate row, or None when the dialect has no upsert."""
+    if dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        statement = dialect_insert(ParcelStat)
+        return statement.on_duplicate_key_update(parcel_count=ParcelStat.parcel_count + statement.inserted["parcel_count"])
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(ParcelStat)
+        return statement.on_conflict_do_update(
+            index_elements=[getattr(ParcelStat, dimension) for dimension in STAT_DIMENSIONS],
+            set_={"parcel_count": ParcelStat.parcel_count + statement.excluded["parcel_count"]},
+        )
+    return None
+
+
+async def apply_stat_deltas(conn, deltas: Counter) -> None:
+    """
+    Adds per-key count changes to parcel_stats inside the caller's transaction. Keys are
+    written in sorted order so concurrent batches lock aggregate rows in the same order.
+    """
+    changes = [
+        {**dict(zip(STAT_DIMENSIONS, key)), "parcel_count": delta}
+        for key, delta in sorted(deltas.items()) if delta
+    ]
+    if not changes:
+        return
+    statement = _stat_upsert(conn.dialect.name)
+    if statement is not None:
+        await conn.execute(statement, changes)
+        return
+    for change in changes:
+        matched = (await conn.execute(
+            update(ParcelStat)
+            .where(*(getattr(ParcelStat, dimension) == change[dimension] for dimension in STAT_DIMENSIONS))
+            .values(parcel_count=ParcelStat.parcel_count + change["parcel_count"])
+        )).rowcount
+        if not matched:
+            await conn.execute(insert(ParcelStat), [change])
+
+
+async def count_parcels(group_by: Iterable[str], filters: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    """Parcel counts grouped by any of STAT_DIMENSIONS, read from the aggregate table only."""
+    group_by = list(dict.fromkeys(group_by))
+    columns = [getattr(ParcelStat, dimension) for dimension in group_by]
+    total = func.sum(ParcelStat.parcel_count)
+    statement = select(*columns, total.label("count"))
+    for dimension, values in (filters or {}).items():
+        if values:
+            statement = statement.where(getattr(ParcelStat, dimension).in_(values))
+    if columns:
+        statement = statement.group_by(*columns)
+    statement = statement.having(total > 0).order_by(total.desc())
+
+    async with pooled_connection() as conn:
+        groups = [
+            {**{dimension: row[dimension] or None for dimension in group_by}, "count": int(row["count"])}
+            for row in (await conn.execute(statement)).mappings()
+        ]
+    return {"total": sum(group["count"] for group in groups), "groups": groups}
+
+
+def _box_filter(min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+    # A box whose west edge is east of its east edge crosses the antimeridian
+    longitude = (
+        Parcel.longitude.between(min_lng, max_lng) if min_lng <= max_lng
+        else or_(Parcel.longitude >= min_lng, Parcel.longitude <= max_lng)
+    )
+    return and_(Parcel.latitude.between(min_lat, max_lat), longitude)
+
+
+async def parcels_in_box(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                         statuses: Optional[List[str]] = None, limit: int = 100) -> Dict[str, Any]:
+    """Per-status counts and up to `limit` parcels inside the box, most recently updated first."""
+    condition = _box_filter(min_lat, min_lng, max_lat, max_lng)
+    if statuses:
+        condition = and_(condition, Parcel.status.in_(statuses))
+    async with pooled_connection() as conn:
+        by_status = {
+            status: count for status, count in
+            (await conn.execute(select(Parcel.status, func.count()).where(condition).group_by(Parcel.status))).all()
+        }
+        parcels = [dict(row) for row in (await conn.execute(
+            select(*ROW_COLUMNS).where(condition).order_by(Parcel.last_update.desc()).limit(min(limit, ANALYTICS_MAX_ROWS))
+        )).mappings()]
+    return {"total": sum(by_status.values()), "by_status": by_status, "parcels": parcels}
+
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle (haversine) distance."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _wrap_longitude(longitude: float) -> float:
+    return (longitude + 180) % 360 - 180
+
+
+async def parcels_near(latitude: float, longitude: float, radius_km: float,
+                       statuses: Optional[List[str]] = None, limit: int = 100) -> Dict[str, Any]:
+    """
+    Parcels within radius_km, nearest first. The surrounding box is read through the
+    latitude/longitude index and only those candidates get the exact distance check.
+    """
+    lat_span = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(-90.0, latitude - lat_span), min(90.0, latitude + lat_span)
+    # Longitude degrees shrink towards the poles; near one, take the whole band
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 1e-6 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        min_lng, max_lng = -180.0, 180.0
+    else:
+        lng_span = radius_km / (KM_PER_DEGREE * cos_lat)
+        min_lng, max_lng = _wrap_longitude(longitude - lng_span), _wrap_longitude(longitude + lng_span)
+
+    condition = _box_filter(min_lat, min_lng, max_lat, max_lng)
+    if statuses:
+        condition = and_(condition, Parcel.status.in_(statuses))
+    async with pooled_connection() as conn:
+        candidates = [dict(row) for row in (await conn.execute(
+            select(*ROW_COLUMNS).where(condition).limit(ANALYTICS_MAX_SCAN + 1)
+        )).mappings()]
+    truncated = len(candidates) > ANALYTICS_MAX_SCAN
+    if truncated:
+        logging.warning(f"Radius query around ({latitude}, {longitude}) hit the {ANALYTICS_MAX_SCAN} candidate cap")
+        candidates = candidates[:ANALYTICS_MAX_SCAN]
+
+    within = []
+    for row in candidates:
+        distance = distance_km(latitude, longitude, row["latitude"], row["longitude"])
+        if distance <= radius_km:
+            within.append({**row, "distance_km": round(distance, 3)})
+    within.sort(key=lambda row: row["distance_km"])
+    by_status = Counter(row["status"] for row in within)
+    return {
+        "total": len(within),
+        "by_status": dict(by_status),
+        "parcels": within[:min(limit, ANALYTICS_MAX_ROWS)],
+        "truncated": truncated,
+    }
+
+
+async def overdue_parcels(now: Optional[datetime] = None, carriers: Optional[List[str]] = None,
+                          countries: Optional[List[str]] = None, limit: int = 100) -> Dict[str, Any]:
+    """Open parcels whose estimated arrival has passed, most overdue first."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    condition = and_(Parcel.status.in_(OPEN_STATUSES), Parcel.estimated_arrival < now)
+    if carriers:
+        condition = and_(condition, Parcel.carrier.in_(carriers))
+    if countries:
+        condition = and_(condition, Parcel.country.in_(countries))
+    async with pooled_connection() as conn:
+        total = (await conn.execute(select(func.count()).where(condition))).scalar()
+        parcels = [dict(row) for row in (await conn.execute(
+            select(*ROW_COLUMNS).where(condition).order_by(Parcel.estimated_arrival).limit(min(limit, ANALYTICS_MAX_ROWS))
+        )).mappings()]
+    for row in parcels:
+        row["overdue_hours"] = round((now - row["estimated_arrival"]).total_seconds() / 3600, 1)
+    return {"total": total, "parcels": parcels}
+
+
+async def rebuild_stats() -> int:
+    """Recomputes parcel_stats from the parcels table (one full scan); returns the number of groups."""
+    dimensions = [func.coalesce(getattr(Parcel, dimension), literal("")) for dimension in STAT_DIMENSIONS]
+    async with get_async_engine().begin() as conn:
+        await conn.execute(delete(ParcelStat))
+        await conn.execute(
+            insert(ParcelStat).from_select(
+                [*STAT_DIMENSIONS, "parcel_count"],
+                select(*dimensions, func.count()).group_by(*dimensions),
+            )
+        )
+        return (await conn.execute(select(func.count()).select_from(ParcelStat))).scalar()
+
+
+def _as_naive_utc(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        moment = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def denormalized_columns(location: Optional[Dict[str, Any]], movement: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The analytics columns for a row, taken from its location / movement JSON."""
+    location, movement = location or {}, movement or {}
+    return {
+        "latitude": location.get("latitude"),
+        "longitude": location.get("longitude"),
+        "city": location.get("city"),
+        "country": location.get("country"),
+        "estimated_arrival": _as_naive_utc(movement.get("estimated_arrival")),
+    }
+
+
+async def backfill_columns(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Fills the denormalized columns of existing rows, paging on parcel_id; returns rows updated."""
+    statement = (
+        update(Parcel)
+        .where(Parcel.parcel_id == bindparam("key"))
+        .values({column: bindparam(f"new_{column}") for column in ("latitude", "longitude", "city", "country", "estimated_arrival")})
+    )
+    after, updated = "", 0
+    while True:
+        async with get_async_engine().begin() as conn:
+            page = (await conn.execute(
+                select(Parcel.parcel_id, Parcel.location, Parcel.movement)
+                .where(Parcel.parcel_id > after)
+                .order_by(Parcel.parcel_id)
+                .limit(batch_size)
+            )).all()
+            if not page:
+                return updated
+            await conn.execute(statement, [
+                {"key": parcel_id, **{f"new_{column}": value for column, value in denormalized_columns(location, movement).items()}}
+                for parcel_id, location, movement in page
+            ])
+        updated += len(page)
+        after = page[-1][0]
+
+
+async def _main(args) -> None:
+    try:
+        if args.backfill:
+            print(f"Backfilled analytics columns on {await backfill_columns()} parcels")
+        print(f"parcel_stats rebuilt: {await rebuild_stats()} groups")
+    finally:
+        await dispose_async_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill", action="store_true", help="fill latitude/longitude/city/country/estimated_arrival from the JSON columns first")
+    asyncio.run(_main(parser.parse_args()))
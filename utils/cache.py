@@ -0,0 +1,348 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Protocol
+
+from utils.metrics import register_collector
+
+# In-process LRU + TTL cache used by the agent to skip repeated Gemini calls.
+# Backends are pluggable: "memory" is private to each worker, "sqlite" shares one
+# local file between the workers of a multi-process deployment.
+
+CACHE_BACKEND = os.getenv("OMI_CACHE_BACKEND", "memory").lower()
+CACHE_SQLITE_PATH = os.getenv("OMI_CACHE_SQLITE_PATH", "omi-cache.sqlite3")
+# sqlite backend: an entry's LRU access time is refreshed at most this often
+CACHE_TOUCH_INTERVAL = float(os.getenv("OMI_CACHE_TOUCH_INTERVAL", "30"))
+# sqlite backend: queued writes applied per transaction, and keys per IN (...) read
+CACHE_WRITE_BATCH = 500
+CACHE_READ_CHUNK = 500
+
+# Pending-write marker for a deleted key
+_DELETED = object()
+
+
+class CacheBackend(Protocol):
+    evictions: int
+
+    def get(self, key: str) -> Optional[Any]: ...
+    def get_many(self, keys: List[str]) -> Dict[str, Any]: ...
+    def set(self, key: str, value: Any, ttl: float) -> None: ...
+    def delete(self, key: str) -> None: ...
+    def clear(self) -> None: ...
+    def __len__(self) -> int: ...
+
+
+class MemoryCacheBackend:
+    """OrderedDict-based LRU; expired entries are dropped lazily on access."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """
+    LRU + TTL table in a local SQLite file so several workers on one host share entries.
+    Values must be JSON-serializable.
+
+    Reads are one indexed SELECT (several keys at once with get_many), which in WAL mode
+    never waits on a writer. Writes - set, delete, expiry and the LRU access times - are
+    queued to a writer thread that applies them in batches, one transaction each, so the
+    event loop never holds the file's write lock. Until a write lands the entry is served
+    from a local pending map. Access times are only refreshed once they are older than
+    CACHE_TOUCH_INTERVAL, and the entry count is tracked rather than counted per write.
+    """
+
+    def __init__(self, maxsize: int, path: str, namespace: str):
+        self.maxsize = maxsize
+        self.namespace = namespace
+        self.evictions = 0
+        self._path = path
+        self._conn = self._connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_entries_lru ON cache_entries (namespace, accessed_at)"
+        )
+        self._size = self._count(self._conn)
+        self._writes_since_count = 0
+        # key -> (serialized value, expires_at) or _DELETED, until the writer has applied it
+        self._pending: Dict[str, Any] = {}
+        self._pending_lock = threading.Lock()
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._writer_pid: Optional[int] = None
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _count(self, conn: sqlite3.Connection) -> int:
+        return conn.execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+
+    def _enqueue(self, op: tuple) -> None:
+        # Started on first use, and again in a worker forked after the cache was built
+        if self._writer_pid != os.getpid():
+            self._writer_pid = os.getpid()
+            threading.Thread(target=self._write_loop, name=f"cache-writer-{self.namespace}", daemon=True).start()
+        self._queue.put(op)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        now = time.time()
+        found: Dict[str, Any] = {}
+        lookup: List[str] = []
+        with self._pending_lock:
+            pending = {key: self._pending[key] for key in keys if key in self._pending}
+        for key in keys:
+            entry = pending.get(key)
+            if entry is None:
+                lookup.append(key)
+            elif entry is not _DELETED and entry[1] > now:
+                found[key] = json.loads(entry[0])
+        for start in range(0, len(lookup), CACHE_READ_CHUNK):
+            chunk = lookup[start:start + CACHE_READ_CHUNK]
+            rows = self._conn.execute(
+                "SELECT key, value, expires_at, accessed_at FROM cache_entries"
+                f" WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                (self.namespace, *chunk),
+            ).fetchall()
+            for key, value, expires_at, accessed_at in rows:
+                if expires_at <= now:
+                    self._enqueue(("expire", key, now))
+                    continue
+                found[key] = json.loads(value)
+                if now - accessed_at >= CACHE_TOUCH_INTERVAL:
+                    self._enqueue(("touch", key, now))
+        return found
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        entry = (json.dumps(value, default=str), time.time() + ttl)
+        with self._pending_lock:
+            self._pending[key] = entry
+        self._enqueue(("set", key, entry))
+
+    def delete(self, key: str) -> None:
+        with self._pending_lock:
+            self._pending[key] = _DELETED
+        self._enqueue(("delete", key, _DELETED))
+
+    def clear(self) -> None:
+        with self._pending_lock:
+            self._pending.clear()
+        self._enqueue(("clear",))
+        self.flush()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Blocks until every write queued so far has been applied."""
+        done = threading.Event()
+        self._enqueue(("flush", done))
+        done.wait(timeout)
+
+    def __len__(self) -> int:
+        return max(self._size, 0)
+
+    def _write_loop(self) -> None:
+        conn = self._connect(self._path)
+        while True:
+            ops = [self._queue.get()]
+            while len(ops) < CACHE_WRITE_BATCH:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply(conn, ops)
+            except sqlite3.Error as e:
+                logging.warning(f"Cache '{self.namespace}' dropped {len(ops)} queued write(s): {e}")
+            finally:
+                with self._pending_lock:
+                    for op in ops:
+                        if op[0] in ("set", "delete") and self._pending.get(op[1]) is op[2]:
+                            del self._pending[op[1]]
+                for op in ops:
+                    if op[0] == "flush":
+                        op[1].set()
+
+    def _apply(self, conn: sqlite3.Connection, ops: List[tuple]) -> None:
+        now = time.time()
+        namespace = self.namespace
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for op in ops:
+                kind = op[0]
+                if kind == "set":
+                    value, expires_at = op[2]
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?)",
+                        (namespace, op[1], value, expires_at, now),
+                    )
+                    # Over-counts replaced keys; corrected by the periodic recount below
+                    self._size += 1
+                    self._writes_since_count += 1
+                elif kind == "delete":
+                    self._size -= conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, op[1])
+                    ).rowcount
+                elif kind == "expire":
+                    self._size -= conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                        (namespace, op[1], op[2]),
+                    ).rowcount
+                elif kind == "touch":
+                    conn.execute(
+                        "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                        (op[2], namespace, op[1]),
+                    )
+                elif kind == "clear":
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+                    self._size = 0
+            # Other workers write to the same table, so recount now and then, not just on overflow
+            if self._size > self.maxsize or self._writes_since_count >= max(1, self.maxsize // 10):
+                self._size = self._count(conn)
+                self._writes_since_count = 0
+                overflow = self._size - self.maxsize
+                if overflow > 0:
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                        " SELECT key FROM cache_entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                        (namespace, namespace, overflow),
+                    )
+                    self.evictions += overflow
+                    self._size -= overflow
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class TTLCache:
+    """Bounded cache with a default TTL and hit/miss/eviction counters."""
+
+    def __init__(self, name: str, backend: CacheBackend, ttl: float):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """{key: value} for the keys that are cached, in one backend round trip."""
+        keys = list(dict.fromkeys(keys))
+        found = self.backend.get_many(keys)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.backend.set(key, value, self.ttl if ttl is None else ttl)
+
+    def delete(self, key: str) -> None:
+        self.backend.delete(key)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.backend.evictions,
+            "size": len(self.backend),
+        }
+
+
+caches: Dict[str, TTLCache] = {}
+
+
+def build_cache(name: str, maxsize: int, ttl: float, backend: Optional[str] = None) -> TTLCache:
+    """Creates (and registers) a named cache on the configured backend."""
+    backend = (backend or CACHE_BACKEND).lower()
+    if backend == "sqlite":
+        store: CacheBackend = SQLiteCacheBackend(maxsize, CACHE_SQLITE_PATH, namespace=name)
+    elif backend == "memory":
+        store = MemoryCacheBackend(maxsize)
+    else:
+        raise ValueError(f"Unknown cache backend {backend!r}; expected 'memory' or 'sqlite'")
+
+    cache = TTLCache(name, store, ttl)
+    caches[name] = cache
+    logging.info(f"Cache '{name}' ready (backend={backend}, maxsize={maxsize}, ttl={ttl}s)")
+    return cache
+
+
+def _cache_samples(field: str, suffix: str = ""):
+    return [(suffix, {"cache": name}, cache.stats()[field]) for name, cache in caches.items()]
+
+
+register_collector("omi_cache_hits_total", "Cache hits by cache.", "counter", lambda: _cache_samples("hits"))
+register_collector("omi_cache_misses_total", "Cache misses by cache.", "counter", lambda: _cache_samples("misses"))
+register_collector("omi_cache_evictions_total", "Cache evictions by cache.", "counter", lambda: _cache_samples("evictions"))
+register_collector("omi_cache_entries", "Current number of entries by cache.", "gauge", lambda: _cache_samples("size"))
+
+
+def cache_key(*parts: Any) -> str:
+    """Stable short key for arbitrary JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
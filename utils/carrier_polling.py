@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import bindparam, select, update
+
+from config.db import get_async_engine
+from models.db_model import Parcel
+from utils.carriers import POLL_MAX_MINUTES, CarrierClient, adapter_for, next_poll_at
+from utils.ingest_db import ingest_parcels, new_result
+from utils.metrics import register_collector
+from utils.retrieve_db import IN_CHUNK_SIZE
+
+# Background refresh of non-terminal parcels. Every tick claims the parcels whose
+# next_poll_at has passed (oldest first), asks each carrier about them through its
+# CarrierClient and writes whatever came back through the bulk ingest path, which also
+# records history, invalidates the parcel cache and schedules the next poll.
+
+CARRIER_POLLING = os.getenv("OMI_CARRIER_POLLING", "false").lower() in ("1", "true", "yes")
+POLL_TICK_SECONDS = float(os.getenv("OMI_POLL_TICK_SECONDS", "30"))
+# Due parcels claimed per tick; a full claim starts the next tick at once
+POLL_BATCH_SIZE = int(os.getenv("OMI_POLL_BATCH_SIZE", "2000"))
+
+
+class CarrierPoller:
+    def __init__(self, batch_size: int = POLL_BATCH_SIZE, tick_seconds: float = POLL_TICK_SECONDS):
+        self.batch_size = batch_size
+        self.tick_seconds = tick_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._clients: Dict[str, CarrierClient] = {}
+        # (carrier, result) -> carrier API requests; carrier -> parcel records received
+        self.requests: Dict[Tuple[str, str], int] = {}
+        self.fetched: Dict[str, int] = {}
+
+    def start(self) -> None:
+        """Starts the polling loop on the running loop (idempotent)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logging.info(f"Carrier polling started (tick={self.tick_seconds}s, batch={self.batch_size})")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for client in self._clients.values():
+            await client.close()
+        self._clients = {}
+
+    def _client(self, carrier: str) -> Optional[CarrierClient]:
+        key = carrier.casefold()
+        if key not in self._clients:
+            adapter = adapter_for(carrier)
+            if adapter is None:
+                return None
+            self._clients[key] = CarrierClient(carrier, adapter)
+        return self._clients[key]
+
+    def _count(self, carrier: str, result: str) -> None:
+        self.requests[(carrier, result)] = self.requests.get((carrier, result), 0) + 1
+
+    async def _claim_due(self, now: datetime) -> List[Dict[str, Any]]:
+        """
+        Picks the due parcels and moves their next_poll_at forward before any carrier is
+        asked, so a slow or failing carrier is retried on the parcel's normal cadence
+        instead of every tick. Rows locked by another poller are skipped where supported.
+        """
+        async with get_async_engine().begin() as conn:
+            due = [dict(row) for row in (await conn.execute(
+                select(Parcel.parcel_id, Parcel.carrier, Parcel.status, Parcel.movement)
+                .where(Parcel.next_poll_at <= now)
+                .order_by(Parcel.next_poll_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).mappings()]
+            if not due:
+                return []
+            claims = []
+            for row in due:
+                if adapter_for(row["carrier"]) is None:
+                    # Nobody to ask; look again rarely in case an adapter is added
+                    claimed_until = now + timedelta(minutes=POLL_MAX_MINUTES)
+                else:
+                    claimed_until = next_poll_at(row, now)
+                claims.append({"key": row["parcel_id"], "claimed_until": claimed_until})
+            statement = (
+                update(Parcel)
+                .where(Parcel.parcel_id == bindparam("key"))
+                .values(next_poll_at=bindparam("claimed_until"))
+            )
+            for start in range(0, len(claims), IN_CHUNK_SIZE):
+                await conn.execute(statement, claims[start:start + IN_CHUNK_SIZE])
+        return due
+
+    async def _fetch(self, client: CarrierClient, parcel_ids: List[str]) -> List[Dict[str, Any]]:
+        try:
+            records = await client.fetch(parcel_ids)
+        except httpx.HTTPStatusError as e:
+            self._count(client.carrier, "rate_limited" if e.response.status_code == 429 else "error")
+            logging.warning(f"{client.carrier} tracking API answered HTTP {e.response.status_code}")
+            return []
+        except (httpx.HTTPError, ValueError) as e:
+            self._count(client.carrier, "error")
+            logging.warning(f"{client.carrier} tracking API failed: {e}")
+            return []
+        self._count(client.carrier, "ok")
+        self.fetched[client.carrier] = self.fetched.get(client.carrier, 0) + len(records)
+        for record in records:
+            if isinstance(record, dict):
+                record.setdefault("carrier", client.carrier)
+        return records
+
+    async def poll_once(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """One tick: claim due parcels, fetch them per carrier concurrently, write the results in batches."""
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        due = await self._claim_due(now)
+        by_carrier: Dict[str, List[str]] = {}
+        for row in due:
+            by_carrier.setdefault(row["carrier"] or "", []).append(row["parcel_id"])
+
+        fetches = []
+        for carrier, parcel_ids in by_carrier.items():
+            client = self._client(carrier)
+            if client is None:
+                continue
+            size = client.adapter.batch_size
+            fetches.extend(self._fetch(client, parcel_ids[start:start + size]) for start in range(0, len(parcel_ids), size))
+
+        records = [record for part in await asyncio.gather(*fetches) for record in part]
+        result = await ingest_parcels(records) if records else new_result()
+        return {"due": len(due), "fetched": len(records), **{key: result[key] for key in ("inserted", "updated", "stale", "rejected")}}
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            summary = {"due": 0}
+            try:
+                summary = await self.poll_once()
+                if summary["due"]:
+                    logging.info(
+                        f"Carrier poll: {summary['due']} due, {summary['fetched']} fetched, "
+                        f"{summary['updated']} updated, {summary['stale']} unchanged or stale"
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Carrier poll failed: {e}")
+            if summary["due"] < self.batch_size:
+                await asyncio.sleep(max(0.0, self.tick_seconds - (time.monotonic() - started)))
+
+
+carrier_poller = CarrierPoller()
+
+register_collector(
+    "omi_carrier_requests_total", "Carrier tracking API requests made by the poller, by carrier and result.", "counter",
+    lambda: [("", {"carrier": carrier, "result": result}, count) for (carrier, result), count in carrier_poller.requests.items()],
+)
+register_collector(
+    "omi_carrier_parcels_fetched_total", "Parcel records received from carrier tracking APIs.", "counter",
+    lambda: [("", {"carrier": carrier}, count) for carrier, count in carrier_poller.fetched.items()],
+)
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# Carrier tracking adapters, per-carrier HTTP pools and rate limits, and the refresh
+# policy deciding when a parcel should be polled next (the parcels.next_poll_at column).
+
+POLL_MIN_MINUTES = float(os.getenv("OMI_POLL_MIN_MINUTES", "15"))
+POLL_MAX_MINUTES = float(os.getenv("OMI_POLL_MAX_MINUTES", "720"))
+POLL_PENDING_MINUTES = float(os.getenv("OMI_POLL_PENDING_MINUTES", "360"))
+POLL_NO_ETA_MINUTES = float(os.getenv("OMI_POLL_NO_ETA_MINUTES", "180"))
+POLL_OVERDUE_MINUTES = float(os.getenv("OMI_POLL_OVERDUE_MINUTES", "60"))
+
+# Generic JSON tracking API used for every carrier without a dedicated adapter
+CARRIER_API_URL = os.getenv("OMI_CARRIER_API_URL")
+CARRIER_API_TOKEN = os.getenv("OMI_CARRIER_API_TOKEN")
+CARRIER_TIMEOUT_SECONDS = float(os.getenv("OMI_CARRIER_TIMEOUT_SECONDS", "10"))
+# Defaults per carrier; OMI_CARRIER_LIMITS='{"DHL": {"rate": 2, "burst": 4, "concurrency": 2}}' overrides them
+CARRIER_RATE_PER_SECOND = float(os.getenv("OMI_CARRIER_RATE_PER_SECOND", "5"))
+CARRIER_BURST = int(os.getenv("OMI_CARRIER_BURST", "10"))
+CARRIER_CONCURRENCY = int(os.getenv("OMI_CARRIER_CONCURRENCY", "4"))
+CARRIER_LIMITS: Dict[str, Dict[str, float]] = json.loads(os.getenv("OMI_CARRIER_LIMITS", "{}"))
+
+TERMINAL_STATUSES = {"delivered", "cancelled", "lost"}
+
+
+def _as_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, str) and value:
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def poll_interval(status: str, estimated_arrival: Any = None, now: Optional[datetime] = None) -> Optional[timedelta]:
+    """
+    How long until a parcel is worth asking the carrier about again, None for never.
+    In-transit parcels are polled more often the closer they are to their estimated
+    arrival (a quarter of the remaining time, within POLL_MIN/MAX_MINUTES); pending
+    ones rarely; delivered, cancelled and lost ones not at all.
+    """
+    if status in TERMINAL_STATUSES:
+        return None
+    if status == "pending":
+        minutes = POLL_PENDING_MINUTES
+    else:
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        eta = _as_datetime(estimated_arrival)
+        if eta is None:
+            minutes = POLL_NO_ETA_MINUTES
+        elif eta <= now:
+            minutes = POLL_OVERDUE_MINUTES
+        else:
+            minutes = (eta - now).total_seconds() / 60 / 4
+    return timedelta(minutes=min(max(minutes, POLL_MIN_MINUTES), POLL_MAX_MINUTES))
+
+
+def next_poll_at(row: Dict[str, Any], now: Optional[datetime] = None) -> Optional[datetime]:
+    """When to poll the parcel in a parcels row next, with ±10% jitter so polls spread out."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    interval = poll_interval(row.get("status"), (row.get("movement") or {}).get("estimated_arrival"), now)
+    if interval is None:
+        return None
+    return now + interval * random.uniform(0.9, 1.1)
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float) -> None:
+        """Stops handing out tokens for about `seconds`, e.g. after an HTTP 429 with Retry-After."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class CarrierAdapter:
+    """
+    Fetches the current state of a batch of parcels from one carrier. fetch() returns
+    records in the models/parcel.Parcel shape; parcels the carrier does not know are
+    simply left out. Subclass it for carriers with their own API and register it with
+    register_carrier_adapter().
+    """
+    batch_size = 50
+
+    async def fetch(self, client: httpx.AsyncClient, carrier: str, parcel_ids: List[str]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class HttpCarrierAdapter(CarrierAdapter):
+    """
+    Generic JSON tracking API (an aggregator, or the mock_carrier app in bench/carrier_polling.py):
+    POST {base_url}/track {"carrier": ..., "parcel_ids": [...]} -> {"parcels": [...]}.
+    """
+
+    def __init__(self, base_url: str, token: Optional[str] = None, batch_size: int = 50):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.batch_size = batch_size
+
+    async def fetch(self, client: httpx.AsyncClient, carrier: str, parcel_ids: List[str]) -> List[Dict[str, Any]]:
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        response = await client.post(
+            f"{self.base_url}/track", json={"carrier": carrier, "parcel_ids": parcel_ids}, headers=headers
+        )
+        response.raise_for_status()
+        return response.json().get("parcels", [])
+
+
+class CarrierClient:
+    """One carrier's adapter with its own connection pool, concurrency limit and rate limit."""
+
+    def __init__(self, carrier: str, adapter: CarrierAdapter):
+        limits = {**CARRIER_LIMITS.get("*", {}), **CARRIER_LIMITS.get(carrier, {})}
+        concurrency = int(limits.get("concurrency", CARRIER_CONCURRENCY))
+        self.carrier = carrier
+        self.adapter = adapter
+        self.bucket = TokenBucket(float(limits.get("rate", CARRIER_RATE_PER_SECOND)), int(limits.get("burst", CARRIER_BURST)))
+        self.slots = asyncio.Semaphore(concurrency)
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            timeout=httpx.Timeout(CARRIER_TIMEOUT_SECONDS),
+        )
+
+    async def fetch(self, parcel_ids: List[str]) -> List[Dict[str, Any]]:
+        async with self.slots:
+            await self.bucket.acquire()
+            try:
+                return await self.adapter.fetch(self.http, self.carrier, parcel_ids)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 429:
+                    retry_after = e.response.headers.get("retry-after", "")
+                    self.bucket.penalize(float(retry_after) if retry_after.replace(".", "", 1).isdigit() else 1.0)
+                raise
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+
+# carrier name (casefolded) -> adapter; "*" is used for carriers without their own entry
+carrier_adapters: Dict[str, CarrierAdapter] = {}
+if CARRIER_API_URL:
+    carrier_adapters["*"] = HttpCarrierAdapter(CARRIER_API_URL, CARRIER_API_TOKEN)
+
+
+def register_carrier_adapter(carrier: str, adapter: CarrierAdapter) -> None:
+    """Registers the adapter used to poll `carrier` ("*" for the default)."""
+    carrier_adapters[carrier.casefold() if carrier != "*" else carrier] = adapter
+
+
+def adapter_for(carrier: Optional[str]) -> Optional[CarrierAdapter]:
+    if carrier and carrier.casefold() in carrier_adapters:
+        return carrier_adapters[carrier.casefold()]
+    return carrier_adapters.get("*")
@@ -1,8 +1,4 @@
-from config.db import Base, async_engine, get_async_db
-from sqlalchemy.ext.asyncio import AsyncSession
-from models.db_model import Parcel
-from sqlalchemy.exc import TimeoutError, OperationalError
-from fastapi import Depends
+from utils.ingest_db import ingest_parcels
 
 from datetime import datetime, timedelta
 
@@ -95,9 +91,6 @@ parcel_seed_data = [
 ]
 
 
-async def populate_db(db_session):
-    for parcel in parcel_seed_data:
-        parcel_entry = Parcel(**parcel)
-        db_session.add(parcel_entry)
-    await db_session.commit()
-    
\ No newline at end of file
+async def populate_db():
+    """Upserts the seed parcels through the bulk ingest path, so it can be run repeatedly."""
+    return await ingest_parcels(parcel_seed_data)
@@ -0,0 +1,391 @@
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import os
+import random
+from collections import Counter
+from datetime import timezone
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+
+from config.db import get_async_engine
+from models.db_model import Parcel
+from models.parcel import Location, Movement, Parcel as ParcelUpdate
+from utils.analytics import apply_stat_deltas, denormalized_columns, stat_key
+from utils.carriers import next_poll_at
+from utils.parcel_cache import invalidate, parcel_key
+from utils.parcel_events import record_events
+
+# Bulk ingest of carrier status updates (POST /parcels/bulk and the /flood seeder).
+# The body is parsed line by line as it arrives, every record is validated with
+# models.parcel.Parcel and rows are written as batched upserts, one transaction per batch,
+# together with their parcel_events history rows and the parcel_stats count changes.
+
+INGEST_BATCH_SIZE = int(os.getenv("OMI_INGEST_BATCH_SIZE", "1000"))
+# Concurrent uploads touching the same key ranges can deadlock on the row/gap locks of the
+# stored-rows read; the database rolls one back and the batch is simply run again
+INGEST_LOCK_RETRIES = int(os.getenv("OMI_INGEST_LOCK_RETRIES", "3"))
+INGEST_RETRY_BACKOFF_SECONDS = float(os.getenv("OMI_INGEST_RETRY_BACKOFF_SECONDS", "0.05"))
+MAX_REPORTED_ERRORS = 20
+
+# MySQL deadlock / lock wait timeout; PostgreSQL deadlock_detected / serialization_failure
+LOCK_CONFLICT_CODES = {1213, 1205}
+LOCK_CONFLICT_SQLSTATES = {"40P01", "40001"}
+
+UPDATABLE_COLUMNS = (
+    "status", "last_update", "location", "movement", "carrier", "next_poll_at",
+    "latitude", "longitude", "city", "country", "estimated_arrival",
+)
+# Carrier feeds rarely know the merchant or tracking page: an update without one keeps the stored value
+KEEP_IF_NULL_COLUMNS = ("tracking_url", "merchant_id")
+# Flat CSV headers that belong inside the JSON columns; "location.city" style headers work too
+NESTED_FIELDS = {
+    **{field: "location" for field in Location.model_fields},
+    **{field: "movement" for field in Movement.model_fields},
+}
+
+Record = Tuple[int, Any]
+
+
+class IngestError(Exception):
+    """
+    A batch could not be written. Earlier batches are already committed: `result` holds
+    their counts and `line` is the first input line of the batch that was rolled back.
+    """
+
+    def __init__(self, message: str, result: Dict[str, Any], line: int):
+        super().__init__(message)
+        self.result = result
+        self.line = line
+
+
+def new_result() -> Dict[str, Any]:
+    return {"inserted": 0, "updated": 0, "stale": 0, "rejected": 0, "errors": []}
+
+
+def _reject(result: Dict[str, Any], line: int, message: str) -> None:
+    result["rejected"] += 1
+    if len(result["errors"]) < MAX_REPORTED_ERRORS:
+        result["errors"].append({"line": line, "error": message})
+
+
+def to_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Validates one status update and converts it to a parcels row."""
+    parcel = ParcelUpdate.model_validate(record)
+    row = parcel.model_dump(mode="json")
+    last_update = parcel.last_update
+    if last_update.tzinfo is not None:
+        # The column is a naive UTC DateTime
+        last_update = last_update.astimezone(timezone.utc).replace(tzinfo=None)
+    row["last_update"] = last_update
+    row["next_poll_at"] = next_poll_at(row)
+    row.update(denormalized_columns(row["location"], row["movement"]))
+    return row
+
+
+def _unflatten(row: Dict[str, str]) -> Dict[str, Any]:
+    record: Dict[str, Any] = {"location": {}, "movement": {}}
+    for header, value in row.items():
+        if header is None:
+            continue
+        value = value.strip() if isinstance(value, str) else value
+        if value == "":
+            value = None
+        group, _, field = header.strip().rpartition(".")
+        if group in ("location", "movement"):
+            record[group][field] = value
+        elif field in NESTED_FIELDS:
+            record[NESTED_FIELDS[field]][field] = value
+        else:
+            record[field] = value
+    return record
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Splits a byte stream into decoded lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[Record]:
+    """Yields (line number, record) pairs; malformed lines yield the exception instead."""
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, e
+
+
+async def iter_csv(chunks: AsyncIterable[bytes]) -> AsyncIterator[Record]:
+    """
+    CSV with a header row; nested fields as flat (city) or dotted (location.city) headers.
+    Quoted fields may contain newlines: lines are gathered until every quote is closed and
+    the whole record goes to csv.reader. Records are numbered by the line they start on.
+    """
+    header: Optional[List[str]] = None
+    line_number = start = quotes = 0
+    pending: List[str] = []
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not pending:
+            if not line.strip():
+                continue
+            start = line_number
+        pending.append(line)
+        # Escaped quotes are doubled, so an odd count means a quoted field is still open
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        values = next(csv.reader(["\n".join(pending)]))
+        pending, quotes = [], 0
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield start, ValueError(f"expected {len(header)} columns, got {len(values)}")
+            continue
+        yield start, _unflatten(dict(zip(header, values)))
+    if pending:
+        yield start, ValueError("unterminated quoted field")
+
+
+_upsert_statements: Dict[str, Any] = {}
+
+
+def _upsert_statement(dialect: str):
+    """
+    Insert-or-update on parcel_id for the dialect, or None when it has no upsert.
+    The statement carries no values: it is executed with the whole batch as
+    executemany parameters, so it compiles once and the driver packs the rows
+    into multi-row INSERTs (asyncmy/pymysql) or a prepared batch. The update only
+    applies when the incoming last_update is not older than the stored one, so a
+    concurrent writer's newer row is never overwritten.
+    """
+    if dialect in _upsert_statements:
+        return _upsert_statements[dialect]
+    statement = None
+    columns = Parcel.__table__.c
+    if dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        statement = dialect_insert(Parcel)
+        newer = statement.inserted.last_update >= columns.last_update
+        values = {
+            **{column: statement.inserted[column] for column in UPDATABLE_COLUMNS},
+            **{column: func.coalesce(statement.inserted[column], columns[column]) for column in KEEP_IF_NULL_COLUMNS},
+        }
+        # MySQL applies the assignments in order and later ones see earlier results, so
+        # last_update goes last: every guard compares against the stored value
+        statement = statement.on_duplicate_key_update([
+            (column, func.if_(newer, value, columns[column]))
+            for column, value in sorted(values.items(), key=lambda item: item[0] == "last_update")
+        ])
+    elif dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        statement = dialect_insert(Parcel)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Parcel.parcel_id],
+            set_={
+                **{column: statement.excluded[column] for column in UPDATABLE_COLUMNS},
+                **{column: func.coalesce(statement.excluded[column], columns[column]) for column in KEEP_IF_NULL_COLUMNS},
+            },
+            where=statement.excluded.last_update >= columns.last_update,
+        )
+    _upsert_statements[dialect] = statement
+    return statement
+
+
+def _is_lock_conflict(error: DBAPIError) -> bool:
+    """Deadlocks and lock timeouts, which the database resolves by rolling the transaction back."""
+    orig = error.orig
+    args = getattr(orig, "args", None) or (None,)
+    if args[0] in LOCK_CONFLICT_CODES:
+        return True
+    if (getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)) in LOCK_CONFLICT_SQLSTATES:
+        return True
+    return "database is locked" in str(orig)
+
+
+async def write_batch(rows: List[Dict[str, Any]], result: Dict[str, Any]) -> List[str]:
+    """
+    Upserts one batch in its own transaction. Updates older than the stored row are
+    skipped (counted as stale). Returns the parcel IDs that were written.
+
+    Parcel IDs are matched case-insensitively, like the parcel cache and MySQL's default
+    collation. The stored rows are read with FOR UPDATE, so the stale check and the
+    parcel_stats deltas cannot interleave with another writer (bulk ingest, the carrier
+    poller, another worker); the upsert repeats the last_update guard as well. A batch
+    rolled back by a deadlock or lock timeout is retried up to INGEST_LOCK_RETRIES times,
+    and the counts in `result` only change once it has committed.
+    """
+    newest: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        key = parcel_key(row["parcel_id"])
+        current = newest.get(key)
+        if current is None or row["last_update"] >= current["last_update"]:
+            newest[key] = row
+
+    for attempt in range(INGEST_LOCK_RETRIES + 1):
+        try:
+            fresh, updated = await _write_newest(rows, newest)
+            break
+        except DBAPIError as e:
+            if attempt == INGEST_LOCK_RETRIES or not _is_lock_conflict(e):
+                raise
+            logging.warning(f"Ingest batch hit a lock conflict (attempt {attempt + 1}), retrying: {e.orig}")
+            await asyncio.sleep(INGEST_RETRY_BACKOFF_SECONDS * 2 ** attempt * (1 + random.random()))
+
+    # After commit, so a concurrent read cannot cache the pre-write row again
+    invalidate(row["parcel_id"] for row in fresh)
+
+    result["stale"] += len(rows) - len(fresh)
+    result["updated"] += updated
+    result["inserted"] += len(fresh) - updated
+    return [row["parcel_id"] for row in fresh]
+
+
+async def _write_newest(rows: List[Dict[str, Any]], newest: Dict[str, Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """One attempt at write_batch's transaction; returns (rows written, how many of them were updates)."""
+    async with get_async_engine().begin() as conn:
+        stored = {parcel_key(row["parcel_id"]): row for row in (await conn.execute(
+            select(Parcel.parcel_id, Parcel.last_update, Parcel.carrier, Parcel.status, Parcel.country, Parcel.city)
+            .where(Parcel.parcel_id.in_([row["parcel_id"] for row in newest.values()]))
+            .order_by(Parcel.parcel_id)
+            .with_for_update()
+        )).mappings()}
+        fresh = [
+            row for key, row in newest.items()
+            if key not in stored or row["last_update"] >= stored[key]["last_update"]
+        ]
+        # Late updates are still history, so every valid row goes to parcel_events
+        await record_events(conn, rows)
+        if not fresh:
+            return [], 0
+
+        statement = _upsert_statement(conn.dialect.name)
+        if statement is not None:
+            await conn.execute(statement, fresh)
+        else:
+            inserts = [row for row in fresh if parcel_key(row["parcel_id"]) not in stored]
+            updates = [
+                {"key": stored[parcel_key(row["parcel_id"])]["parcel_id"], **{f"new_{column}": row[column] for column in UPDATABLE_COLUMNS + KEEP_IF_NULL_COLUMNS}}
+                for row in fresh if parcel_key(row["parcel_id"]) in stored
+            ]
+            if inserts:
+                await conn.execute(insert(Parcel), inserts)
+            if updates:
+                columns = Parcel.__table__.c
+                await conn.execute(
+                    update(Parcel)
+                    .where(Parcel.parcel_id == bindparam("key"))
+                    .values({
+                        **{column: bindparam(f"new_{column}") for column in UPDATABLE_COLUMNS},
+                        **{column: func.coalesce(bindparam(f"new_{column}"), columns[column]) for column in KEEP_IF_NULL_COLUMNS},
+                    }),
+                    updates,
+                )
+
+        # Each written row moves one parcel between aggregate groups (or adds it)
+        deltas: Counter = Counter()
+        for row in fresh:
+            previous = stored.get(parcel_key(row["parcel_id"]))
+            if previous is not None:
+                deltas[stat_key(previous)] -= 1
+            deltas[stat_key(row)] += 1
+        await apply_stat_deltas(conn, deltas)
+
+    return fresh, sum(1 for row in fresh if parcel_key(row["parcel_id"]) in stored)
+
+
+async def ingest_records(records: AsyncIterable[Record], batch_size: int = INGEST_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Validates (line, record) pairs and writes them in batches; returns the ingest counts.
+    One batch is written while the next is parsed; batches still commit in input order.
+    Raises IngestError, with the counts committed so far, when a batch cannot be written.
+    """
+    result = new_result()
+    batch: List[Dict[str, Any]] = []
+    batch_line = 0
+    writing: Optional[asyncio.Task] = None
+
+    async def write(rows: List[Dict[str, Any]], first_line: int) -> None:
+        try:
+            await write_batch(rows, result)
+        except SQLAlchemyError as e:
+            logging.error(f"Ingest batch starting at line {first_line} failed: {e}")
+            raise IngestError(f"Database write failed for the batch starting at line {first_line}", result, first_line) from e
+
+    try:
+        async for line, record in records:
+            if isinstance(record, Exception):
+                _reject(result, line, str(record))
+                continue
+            if not isinstance(record, dict):
+                _reject(result, line, "expected a JSON object")
+                continue
+            try:
+                row = to_row(record)
+            except ValidationError as e:
+                _reject(result, line, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                continue
+            except (TypeError, ValueError) as e:
+                _reject(result, line, str(e))
+                continue
+            if not batch:
+                batch_line = line
+            batch.append(row)
+            if len(batch) >= batch_size:
+                if writing is not None:
+                    await writing
+                writing = asyncio.create_task(write(batch, batch_line))
+                batch = []
+        if writing is not None:
+            await writing
+    except BaseException:
+        # e.g. the client went away mid-upload; the in-flight batch rolls back
+        if writing is not None:
+            writing.cancel()
+        raise
+    if batch:
+        await write(batch, batch_line)
+
+    logging.info(
+        f"Ingest finished: {result['inserted']} inserted, {result['updated']} updated, "
+        f"{result['stale']} stale, {result['rejected']} rejected"
+    )
+    return result
+
+
+async def _enumerate(records: Iterable[Dict[str, Any]]) -> AsyncIterator[Record]:
+    for index, record in enumerate(records, start=1):
+        yield index, record
+
+
+async def ingest_stream(chunks: AsyncIterable[bytes], content_type: str = "application/x-ndjson") -> Dict[str, Any]:
+    """Ingests an NDJSON or CSV (text/csv) upload as it streams in."""
+    parser = iter_csv if "csv" in (content_type or "").lower() else iter_ndjson
+    return await ingest_records(parser(chunks))
+
+
+async def ingest_parcels(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Ingests already-parsed records, e.g. generated or seed data."""
+    return await ingest_records(_enumerate(records))
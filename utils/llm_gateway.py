@@ -0,0 +1,377 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+
+from utils.metrics import register_collector
+
+# Admission control in front of every Gemini call. Calls take a slot from a global and a
+# per-stage limit, waiting in a priority queue (interactive requests before background
+# tasks) for at most LLM_QUEUE_TIMEOUT_SECONDS. Each call gets a deadline, slow calls are
+# hedged with a second request, and a circuit breaker trips on sustained 429/5xx/timeouts.
+# While it is open, or when no slot frees up in time, LLMUnavailableError is raised and
+# the agent degrades to its local template/parser paths instead of queueing.
+
+LLM_MAX_CONCURRENCY = int(os.getenv("OMI_LLM_MAX_CONCURRENCY", "32"))
+LLM_STAGE_LIMITS: Dict[str, int] = {
+    "extraction": 16,
+    "extraction_batch": 4,
+    "report": 16,
+    "report_batch": 4,
+    "next_step": 8,
+    **json.loads(os.getenv("OMI_LLM_STAGE_LIMITS", "{}")),
+}
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OMI_LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("OMI_LLM_CALL_TIMEOUT_SECONDS", "30"))
+# A call still running after this long gets a duplicate request if a slot is free (0 = off)
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("OMI_LLM_HEDGE_AFTER_SECONDS", "8"))
+LLM_RETRIES = int(os.getenv("OMI_LLM_RETRIES", "1"))
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("OMI_LLM_RETRY_BACKOFF_SECONDS", "0.5"))
+
+LLM_BREAKER_WINDOW = int(os.getenv("OMI_LLM_BREAKER_WINDOW", "50"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("OMI_LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("OMI_LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("OMI_LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+INTERACTIVE, BACKGROUND = 0, 1
+# Set by the background task queue; everything else is an interactive request
+llm_priority: ContextVar[int] = ContextVar("llm_priority", default=INTERACTIVE)
+
+T = TypeVar("T")
+
+
+class LLMUnavailableError(Exception):
+    """The gateway shed the call: circuit open, no slot before the queue deadline, or deadline hit."""
+
+
+class LLMAPIError(Exception):
+    """
+    An error answer from the model API, re-raised by the gateway in place of google.genai's
+    APIError so callers need not import google.genai (loaded lazily with the client).
+    """
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def _as_api_error(error: BaseException) -> Optional[LLMAPIError]:
+    # If google.genai was never imported, the error cannot have come from it
+    errors = sys.modules.get("google.genai.errors")
+    if errors is not None and isinstance(error, errors.APIError):
+        return LLMAPIError(error.code, str(error))
+    return None
+
+
+def is_transient(error: BaseException) -> bool:
+    """429 and 5xx answers, timeouts and connection failures; other 4xx are the caller's fault."""
+    if isinstance(error, LLMAPIError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Opens when at least `failure_rate` of the last `window` calls failed transiently. After
+    `cooldown` seconds one probe call is let through: success closes it, failure re-opens it.
+    """
+
+    def __init__(self, window: int, min_calls: int, failure_rate: float, cooldown: float):
+        self.outcomes: deque = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing or time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> Tuple[bool, bool]:
+        """Returns (allowed, is_probe)."""
+        if self.opened_at is None:
+            return True, False
+        if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+            return False, False
+        self.probing = True
+        return True, True
+
+    def abandon_probe(self) -> None:
+        """The probe ended without an outcome (cancelled, or no slot in time); the next call probes instead."""
+        self.probing = False
+
+    def record(self, ok: bool, probe: bool = False) -> None:
+        if probe:
+            self.probing = False
+            if ok:
+                self.opened_at = None
+                self.outcomes.clear()
+                logging.info("LLM circuit breaker closed")
+            else:
+                self.opened_at = time.monotonic()
+            return
+        if self.opened_at is not None:
+            # A call admitted before the breaker opened; it does not decide anything now
+            return
+        self.outcomes.append(ok)
+        failed = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_calls and failed / len(self.outcomes) >= self.failure_rate:
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            logging.warning(
+                f"LLM circuit breaker opened: {failed}/{len(self.outcomes)} recent calls failed, "
+                f"falling back to local rendering for {self.cooldown:.0f}s"
+            )
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        stage_limits: Optional[Dict[str, int]] = None,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        call_timeout: float = LLM_CALL_TIMEOUT_SECONDS,
+        hedge_after: float = LLM_HEDGE_AFTER_SECONDS,
+        retries: int = LLM_RETRIES,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.stage_limits = LLM_STAGE_LIMITS if stage_limits is None else stage_limits
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.hedge_after = hedge_after
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker(
+            LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_FAILURE_RATE, LLM_BREAKER_COOLDOWN_SECONDS
+        )
+        self.in_flight = 0
+        self.stage_in_flight: Dict[str, int] = {}
+        # (priority, arrival, stage, future)
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self.stats: Dict[str, int] = {"admitted": 0, "shed": 0, "hedged": 0, "retried": 0, "timeouts": 0}
+
+    def _has_room(self, stage: str) -> bool:
+        return (
+            self.in_flight < self.max_concurrency
+            and self.stage_in_flight.get(stage, 0) < self.stage_limits.get(stage, self.max_concurrency)
+        )
+
+    def _take(self, stage: str) -> None:
+        self.in_flight += 1
+        self.stage_in_flight[stage] = self.stage_in_flight.get(stage, 0) + 1
+
+    def _try_acquire(self, stage: str) -> bool:
+        """
+        Takes a slot unless a queued call that could run now is ahead (hedges never jump the
+        queue). Waiters held back only by their own stage's limit do not block other stages.
+        """
+        if not self._has_room(stage):
+            return False
+        if any(not waiter.done() and self._has_room(stage_waiting) for _, _, stage_waiting, waiter in self._waiters):
+            return False
+        self._take(stage)
+        return True
+
+    async def _acquire(self, stage: str, priority: int) -> None:
+        if self._try_acquire(stage):
+            self.stats["admitted"] += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), stage, waiter))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                self.stats["shed"] += 1
+                raise LLMUnavailableError(f"no {stage} LLM slot within {self.queue_timeout:.0f}s")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(stage)
+            else:
+                waiter.cancel()
+            raise
+        self.stats["admitted"] += 1
+
+    def _release(self, stage: str) -> None:
+        self.in_flight -= 1
+        self.stage_in_flight[stage] -= 1
+        # Hand freed slots to the best-placed waiters whose stage has room, skipping those
+        # still held back by their own stage's limit
+        skipped = []
+        while self._waiters and self.in_flight < self.max_concurrency:
+            entry = heapq.heappop(self._waiters)
+            _, _, stage_waiting, waiter = entry
+            if waiter.done():
+                continue
+            if self._has_room(stage_waiting):
+                self._take(stage_waiting)
+                waiter.set_result(None)
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def queued(self) -> int:
+        return sum(1 for _, _, _, waiter in self._waiters if not waiter.done())
+
+    async def _hedged(self, stage: str, fn: Callable[[], Awaitable[T]], deadline: float) -> T:
+        """Runs fn, adding one duplicate if it is still running after hedge_after; first success wins."""
+        tasks = {asyncio.ensure_future(fn())}
+        hedged = False
+        try:
+            error: Optional[BaseException] = None
+            while tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                wait_for = remaining
+                if not hedged and 0 < self.hedge_after < remaining:
+                    wait_for = self.hedge_after
+                done, _ = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if not hedged and wait_for < remaining and self._try_acquire(stage):
+                        hedged = True
+                        self.stats["hedged"] += 1
+                        tasks.add(asyncio.ensure_future(fn()))
+                    elif wait_for >= remaining:
+                        raise asyncio.TimeoutError()
+                    continue
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not hedged:
+                    # The only request failed; no point hedging a fast error
+                    break
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if hedged:
+                self._release(stage)
+
+    async def call(self, stage: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs one idempotent Gemini request under the gateway's limits. Transient failures are
+        retried while the deadline allows; LLMUnavailableError means "use the local fallback".
+        """
+        allowed, probe = self.breaker.allow()
+        if not allowed:
+            self.stats["shed"] += 1
+            raise LLMUnavailableError("LLM circuit breaker is open")
+        priority = llm_priority.get()
+        deadline = time.monotonic() + self.call_timeout
+
+        async def translated() -> T:
+            try:
+                return await fn()
+            except Exception as e:
+                api_error = _as_api_error(e)
+                if api_error is None:
+                    raise
+                raise api_error from e
+
+        try:
+            for attempt in range(self.retries + 1):
+                await self._acquire(stage, priority)
+                try:
+                    result = await self._hedged(stage, translated, deadline)
+                except Exception as e:
+                    if not is_transient(e):
+                        self.breaker.record(True, probe)
+                        probe = False
+                        raise
+                    self.breaker.record(False, probe)
+                    probe = False
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.stats["timeouts"] += 1
+                        raise LLMUnavailableError(f"{stage} LLM call exceeded {self.call_timeout:.0f}s") from e
+                    if self.breaker.state != "closed":
+                        raise LLMUnavailableError("LLM circuit breaker is open") from e
+                    if attempt == self.retries or deadline - time.monotonic() < LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt:
+                        raise
+                    logging.warning(f"{stage} LLM call failed transiently, retrying: {e}")
+                    self.stats["retried"] += 1
+                else:
+                    self.breaker.record(True, probe)
+                    probe = False
+                    return result
+                finally:
+                    self._release(stage)
+                await asyncio.sleep(LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+        finally:
+            # Cancelled, or shed while queueing, before the probe produced an outcome
+            if probe:
+                self.breaker.abandon_probe()
+
+    @asynccontextmanager
+    async def slot(self, stage: str):
+        """
+        Admission and breaker accounting for a streaming call (no hedging). Yields the call's
+        deadline (time.monotonic() based); the caller bounds each wait on the stream by it.
+        """
+        allowed, probe = self.breaker.allow()
+        if not allowed:
+            self.stats["shed"] += 1
+            raise LLMUnavailableError("LLM circuit breaker is open")
+        try:
+            await self._acquire(stage, llm_priority.get())
+            try:
+                yield time.monotonic() + self.call_timeout
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["timeouts"] += 1
+                api_error = _as_api_error(e)
+                self.breaker.record(not is_transient(api_error or e), probe)
+                probe = False
+                if api_error is not None:
+                    raise api_error from e
+                raise
+            else:
+                self.breaker.record(True, probe)
+                probe = False
+            finally:
+                self._release(stage)
+        finally:
+            # Client disconnected mid-stream (GeneratorExit / CancelledError) or no slot in time
+            if probe:
+                self.breaker.abandon_probe()
+
+
+llm_gateway = LLMGateway()
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+register_collector(
+    "omi_llm_gateway_events_total", "LLM gateway admissions, shed calls, hedges, retries and timeouts.", "counter",
+    lambda: [("", {"event": event}, count) for event, count in llm_gateway.stats.items()],
+)
+register_collector(
+    "omi_llm_gateway_in_flight", "Gemini calls holding a gateway slot, by stage.", "gauge",
+    lambda: [("", {"stage": stage}, count) for stage, count in llm_gateway.stage_in_flight.items()],
+)
+register_collector(
+    "omi_llm_gateway_queued", "Gemini calls waiting for a gateway slot.", "gauge",
+    lambda: [("", {}, llm_gateway.queued())],
+)
+register_collector(
+    "omi_llm_breaker_state", "LLM circuit breaker state (0 closed, 1 half-open, 2 open).", "gauge",
+    lambda: [("", {}, BREAKER_STATES[llm_gateway.breaker.state])],
+)
@@ -0,0 +1,152 @@
+import math
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Minimal Prometheus text-format registry (no client library dependency).
+# Counters and histograms are updated inline; collectors are callbacks evaluated on
+# scrape, for values that already live elsewhere (cache stats, pool state, ...).
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [f'{key}="{_escape(value)}"' for key, value in labels]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            # [bucket counts..., +Inf count, sum]
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {_format_value(count)}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-1])}")
+        return lines
+
+
+class Collector:
+    """Metric family whose samples are produced by a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, metric_type: str, collect: Callable[[], Iterable[Sample]]):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, labels, value in self.collect():
+            lines.append(f"{self.name}{suffix}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return lines
+
+
+_registry: Dict[str, object] = {}
+
+
+def counter(name: str, documentation: str) -> Counter:
+    return _registry.setdefault(name, Counter(name, documentation))
+
+
+def histogram(name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return _registry.setdefault(name, Histogram(name, documentation, buckets))
+
+
+def register_collector(name: str, documentation: str, metric_type: str, collect: Callable[[], Iterable[Sample]]) -> None:
+    _registry[name] = Collector(name, documentation, metric_type, collect)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry.values():
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f"# {metric.name} unavailable: {e}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Agent pipeline metrics ---
+
+stage_duration = histogram(
+    "omi_stage_duration_seconds",
+    "Time spent per pipeline stage (payload_extraction, gemini_extraction, db_retrieval, gemini_report, serialization).",
+)
+llm_call_duration = histogram("omi_llm_call_duration_seconds", "Latency of individual Gemini calls by purpose.")
+llm_tokens = counter("omi_llm_tokens_total", "Gemini tokens by purpose and kind (prompt, completion).")
+failures = counter("omi_failures_total", "Pipeline failures by type.")
+db_pool_wait = histogram("omi_db_pool_wait_seconds", "Time spent waiting to check a connection out of the SQLAlchemy pool.")
+
+
+def record_llm_usage(purpose: str, response) -> None:
+    """Adds a Gemini response's usage metadata to omi_llm_tokens_total."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    llm_tokens.inc(usage.prompt_token_count or 0, purpose=purpose, kind="prompt")
+    llm_tokens.inc(usage.candidates_token_count or 0, purpose=purpose, kind="completion")
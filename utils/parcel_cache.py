@@ -0,0 +1,86 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.cache import CACHE_BACKEND, build_cache
+
+# Read-through cache of parcels rows keyed by parcel_id, in front of retrieve_parcel_meta_by_id.
+# Terminal parcels never change again and are kept much longer than ones still moving;
+# unknown IDs are cached briefly as misses. The ingest path invalidates what it writes, in
+# its own process only: with the memory backend other workers keep serving their copy until
+# it expires, so there every TTL is capped at PARCEL_CACHE_LOCAL_MAX_TTL. The sqlite backend
+# is shared by the workers of one host and invalidated for all of them.
+
+PARCEL_CACHE_SIZE = int(os.getenv("OMI_PARCEL_CACHE_SIZE", "50000"))
+PARCEL_CACHE_TTL = float(os.getenv("OMI_PARCEL_CACHE_TTL", "60"))
+PARCEL_CACHE_TERMINAL_TTL = float(os.getenv("OMI_PARCEL_CACHE_TERMINAL_TTL", "86400"))
+PARCEL_CACHE_NEGATIVE_TTL = float(os.getenv("OMI_PARCEL_CACHE_NEGATIVE_TTL", "30"))
+# Longest a worker may serve a row another worker has since rewritten (memory backend)
+PARCEL_CACHE_LOCAL_MAX_TTL = float(os.getenv("OMI_PARCEL_CACHE_LOCAL_MAX_TTL", "300"))
+
+TERMINAL_STATUSES = {"delivered", "cancelled", "lost"}
+
+# Stored for IDs the database does not know (None already means "not cached")
+NOT_FOUND = {"__missing__": True}
+
+parcel_cache = build_cache("parcel", PARCEL_CACHE_SIZE, PARCEL_CACHE_TTL)
+_generation = 0
+
+
+def parcel_key(parcel_id: str) -> str:
+    # parcel_id comparisons follow the database collation, which is case-insensitive on MySQL
+    return parcel_id.strip().casefold()
+
+
+def ttl_for(row: Dict[str, Any]) -> float:
+    ttl = PARCEL_CACHE_TERMINAL_TTL if row.get("status") in TERMINAL_STATUSES else PARCEL_CACHE_TTL
+    return ttl if CACHE_BACKEND == "sqlite" else min(ttl, PARCEL_CACHE_LOCAL_MAX_TTL)
+
+
+def generation() -> int:
+    """Bumped on every invalidation; a fetch that straddles one must not be cached."""
+    return _generation
+
+
+def lookup(parcel_ids: Iterable[str]) -> Tuple[Dict[str, Optional[Dict[str, Any]]], List[str]]:
+    """
+    Returns ({key: row or None for known misses}, [parcel IDs that must be read from the DB]).
+    """
+    parcel_ids = list(parcel_ids)
+    cached = parcel_cache.get_many([parcel_key(parcel_id) for parcel_id in parcel_ids])
+    found: Dict[str, Optional[Dict[str, Any]]] = {}
+    misses: List[str] = []
+    for parcel_id in parcel_ids:
+        key = parcel_key(parcel_id)
+        row = cached.get(key)
+        if row is None:
+            misses.append(parcel_id)
+        elif row.get("__missing__"):
+            found[key] = None
+        else:
+            if isinstance(row.get("last_update"), str):
+                # The SQLite backend stores values as JSON
+                row = {**row, "last_update": datetime.fromisoformat(row["last_update"])}
+            found[key] = row
+    return found, misses
+
+
+def remember(parcel_ids: Iterable[str], rows: List[Dict[str, Any]], started_generation: int) -> None:
+    """Caches fetched rows and records the requested IDs the database did not return."""
+    if started_generation != _generation:
+        return
+    by_key = {parcel_key(row["parcel_id"]): row for row in rows}
+    for key, row in by_key.items():
+        parcel_cache.set(key, row, ttl_for(row))
+    for parcel_id in parcel_ids:
+        key = parcel_key(parcel_id)
+        if key not in by_key:
+            parcel_cache.set(key, NOT_FOUND, PARCEL_CACHE_NEGATIVE_TTL)
+
+
+def invalidate(parcel_ids: Iterable[str]) -> None:
+    """Drops written parcels, including negative entries for IDs that now exist."""
+    global _generation
+    _generation += 1
+    for parcel_id in parcel_ids:
+        parcel_cache.delete(parcel_key(parcel_id))
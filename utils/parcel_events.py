@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, insert, select
+
+from config.db import get_async_engine
+from models.db_model import ParcelEvent
+from utils.retrieve_db import IN_CHUNK_SIZE, pooled_connection
+
+# Movement history fed by the ingest path. parcels keeps only the latest state; every
+# accepted update (including late, out-of-order ones) is also appended here.
+
+EVENT_RETENTION_DAYS = int(os.getenv("OMI_EVENT_RETENTION_DAYS", "180"))
+# Older than this, repeated scans at the same facility with an unchanged status are collapsed
+EVENT_COMPACT_AFTER_DAYS = int(os.getenv("OMI_EVENT_COMPACT_AFTER_DAYS", "14"))
+EVENT_MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("OMI_EVENT_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+EVENT_DELETE_BATCH_SIZE = 5000
+
+HOP_FIELDS = ("timestamp", "status", "facility", "city", "country")
+
+
+def event_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Maps an ingested parcels row onto a parcel_events row."""
+    location = row.get("location") or {}
+    return {
+        "parcel_id": row["parcel_id"],
+        "timestamp": row["last_update"],
+        "status": row["status"],
+        "carrier": row.get("carrier"),
+        "facility": location.get("facility"),
+        "city": location.get("city"),
+        "country": location.get("country"),
+        "latitude": location.get("latitude"),
+        "longitude": location.get("longitude"),
+    }
+
+
+def _insert_ignore(dialect: str):
+    if dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        return dialect_insert(ParcelEvent).prefix_with("IGNORE")
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(ParcelEvent).on_conflict_do_nothing(index_elements=["parcel_id", "timestamp"])
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert(ParcelEvent).on_conflict_do_nothing(index_elements=["parcel_id", "timestamp"])
+    return None
+
+
+async def record_events(conn, rows: List[Dict[str, Any]]) -> None:
+    """Appends history for a batch of ingested rows inside the caller's transaction."""
+    events = list({(event["parcel_id"], event["timestamp"]): event for event in map(event_row, rows)}.values())
+    if not events:
+        return
+    statement = _insert_ignore(conn.dialect.name)
+    if statement is None:
+        # No INSERT ... IGNORE equivalent: skip the (parcel_id, timestamp) pairs already stored
+        stored = set((await conn.execute(
+            select(ParcelEvent.parcel_id, ParcelEvent.timestamp)
+            .where(ParcelEvent.parcel_id.in_({event["parcel_id"] for event in events}))
+        )).all())
+        events = [event for event in events if (event["parcel_id"], event["timestamp"]) not in stored]
+        if not events:
+            return
+        statement = insert(ParcelEvent)
+    await conn.execute(statement, events)
+
+
+async def recent_hops(parcel_ids: List[str], limit: int) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    The last `limit` events per parcel, oldest first, keyed by parcel_id.
+    Served from the (parcel_id, timestamp) index with one windowed query per ID chunk.
+    """
+    hops: Dict[str, List[Dict[str, Any]]] = {}
+    if not parcel_ids or limit <= 0:
+        return hops
+    columns = [getattr(ParcelEvent, field) for field in HOP_FIELDS]
+    async with pooled_connection() as conn:
+        for start in range(0, len(parcel_ids), IN_CHUNK_SIZE):
+            ranked = (
+                select(
+                    ParcelEvent.parcel_id, *columns,
+                    func.row_number().over(
+                        partition_by=ParcelEvent.parcel_id, order_by=ParcelEvent.timestamp.desc()
+                    ).label("hop_rank"),
+                )
+                .where(ParcelEvent.parcel_id.in_(parcel_ids[start:start + IN_CHUNK_SIZE]))
+                .subquery()
+            )
+            result = await conn.execute(
+                select(ranked.c.parcel_id, *(ranked.c[field] for field in HOP_FIELDS))
+                .where(ranked.c.hop_rank <= limit)
+                .order_by(ranked.c.parcel_id, ranked.c.timestamp)
+            )
+            for row in result.mappings():
+                hops.setdefault(row["parcel_id"], []).append({field: row[field] for field in HOP_FIELDS})
+    return hops
+
+
+async def attach_recent_hops(rows: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """Copies of the rows with a recent_hops list, for the report stage."""
+    hops = await recent_hops([row["parcel_id"] for row in rows], limit)
+    return [{**row, "recent_hops": hops.get(row["parcel_id"], [])} for row in rows]
+
+
+async def events_between(start: datetime, end: datetime, carrier: Optional[str] = None,
+                         status: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Events in [start, end), newest first. With carrier (and status) the lookup runs on the
+    (carrier, status, timestamp) index, e.g. "what stalled in transit with DHL in the last 48h".
+    """
+    conditions = [ParcelEvent.timestamp >= start, ParcelEvent.timestamp < end]
+    if carrier is not None:
+        conditions.append(ParcelEvent.carrier == carrier)
+    if status is not None:
+        conditions.append(ParcelEvent.status == status)
+    async with pooled_connection() as conn:
+        result = await conn.execute(
+            select(ParcelEvent.parcel_id, ParcelEvent.carrier, *(getattr(ParcelEvent, field) for field in HOP_FIELDS))
+            .where(and_(*conditions))
+            .order_by(ParcelEvent.timestamp.desc())
+            .limit(limit)
+        )
+        return [dict(row) for row in result.mappings()]
+
+
+async def _delete_ids(conn, ids: List[int]) -> int:
+    if ids:
+        await conn.execute(delete(ParcelEvent).where(ParcelEvent.id.in_(ids)))
+    return len(ids)
+
+
+async def purge_expired_events(now: Optional[datetime] = None) -> int:
+    """Deletes events past the retention window, in bounded transactions."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = now - timedelta(days=EVENT_RETENTION_DAYS)
+    removed = 0
+    while True:
+        async with get_async_engine().begin() as conn:
+            ids = list((await conn.execute(
+                select(ParcelEvent.id).where(ParcelEvent.timestamp < cutoff).limit(EVENT_DELETE_BATCH_SIZE)
+            )).scalars())
+            removed += await _delete_ids(conn, ids)
+        if len(ids) < EVENT_DELETE_BATCH_SIZE:
+            return removed
+
+
+async def compact_events(now: Optional[datetime] = None) -> int:
+    """
+    Collapses old runs of scans that changed neither status nor facility (e.g. daily
+    "in_transit" pings from the same hub) down to the first event of each run, so
+    status transitions and every facility on the route are kept.
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = now - timedelta(days=EVENT_COMPACT_AFTER_DAYS)
+    runs = (
+        select(
+            ParcelEvent.id,
+            ParcelEvent.status,
+            ParcelEvent.facility,
+            func.lag(ParcelEvent.status).over(
+                partition_by=ParcelEvent.parcel_id, order_by=ParcelEvent.timestamp
+            ).label("previous_status"),
+            func.lag(ParcelEvent.facility).over(
+                partition_by=ParcelEvent.parcel_id, order_by=ParcelEvent.timestamp
+            ).label("previous_facility"),
+        )
+        .where(ParcelEvent.timestamp < cutoff)
+        .subquery()
+    )
+    removed = 0
+    while True:
+        async with get_async_engine().begin() as conn:
+            ids = list((await conn.execute(
+                select(runs.c.id)
+                .where(runs.c.status == runs.c.previous_status, runs.c.facility == runs.c.previous_facility)
+                .limit(EVENT_DELETE_BATCH_SIZE)
+            )).scalars())
+            removed += await _delete_ids(conn, ids)
+        if len(ids) < EVENT_DELETE_BATCH_SIZE:
+            return removed
+
+
+async def run_event_maintenance() -> None:
+    """
+    Background loop started from the FastAPI lifespan: retention, then compaction.
+    The first pass waits one interval so worker start-up does not hit the database.
+    """
+    while True:
+        await asyncio.sleep(EVENT_MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            purged = await purge_expired_events()
+            compacted = await compact_events()
+            if purged or compacted:
+                logging.info(f"parcel_events maintenance: {purged} expired, {compacted} compacted")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"parcel_events maintenance failed: {e}")
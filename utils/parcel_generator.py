@@ -0,0 +1,183 @@
+"""
+Synthetic parcel population for load and scale testing.
+
+Records follow the models/parcel.Parcel shape (Location/Movement included) with a
+spread of carriers, statuses, merchants, coordinates and timestamps. The same --seed and --now
+always produce the same rows.
+
+    python -m utils.parcel_generator --count 1000000 --out parcels.ndjson
+    python -m utils.parcel_generator --count 200000 --db        # bulk upsert into DATABASE_URL
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Any, Dict, Iterator, Optional
+
+# (carrier, weight, tracking URL template)
+CARRIERS = [
+    ("DHL", 18, "https://www.dhl.com/track?{parcel_id}"),
+    ("FedEx", 14, "https://www.fedex.com/fedextrack/?trknbr={parcel_id}"),
+    ("UPS", 14, "https://www.ups.com/track?tracknum={parcel_id}"),
+    ("USPS", 8, "https://tools.usps.com/go/TrackConfirmAction?tLabels={parcel_id}"),
+    ("Royal Mail", 6, "https://www.royalmail.com/track?{parcel_id}"),
+    ("Hermes", 6, "https://www.myhermes.de/track?{parcel_id}"),
+    ("DPD", 6, "https://tracking.dpd.de/status/{parcel_id}"),
+    ("Japan Post", 5, "https://www.post.japanpost.jp/track?{parcel_id}"),
+    ("Aramex", 5, "https://www.aramex.com/track/results?ShipmentNumber={parcel_id}"),
+    ("GIG Logistics", 8, "https://giglogistics.com/track/{parcel_id}"),
+    ("Canada Post", 4, "https://www.canadapost-postescanada.ca/track/{parcel_id}"),
+    ("Australia Post", 4, "https://auspost.com.au/mypost/track/#/details/{parcel_id}"),
+]
+
+# (status, weight) - most traffic is in flight or already delivered
+STATUSES = [("in_transit", 45), ("delivered", 35), ("pending", 12), ("cancelled", 5), ("lost", 3)]
+
+# (city, state, country, ISO code, latitude, longitude)
+CITIES = [
+    ("Lagos", "Lagos", "Nigeria", "NG", 6.5244, 3.3792),
+    ("Abuja", "FCT", "Nigeria", "NG", 9.0765, 7.3986),
+    ("Accra", "Greater Accra", "Ghana", "GH", 5.6037, -0.187),
+    ("Nairobi", "Nairobi", "Kenya", "KE", -1.2921, 36.8219),
+    ("Johannesburg", "Gauteng", "South Africa", "ZA", -26.2041, 28.0473),
+    ("Cairo", "Cairo", "Egypt", "EG", 30.0444, 31.2357),
+    ("London", "England", "United Kingdom", "GB", 51.5074, -0.1278),
+    ("Manchester", "England", "United Kingdom", "GB", 53.4808, -2.2426),
+    ("Berlin", "Berlin", "Germany", "DE", 52.52, 13.405),
+    ("Hamburg", "Hamburg", "Germany", "DE", 53.5511, 9.9937),
+    ("Paris", "Ile-de-France", "France", "FR", 48.8566, 2.3522),
+    ("Amsterdam", "North Holland", "Netherlands", "NL", 52.3676, 4.9041),
+    ("Madrid", "Madrid", "Spain", "ES", 40.4168, -3.7038),
+    ("New York", "New York", "United States", "US", 40.7128, -74.006),
+    ("Los Angeles", "California", "United States", "US", 34.0522, -118.2437),
+    ("Chicago", "Illinois", "United States", "US", 41.8781, -87.6298),
+    ("Toronto", "Ontario", "Canada", "CA", 43.6532, -79.3832),
+    ("Sao Paulo", "Sao Paulo", "Brazil", "BR", -23.5505, -46.6333),
+    ("Tokyo", "Tokyo", "Japan", "JP", 35.6762, 139.6503),
+    ("Osaka", "Osaka", "Japan", "JP", 34.6937, 135.5023),
+    ("Shanghai", "Shanghai", "China", "CN", 31.2304, 121.4737),
+    ("Shenzhen", "Guangdong", "China", "CN", 22.5431, 114.0579),
+    ("Mumbai", "Maharashtra", "India", "IN", 19.076, 72.8777),
+    ("Dubai", "Dubai", "United Arab Emirates", "AE", 25.2048, 55.2708),
+    ("Sydney", "New South Wales", "Australia", "AU", -33.8688, 151.2093),
+]
+
+# Merchant accounts own Zipf-like shares of the population: MRC0001 holds ~17% of all
+# parcels, MRC0200 under 0.1%
+MERCHANT_COUNT = 200
+
+_CARRIER_CHOICES = [(name, template) for name, _, template in CARRIERS]
+_CARRIER_WEIGHTS = list(accumulate(weight for _, weight, _ in CARRIERS))
+_STATUS_CHOICES = [name for name, _ in STATUSES]
+_STATUS_WEIGHTS = list(accumulate(weight for _, weight in STATUSES))
+_MERCHANT_CHOICES = [f"MRC{rank:04d}" for rank in range(1, MERCHANT_COUNT + 1)]
+_MERCHANT_WEIGHTS = list(accumulate(1 / rank for rank in range(1, MERCHANT_COUNT + 1)))
+
+FACILITY_KINDS = ["Sorting Center", "Distribution Hub", "Delivery Center", "Airport Hub", "Customs Facility"]
+
+
+def _facility(rng: random.Random, city: str) -> str:
+    return f"{city} {rng.choice(FACILITY_KINDS)}"
+
+
+def generate_parcel(index: int, rng: random.Random, now: datetime, days: int = 30) -> Dict[str, Any]:
+    """One parcel in the models/parcel.Parcel shape, with timestamps as ISO strings."""
+    carrier, tracking_template = rng.choices(_CARRIER_CHOICES, cum_weights=_CARRIER_WEIGHTS)[0]
+    status = rng.choices(_STATUS_CHOICES, cum_weights=_STATUS_WEIGHTS)[0]
+    city, state, country, code, latitude, longitude = rng.choice(CITIES)
+    origin = rng.choice(CITIES)[0]
+    parcel_id = f"PKG{index:07d}{code}"
+
+    # Recent updates are more common; delivered/lost parcels stopped moving a while ago
+    last_update = now - timedelta(minutes=int(rng.expovariate(1 / (days * 24 * 60 / 6))) % (days * 24 * 60))
+    if status == "in_transit":
+        estimated_arrival = last_update + timedelta(hours=rng.randint(-24, 96))
+        previous_facility, next_facility = _facility(rng, origin), _facility(rng, city)
+    elif status == "pending":
+        estimated_arrival = last_update + timedelta(days=rng.randint(2, 10))
+        previous_facility, next_facility = None, _facility(rng, origin)
+    elif status == "delivered":
+        estimated_arrival = last_update + timedelta(hours=rng.randint(-48, 12))
+        previous_facility, next_facility = _facility(rng, origin), None
+    else:
+        estimated_arrival = None if status == "lost" else last_update + timedelta(days=rng.randint(1, 5))
+        previous_facility, next_facility = _facility(rng, origin), None
+
+    return {
+        "parcel_id": parcel_id,
+        "status": status,
+        "last_update": last_update.isoformat(),
+        "location": {
+            "latitude": round(latitude + rng.uniform(-0.15, 0.15), 5),
+            "longitude": round(longitude + rng.uniform(-0.15, 0.15), 5),
+            "city": city,
+            "state": state,
+            "country": country,
+            "facility": "Unknown" if status == "lost" else _facility(rng, city),
+        },
+        "movement": {
+            "previous_facility": previous_facility,
+            "next_facility": next_facility,
+            "estimated_arrival": estimated_arrival.isoformat() if estimated_arrival else None,
+        },
+        "carrier": carrier,
+        "tracking_url": tracking_template.format(parcel_id=parcel_id),
+        # Drawn last so the other fields stay the same as before merchants existed
+        "merchant_id": rng.choices(_MERCHANT_CHOICES, cum_weights=_MERCHANT_WEIGHTS)[0],
+    }
+
+
+def generate_parcels(count: int, seed: int = 42, now: Optional[datetime] = None,
+                     start_index: int = 0, days: int = 30) -> Iterator[Dict[str, Any]]:
+    """Lazily yields `count` parcels; memory use does not grow with count."""
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    for index in range(start_index, start_index + count):
+        yield generate_parcel(index, rng, now, days)
+
+
+def write_ndjson(records: Iterator[Dict[str, Any]], handle) -> int:
+    written = 0
+    for record in records:
+        handle.write(json.dumps(record, separators=(",", ":")))
+        handle.write("\n")
+        written += 1
+    return written
+
+
+async def ingest_generated(records: Iterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """Creates the tables if needed and upserts the records through the bulk ingest path."""
+    from config.db import dispose_async_engine
+    from utils.ingest_db import ingest_parcels
+    from utils.schema import create_schema
+
+    await create_schema()
+    try:
+        return await ingest_parcels(records)
+    finally:
+        await dispose_async_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--now", type=datetime.fromisoformat, help="reference time (naive UTC); defaults to the current hour")
+    parser.add_argument("--start-index", type=int, default=0, help="first parcel number, to extend an existing population")
+    parser.add_argument("--days", type=int, default=30, help="spread of last_update timestamps")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--out", help="NDJSON file to write, '-' for stdout")
+    target.add_argument("--db", action="store_true", help="upsert straight into DATABASE_URL")
+    args = parser.parse_args()
+
+    records = generate_parcels(args.count, args.seed, args.now, args.start_index, args.days)
+    if args.db:
+        print(asyncio.run(ingest_generated(records)), file=sys.stderr)
+    elif args.out == "-":
+        write_ndjson(records, sys.stdout)
+    else:
+        with open(args.out, "w", encoding="utf-8") as handle:
+            print(f"Wrote {write_ndjson(records, handle)} parcels to {args.out}", file=sys.stderr)
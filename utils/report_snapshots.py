@@ -0,0 +1,47 @@
+import datetime
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.cache import build_cache
+
+# Per-context record of what the last reply told the client: {parcel key: [last_update, status]}.
+# Delta reports compare the fresh rows against it and only report the parcels that moved.
+# Stored in the regular cache backend (JSON values), so "sqlite" shares it between workers.
+
+DELTA_REPORTS = os.getenv("OMI_DELTA_REPORTS", "false").lower() in ("1", "true", "yes")
+SNAPSHOT_STORE_SIZE = int(os.getenv("OMI_SNAPSHOT_STORE_SIZE", "10000"))
+# A context that has not polled for this long starts over with a full report
+SNAPSHOT_TTL = float(os.getenv("OMI_SNAPSHOT_TTL", "86400"))
+
+snapshot_store = build_cache("snapshot", SNAPSHOT_STORE_SIZE, SNAPSHOT_TTL)
+
+Snapshot = Dict[str, List[Optional[str]]]
+
+
+def _state(row: Dict[str, Any]) -> List[Optional[str]]:
+    last_update = row.get("last_update")
+    if isinstance(last_update, datetime.datetime):
+        last_update = last_update.isoformat()
+    return [last_update, row.get("status")]
+
+
+def changed_rows(context_id: str, db_result: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Snapshot]:
+    """
+    Returns (rows whose last_update or status differs from the context's snapshot, the
+    snapshot to save once the reply has been produced). Parcels the context has not seen
+    before count as changed.
+    """
+    previous: Snapshot = snapshot_store.get(context_id) or {}
+    snapshot = dict(previous)
+    changed = []
+    for row in db_result:
+        key = row["parcel_id"].casefold()
+        state = _state(row)
+        if previous.get(key) != state:
+            changed.append(row)
+        snapshot[key] = state
+    return changed, snapshot
+
+
+def save_snapshot(context_id: str, snapshot: Snapshot) -> None:
+    snapshot_store.set(context_id, snapshot)
@@ -1,37 +1,134 @@
-from sqlalchemy import select
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from sqlalchemy import and_, or_, select
+from config.db import get_async_engine
 from models.db_model import Parcel
-from typing import Any, List, Dict, Optional
-
-
-async def retrieve_parcel_meta_by_id(
-    parcel_list: List[Dict[str, Any]], db_session: Any
-) -> List[Dict[str, Optional[str]]]:
-    """Retrives parcel metadata for a list of parcel dictionaries using a single query"""
-    parcels_ids = [
-        item.get("parcel_id").strip()
-        for item in parcel_list
-        if item and item.get("parcel_id")
-    ]
+from utils.metrics import db_pool_wait
+from typing import Any, AsyncIterator, List, Dict, Optional
+
+# Lookups select only the report columns as plain mappings (no ORM identity map), split
+# the de-duplicated IDs into bounded IN lists and run those concurrently on pooled connections.
+IN_CHUNK_SIZE = int(os.getenv("OMI_DB_IN_CHUNK_SIZE", "500"))
+QUERY_CONCURRENCY = int(os.getenv("OMI_DB_QUERY_CONCURRENCY", "4"))
+# Rows per keyset page of an account-wide (merchant) query
+ACCOUNT_PAGE_SIZE = int(os.getenv("OMI_ACCOUNT_PAGE_SIZE", "500"))
+
+PARCEL_COLUMNS = (
+    Parcel.parcel_id,
+    Parcel.status,
+    Parcel.last_update,
+    Parcel.location,
+    Parcel.movement,
+    Parcel.carrier,
+    Parcel.tracking_url,
+)
+
+_query_slots = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+
+def requested_parcel_ids(parcel_list: List[Dict[str, Any]]) -> List[str]:
+    """Stripped, de-duplicated parcel IDs in the order they were asked for."""
+    unique: Dict[str, str] = {}
+    for item in parcel_list:
+        parcel_id = (item.get("parcel_id") or "").strip() if item else ""
+        if parcel_id:
+            unique.setdefault(parcel_id.casefold(), parcel_id)
+    return list(unique.values())
+
+
+def _chunks(parcel_ids: List[str], size: int) -> List[List[str]]:
+    return [parcel_ids[start:start + size] for start in range(0, len(parcel_ids), size)]
+
+
+def _in_request_order(parcel_ids: List[str], rows: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    ordered = []
+    for parcel_id in parcel_ids:
+        row = rows.get(parcel_id.casefold())
+        if row is not None:
+            ordered.append(row)
+    return ordered
+
+
+@asynccontextmanager
+async def pooled_connection():
+    """Checks a connection out of the pool just for one query, timing the wait."""
+    with db_pool_wait.time():
+        conn = await get_async_engine().connect()
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+
+async def _select_chunk(conn, parcel_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    result = await conn.execute(select(*PARCEL_COLUMNS).where(Parcel.parcel_id.in_(parcel_ids)))
+    return {row["parcel_id"].casefold(): dict(row) for row in result.mappings()}
+
+
+async def _select_chunk_pooled(parcel_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    async with _query_slots:
+        async with pooled_connection() as conn:
+            return await _select_chunk(conn, parcel_ids)
+
+
+async def retrieve_parcel_meta_by_id(parcel_list: List[Dict[str, Any]]) -> List[Dict[str, Optional[str]]]:
+    """
+    Retrives parcel metadata for a list of parcel dictionaries, in request order.
+    Each chunk borrows its own pooled connection, at most QUERY_CONCURRENCY at a time.
+    """
+    parcels_ids = requested_parcel_ids(parcel_list)
     if not parcels_ids:
         return []
 
-    selection = select(Parcel).where(Parcel.parcel_id.in_(parcels_ids))
-
-    parcel_payload = await db_session.execute(selection)
-    parcel_objects = parcel_payload.scalars().all()
-
-    results = []
-    for parcel in parcel_objects:
-        results.append(
-            {
-                "parcel_id": parcel.parcel_id,
-                "status": parcel.status,
-                "last_update": parcel.last_update,
-                "location": parcel.location,
-                "movement": parcel.movement,
-                "carrier": parcel.carrier,
-                "tracking_url": parcel.tracking_url,
-            }
-        )
-    print("From DB with LOVE: ", results)
+    rows: Dict[str, Dict[str, Any]] = {}
+    chunks = _chunks(parcels_ids, IN_CHUNK_SIZE)
+    for chunk_rows in await asyncio.gather(*(_select_chunk_pooled(chunk) for chunk in chunks)):
+        rows.update(chunk_rows)
+
+    results = _in_request_order(parcels_ids, rows)
+    logging.debug("Retrieved %d parcel row(s) from the database in %d chunk(s)", len(results), len(chunks))
     return results
+
+
+async def iter_merchant_parcels(
+    merchant_id: str,
+    statuses: List[str],
+    arrival_before: Optional[datetime] = None,
+    page_size: int = ACCOUNT_PAGE_SIZE,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Yields a merchant's parcels in the given statuses one page at a time, oldest update
+    first within each status, optionally only those whose estimated_arrival is before
+    arrival_before (overdue). Pages are keyset-paginated on (last_update, parcel_id), so
+    every page is an index range scan on (merchant_id, status, last_update) no matter how
+    deep it is, and each page holds a pooled connection only while it is read.
+    """
+    for status in statuses:
+        conditions = [Parcel.merchant_id == merchant_id, Parcel.status == status]
+        if arrival_before is not None:
+            conditions.append(Parcel.estimated_arrival < arrival_before)
+        after = None
+        while True:
+            page_conditions = list(conditions)
+            if after is not None:
+                last_update, parcel_id = after
+                page_conditions.append(or_(
+                    Parcel.last_update > last_update,
+                    and_(Parcel.last_update == last_update, Parcel.parcel_id > parcel_id),
+                ))
+            async with pooled_connection() as conn:
+                result = await conn.execute(
+                    select(*PARCEL_COLUMNS)
+                    .where(*page_conditions)
+                    .order_by(Parcel.last_update, Parcel.parcel_id)
+                    .limit(page_size)
+                )
+                page = [dict(row) for row in result.mappings()]
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+            after = (page[-1]["last_update"], page[-1]["parcel_id"])
@@ -0,0 +1,140 @@
+"""
+Schema bookkeeping. Startup no longer runs Base.metadata.create_all, which inspects every
+table on every boot; it reads the schema_version table once and refuses to serve a
+database older than this code. Tables are created, and new revisions recorded, out of band:
+
+    python -m utils.schema --create    # create missing tables and stamp SCHEMA_VERSION
+    python -m utils.schema --stamp     # record SCHEMA_VERSION on a database migrated by hand
+
+OMI_SCHEMA_MODE picks what startup does: "check" (default), "create" (the old create_all
+behaviour, plus the stamp) or "off".
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import func, insert, inspect, select
+from sqlalchemy.exc import DBAPIError
+
+from config.db import Base, dispose_async_engine, get_async_engine
+from models.db_model import SchemaVersion
+
+# Bump together with any change to models/db_model.py that needs a migration
+SCHEMA_VERSION = 1
+SCHEMA_MODE = os.getenv("OMI_SCHEMA_MODE", "check").lower()
+
+
+class SchemaVersionError(Exception):
+    """The database has not been created, or is older than SCHEMA_VERSION."""
+
+
+async def current_version() -> Optional[int]:
+    """Highest applied version, or None when the schema_version table is missing or empty."""
+    # Connection errors surface from connect(); only a failing query means "no table"
+    async with get_async_engine().connect() as conn:
+        try:
+            return (await conn.execute(select(func.max(SchemaVersion.version)))).scalar()
+        except DBAPIError:
+            return None
+
+
+async def check_schema() -> int:
+    """Verifies the database is at SCHEMA_VERSION or newer with a single query."""
+    version = await current_version()
+    if version is None:
+        raise SchemaVersionError(
+            "Database schema is not stamped; run `python -m utils.schema --create` "
+            "(or start once with OMI_SCHEMA_MODE=create)"
+        )
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionError(f"Database schema is at version {version}, this build needs {SCHEMA_VERSION}")
+    if version > SCHEMA_VERSION:
+        # Expected while a rolling deploy still runs the previous build
+        logging.warning(f"Database schema version {version} is newer than this build ({SCHEMA_VERSION})")
+    return version
+
+
+def _missing_objects(sync_conn) -> List[str]:
+    """Tables, columns and indexes of the models that the database lacks."""
+    inspector = inspect(sync_conn)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in columns]
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing += [f"{table.name}.{index.name}" for index in table.indexes if index.name not in indexes]
+    return missing
+
+
+async def _stamp(conn) -> None:
+    # create_all never alters an existing table, so a database from before the newer
+    # parcels columns would otherwise be stamped current and fail at query time
+    missing = await conn.run_sync(_missing_objects)
+    if missing:
+        raise SchemaVersionError(
+            f"Database schema predates this build, missing: {', '.join(missing)}. Apply the "
+            "ALTER statements from the README, then run `python -m utils.schema --stamp`"
+        )
+    applied = (await conn.execute(
+        select(SchemaVersion.version).where(SchemaVersion.version == SCHEMA_VERSION)
+    )).scalar()
+    if applied is None:
+        await conn.execute(insert(SchemaVersion).values(
+            version=SCHEMA_VERSION,
+            applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        ))
+
+
+async def create_schema(drop: bool = False) -> None:
+    """
+    Creates any missing tables (dropping them first if asked) and stamps SCHEMA_VERSION,
+    refusing to stamp when an existing table lacks columns or indexes of the models.
+    """
+    async with get_async_engine().begin() as conn:
+        if drop:
+            await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await _stamp(conn)
+    logging.info(f"Database schema created at version {SCHEMA_VERSION}")
+
+
+async def stamp_schema() -> None:
+    """Records SCHEMA_VERSION without touching the tables, after a manual migration (verified first)."""
+    async with get_async_engine().begin() as conn:
+        await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+        await _stamp(conn)
+
+
+async def ensure_schema() -> Optional[int]:
+    """Startup hook, driven by OMI_SCHEMA_MODE; returns the version found or created."""
+    if SCHEMA_MODE == "off":
+        return None
+    if SCHEMA_MODE == "create":
+        await create_schema()
+        return SCHEMA_VERSION
+    return await check_schema()
+
+
+async def _main(args) -> None:
+    try:
+        if args.create:
+            await create_schema()
+        elif args.stamp:
+            await stamp_schema()
+        print(f"schema version: {await current_version()} (this build: {SCHEMA_VERSION})")
+    finally:
+        await dispose_async_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--create", action="store_true", help="create missing tables and stamp the current version")
+    group.add_argument("--stamp", action="store_true", help="only record the current version")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from utils.metrics import register_collector
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one in-flight task.
+
+    Every waiter receives the leader's result or exception. A cancelled waiter only
+    stops waiting; the shared task is cancelled once its last waiter has gone.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executions = 0
+        self.shared = 0
+        self._inflight: Dict[str, _Call] = {}
+
+    def _forget(self, key: str, call: _Call, _task: asyncio.Task) -> None:
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._inflight.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda task, key=key, call=call: self._forget(key, call, task))
+            self._inflight[key] = call
+            self.executions += 1
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Nobody else is waiting: stop the upstream work and let the next caller start fresh
+                self._forget(key, call, call.task)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"executions": self.executions, "shared": self.shared, "in_flight": len(self._inflight)}
+
+
+flights: Dict[str, SingleFlight] = {}
+
+
+def build_single_flight(name: str) -> SingleFlight:
+    """Creates (and registers) a named single-flight group."""
+    flight = SingleFlight(name)
+    flights[name] = flight
+    return flight
+
+
+register_collector(
+    "omi_single_flight_calls_total",
+    "Single-flight calls by group and outcome (executed upstream or shared an in-flight call).",
+    "counter",
+    lambda: [
+        ("", {"group": name, "outcome": outcome}, flight.stats()[field])
+        for name, flight in flights.items()
+        for outcome, field in (("executed", "executions"), ("shared", "shared"))
+    ],
+)